@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+from openai import APITimeoutError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITER_SETTINGS = {
+    "min_limit": 1,
+    "max_limit": 64,
+    "initial_limit": 8,
+    "additive_increase": 1.0,
+    "multiplicative_decrease": 0.5,
+    "latency_tolerance": 2.0,
+    "decrease_cooldown": 1.0,
+}
+
+# 限流状态后端：endpoint -> 状态字典。默认为进程内的普通dict，
+# 多进程运行时由 install_shared_backend 替换为 multiprocessing.Manager 的代理对象
+_backend_state = {}
+_backend_condition = threading.Condition()
+_limiter_settings: Dict = dict(DEFAULT_LIMITER_SETTINGS)
+_limiters: Dict[str, "AIMDLimiter"] = {}
+_limiters_lock = threading.Lock()
+
+# 异步等待时队首的等待者查询共享状态的间隔，用于发现其他进程释放的名额（本进程的释放会直接唤醒）
+ASYNC_POLL_MIN = 0.01
+ASYNC_POLL_MAX = 0.2
+
+
+def is_overload_error(error: Exception) -> bool:
+    """判断异常是否表示服务端过载（429、5xx或超时）"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return isinstance(error, APITimeoutError)
+
+
+class AIMDLimiter:
+    """按endpoint的自适应并发限流器（加性增、乘性减）
+
+    每次请求成功且延迟健康时窗口加性增长（约每个窗口+additive_increase），
+    遇到429/5xx/超时时窗口乘性缩小。状态保存在共享后端中，
+    因此同一进程的所有玩家、以及安装了共享后端的所有进程共用同一个窗口。
+
+    异步等待者在进程内按先后排队，本进程释放名额时直接唤醒队首；只有队首会去查询共享状态，
+    使共享后端为Manager代理时，排队的请求再多也只有一个在做跨进程往返。
+    """
+
+    def __init__(self, endpoint: str, state, condition,
+                 min_limit: int = 1,
+                 max_limit: int = 64,
+                 initial_limit: int = 8,
+                 additive_increase: float = 1.0,
+                 multiplicative_decrease: float = 0.5,
+                 latency_tolerance: float = 2.0,
+                 decrease_cooldown: float = 1.0):
+        """
+        Args:
+            endpoint: 被限流的endpoint（base_url）
+            state: 共享状态字典
+            condition: 保护共享状态的条件变量
+            min_limit/max_limit/initial_limit: 并发窗口的下限、上限和初始值
+            additive_increase: 每个窗口的加性增量
+            multiplicative_decrease: 过载时窗口的缩小系数
+            latency_tolerance: 延迟超过基线的该倍数时视为不健康，窗口停止增长
+            decrease_cooldown: 两次缩小之间的最短间隔（秒），避免同一波错误反复缩小
+        """
+        self.endpoint = endpoint
+        self._state = state
+        self._condition = condition
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.initial_limit = max(min_limit, min(initial_limit, max_limit))
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.latency_tolerance = latency_tolerance
+        self.decrease_cooldown = decrease_cooldown
+        # 进程内的异步等待者：[事件循环, 唤醒用的future]
+        self._waiters: Deque[List] = deque()
+        self._waiters_lock = threading.Lock()
+
+    def _load(self) -> Dict:
+        """读取状态，调用方需持有条件变量"""
+        state = self._state.get(self.endpoint)
+        if state is None:
+            state = {"limit": float(self.initial_limit), "inflight": 0, "baseline_latency": None, "last_decrease": 0.0}
+        return state
+
+    def _store(self, state: Dict) -> None:
+        # 共享后端为Manager代理时，嵌套字典需整体写回
+        self._state[self.endpoint] = state
+
+    @property
+    def limit(self) -> int:
+        with self._condition:
+            return math.floor(self._load()["limit"])
+
+    @property
+    def inflight(self) -> int:
+        with self._condition:
+            return self._load()["inflight"]
+
+    def try_acquire(self) -> bool:
+        """尝试占用一个并发名额，不阻塞"""
+        with self._condition:
+            state = self._load()
+            if state["inflight"] >= math.floor(state["limit"]):
+                return False
+            state["inflight"] += 1
+            self._store(state)
+            return True
+
+    def acquire(self) -> None:
+        """阻塞直到获得一个并发名额"""
+        with self._condition:
+            while True:
+                state = self._load()
+                if state["inflight"] < math.floor(state["limit"]):
+                    state["inflight"] += 1
+                    self._store(state)
+                    return
+                # 跨进程时通知可能丢失，因此定时醒来重新检查
+                self._condition.wait(timeout=0.5)
+
+    async def aacquire(self) -> None:
+        """异步等待并发名额，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        waiter = [loop, loop.create_future()]
+        with self._waiters_lock:
+            self._waiters.append(waiter)
+            first = self._waiters[0] is waiter
+        try:
+            delay = ASYNC_POLL_MIN
+            while True:
+                woken = waiter[1].done()
+                if first or woken:
+                    if self.try_acquire():
+                        return
+                if woken:
+                    waiter[1] = loop.create_future()
+                    delay = ASYNC_POLL_MIN
+                # 队首定时查询共享状态（其他进程释放名额时不会唤醒本进程），其余等待者只等本进程的唤醒
+                done, _ = await asyncio.wait({waiter[1]}, timeout=delay if first else None)
+                if not done:
+                    delay = min(delay * 2, ASYNC_POLL_MAX)
+                with self._waiters_lock:
+                    first = self._waiters[0] is waiter
+        finally:
+            with self._waiters_lock:
+                self._waiters.remove(waiter)
+            # 窗口可能不止空出一个名额，让下一个等待者也试一次
+            self._wake_next()
+
+    def _wake_next(self) -> None:
+        """唤醒进程内排在最前的异步等待者"""
+        with self._waiters_lock:
+            if not self._waiters:
+                return
+            loop, future = self._waiters[0]
+
+        def wake():
+            if not future.done():
+                future.set_result(None)
+
+        try:
+            loop.call_soon_threadsafe(wake)
+        except RuntimeError:
+            # 等待者所在的事件循环已经关闭
+            pass
+
+    def release(self, latency: float, overloaded: bool = False) -> None:
+        """释放名额并根据本次请求的结果调整窗口
+
+        Args:
+            latency: 本次请求耗时（秒）
+            overloaded: 本次请求是否遇到过载信号（429/5xx/超时）
+        """
+        with self._condition:
+            state = self._load()
+            state["inflight"] = max(0, state["inflight"] - 1)
+            limit = state["limit"]
+
+            if overloaded:
+                now = time.monotonic()
+                if now - state["last_decrease"] >= self.decrease_cooldown:
+                    state["limit"] = max(float(self.min_limit), limit * self.multiplicative_decrease)
+                    state["last_decrease"] = now
+                    logger.warning(f"{self.endpoint} 出现过载信号，并发窗口 {limit:.1f} -> {state['limit']:.1f}")
+            else:
+                baseline = state["baseline_latency"]
+                if baseline is None or latency < baseline:
+                    baseline = latency
+                else:
+                    # 基线缓慢跟随实际延迟，避免负载变化后一直停留在历史最低值
+                    baseline += (latency - baseline) * 0.01
+                state["baseline_latency"] = baseline
+                if latency <= baseline * self.latency_tolerance:
+                    state["limit"] = min(float(self.max_limit), limit + self.additive_increase / max(limit, 1.0))
+
+            self._store(state)
+            self._condition.notify_all()
+        self._wake_next()
+
+
+def install_shared_backend(state, condition, settings: Optional[Dict] = None) -> None:
+    """安装跨进程共享的限流状态，通常作为进程池的initializer调用
+
+    Args:
+        state: multiprocessing.Manager().dict()
+        condition: multiprocessing.Manager().Condition()
+        settings: 限流参数，覆盖 DEFAULT_LIMITER_SETTINGS
+    """
+    global _backend_state, _backend_condition
+    with _limiters_lock:
+        _backend_state = state
+        _backend_condition = condition
+        _limiters.clear()
+    if settings:
+        configure_limiters(**settings)
+
+
+def configure_limiters(**settings) -> None:
+    """修改之后创建的限流器的默认参数"""
+    unknown = set(settings) - set(DEFAULT_LIMITER_SETTINGS)
+    if unknown:
+        raise ValueError(f"未知的限流参数: {', '.join(sorted(unknown))}")
+    with _limiters_lock:
+        _limiter_settings.update(settings)
+        _limiters.clear()
+
+
+def get_limiter(endpoint: str) -> AIMDLimiter:
+    """获取endpoint对应的限流器"""
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            limiter = AIMDLimiter(endpoint, _backend_state, _backend_condition, **_limiter_settings)
+            _limiters[endpoint] = limiter
+        return limiter
@@ -0,0 +1,96 @@
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 每轮对话的默认token预算，超过后把历史压缩为一条完整的轮次情况
+DEFAULT_CONVERSATION_TOKEN_BUDGET = 8000
+
+
+class RoundConversation:
+    """一名玩家在一轮游戏中与LLM的多轮对话
+
+    每次决策只发送与上一次相比新增的操作记录（通过前缀比较得到），历史消息保持不变，
+    配合服务端前缀缓存使每轮的prefill从 O(操作数²) 降为约 O(操作数)。
+    进入新的一轮、操作记录不再是上次的延续，或历史超过token预算时，重新以一条完整的轮次情况开始。
+    """
+
+    def __init__(self, token_budget: int = DEFAULT_CONVERSATION_TOKEN_BUDGET,
+                 count_tokens: Callable[[str], int] = estimate_tokens):
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+        self._lock = threading.Lock()
+        self._round_base_info: Optional[str] = None
+        self._sent_actions = ""
+        self._history: List[Dict[str, str]] = []
+        self._history_tokens = 0
+
+    def prepare(self, system_prompt: str, round_base_info: str, round_action_info: str,
+                render: Callable[[str], str]) -> List[Dict[str, str]]:
+        """
+        构造本次请求的消息，不修改对话状态（并发的反思请求可以各自从同一段历史分叉）
+
+        Args:
+            system_prompt: 固定的system消息
+            round_base_info: 轮次基础信息
+            round_action_info: 截至目前的完整操作记录
+            render: 用本次的轮次情况（完整或增量）填充user消息
+
+        Returns:
+            List[Dict[str, str]]: system消息 + 历史 + 本次的user消息
+        """
+        with self._lock:
+            history = self._history
+            history_tokens = self._history_tokens
+            sent_actions = self._sent_actions
+            same_round = round_base_info == self._round_base_info and round_action_info.startswith(sent_actions)
+
+        if same_round and history and history_tokens > self.token_budget:
+            logger.info(f"对话历史约 {history_tokens} tokens，超过预算 {self.token_budget}，压缩为完整的轮次情况")
+            same_round = False
+        if not same_round or not history:
+            history = []
+            context = f"以下是当前这局游戏的情况：\n{round_base_info}\n{round_action_info}".rstrip("\n")
+        else:
+            new_actions = round_action_info[len(sent_actions):].strip("\n")
+            context = f"此后的操作：\n{new_actions}" if new_actions else "此后没有新的操作。"
+
+        return [{"role": "system", "content": system_prompt}] + list(history) + [
+            {"role": "user", "content": render(context)}
+        ]
+
+    def commit(self, messages: List[Dict[str, str]], reply: str, round_base_info: str, round_action_info: str) -> None:
+        """决策成功后把本次的user消息和回复追加到历史"""
+        history = messages[1:] + [{"role": "assistant", "content": reply}]
+        with self._lock:
+            self._history = history
+            self._history_tokens = sum(self.count_tokens(message["content"]) for message in history)
+            self._round_base_info = round_base_info
+            self._sent_actions = round_action_info
+
+    def checkpoint_state(self) -> Dict:
+        """检查点中保存的对话状态"""
+        with self._lock:
+            return {
+                "round_base_info": self._round_base_info,
+                "sent_actions": self._sent_actions,
+                "history": [dict(message) for message in self._history],
+            }
+
+    def restore_state(self, state: Dict) -> None:
+        """从检查点恢复对话状态"""
+        history = [dict(message) for message in state.get("history", [])]
+        with self._lock:
+            self._round_base_info = state.get("round_base_info")
+            self._sent_actions = state.get("sent_actions", "")
+            self._history = history
+            self._history_tokens = sum(self.count_tokens(message["content"]) for message in history)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._round_base_info = None
+            self._sent_actions = ""
+            self._history = []
+            self._history_tokens = 0
@@ -0,0 +1,186 @@
+import json
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+PLAY_DECISION_KEYS = ("played_cards", "behavior", "play_reason")
+CHALLENGE_DECISION_KEYS = ("was_challenged", "challenge_reason")
+
+_TRUE_STRINGS = {"true", "yes", "是", "质疑"}
+_FALSE_STRINGS = {"false", "no", "否", "不质疑"}
+
+
+def play_decision_response_format(hand: Sequence[str]) -> Dict:
+    """出牌决策的 response_format，played_cards 只允许出现手牌中的牌面"""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "play_decision",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "played_cards": {
+                        "type": "array",
+                        "items": {"type": "string", "enum": sorted(set(hand))},
+                        "minItems": 1,
+                        "maxItems": 3
+                    },
+                    "behavior": {"type": "string"},
+                    "play_reason": {"type": "string"}
+                },
+                "required": list(PLAY_DECISION_KEYS),
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+def challenge_decision_response_format() -> Dict:
+    """质疑决策的 response_format"""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "challenge_decision",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "was_challenged": {"type": "boolean"},
+                    "challenge_reason": {"type": "string"}
+                },
+                "required": list(CHALLENGE_DECISION_KEYS),
+                "additionalProperties": False
+            }
+        }
+    }
+
+
+def iter_json_objects(text: str) -> Iterator[Tuple[int, Dict]]:
+    """按出现顺序逐个扫描文本中完整且合法的顶层json对象
+
+    扫描时跟踪括号深度并跳过字符串中的括号；某个候选片段无法解析时，
+    从其内部的下一个 '{' 继续尝试。
+
+    Yields:
+        (结束位置, 对象)
+    """
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_string = False
+        escaped = False
+        end = -1
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    end = i + 1
+                    break
+        if end == -1:
+            # 对象尚未闭合（例如流式输出还没结束）
+            return
+        try:
+            obj, _ = decoder.raw_decode(text[start:end])
+        except ValueError:
+            start = text.find("{", start + 1)
+            continue
+        if isinstance(obj, dict):
+            yield end, obj
+        start = text.find("{", end)
+
+
+def extract_last_json_object(text: str, required_keys: Sequence[str] = ()) -> Optional[Dict]:
+    """提取文本中最后一个合法的、包含全部 required_keys 的json对象"""
+    result = None
+    for _, obj in iter_json_objects(text or ""):
+        if all(key in obj for key in required_keys):
+            result = obj
+    return result
+
+
+def repair_play_decision(result: Dict, hand: Sequence[str]) -> Tuple[Optional[Dict], bool]:
+    """校验并尽量修复出牌决策，而不是直接重新请求
+
+    修复内容：played_cards 为字符串时拆分为列表；剔除不在手牌中的牌（按张数计）；
+    超过3张时只保留前3张；behavior/play_reason 缺失时补为空字符串。
+
+    Returns:
+        (修复后的决策, 是否进行了修复)；无法修复时决策为None
+    """
+    if "played_cards" not in result:
+        return None, False
+
+    repaired = False
+    played_cards = result["played_cards"]
+    if isinstance(played_cards, str):
+        played_cards = [card.strip() for card in played_cards.replace("，", ",").split(",") if card.strip()]
+        repaired = True
+    elif not isinstance(played_cards, list):
+        played_cards = [played_cards]
+        repaired = True
+
+    remaining = list(hand)
+    legal_cards: List[str] = []
+    for card in played_cards:
+        card = str(card).strip()
+        if card in remaining:
+            remaining.remove(card)
+            legal_cards.append(card)
+        else:
+            repaired = True
+    if len(legal_cards) > 3:
+        legal_cards = legal_cards[:3]
+        repaired = True
+    if not legal_cards:
+        return None, False
+
+    decision = dict(result)
+    decision["played_cards"] = legal_cards
+    for key in ("behavior", "play_reason"):
+        if not isinstance(decision.get(key), str):
+            decision[key] = "" if decision.get(key) is None else str(decision[key])
+            repaired = True
+    return decision, repaired
+
+
+def repair_challenge_decision(result: Dict) -> Tuple[Optional[Dict], bool]:
+    """校验并尽量修复质疑决策
+
+    修复内容：was_challenged 为 "true"/"是" 等字符串时转换为布尔值；challenge_reason 缺失时补为空字符串。
+
+    Returns:
+        (修复后的决策, 是否进行了修复)；无法修复时决策为None
+    """
+    if "was_challenged" not in result:
+        return None, False
+
+    repaired = False
+    was_challenged = result["was_challenged"]
+    if not isinstance(was_challenged, bool):
+        normalized = str(was_challenged).strip().lower()
+        if normalized in _TRUE_STRINGS:
+            was_challenged = True
+        elif normalized in _FALSE_STRINGS:
+            was_challenged = False
+        else:
+            return None, False
+        repaired = True
+
+    decision = dict(result)
+    decision["was_challenged"] = was_challenged
+    if not isinstance(decision.get("challenge_reason"), str):
+        decision["challenge_reason"] = "" if decision.get("challenge_reason") is None else str(decision["challenge_reason"])
+        repaired = True
+    return decision, repaired
@@ -1,21 +1,47 @@
+import asyncio
+import copy
 import yaml
 import argparse
 import logging
 from rich.console import Console
 from rich.table import Table
 from rich.panel import Panel
-from typing import List, Dict
+from typing import Any, Awaitable, List, Dict
 from player import LLMPlayer, HumanPlayer
-from game_record import GameRecord
+from game_record import FSYNC_POLICIES, GameRecord, has_checkpoint
 from game_server import GameServer
 from player_client import PlayerClient
+from prompt_templates import registry as prompt_registry
+from llm_client import aclose_clients
+from llm_metrics import measure_calls, metrics
+from record_writer import BACKPRESSURE_POLICIES, configure_writer
 
 logger = logging.getLogger(__name__)
 console = Console()
 
+
+def run_sync(coro: Awaitable) -> Any:
+    """在新的事件循环中运行协程，结束前关闭该事件循环的异步连接池"""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await aclose_clients()
+    return asyncio.run(main())
+
 class Game:
-    def __init__(self, player_configs: List[Dict[str, str]]) -> None:
-        """初始化游戏"""
+    def __init__(self, player_configs: List[Dict[str, str]], reflection_concurrency: int = 8, record_fsync: str = "round",
+                 game_id: str = None, resume: bool = False, seed: int = None) -> None:
+        """初始化游戏
+
+        Args:
+            player_configs: 玩家配置列表
+            reflection_concurrency: 轮次结束时并发反思请求的上限
+            record_fsync: 游戏事件日志的fsync策略，见 FSYNC_POLICIES
+            game_id: 游戏ID，None表示自动生成
+            resume: 从game_id最近的检查点继续，玩家配置需与原来的游戏一致
+            seed: 随机种子，决定座位的子弹位置、每轮的牌组、目标牌和起始玩家，None表示不可复现
+        """
         players = []
         print(player_configs)
         for config in player_configs:
@@ -29,18 +55,37 @@ class Game:
             player.init_opinions(players)
 
         self.clients = [PlayerClient(p) for p in players]
-        self.game_record = GameRecord()
-        self.game_record.start_game([c.name for c in self.clients])
-        self.server = GameServer(players, self.game_record)
+        self.resumed = resume
+        if resume:
+            self.game_record, state = GameRecord.from_checkpoint(game_id, fsync=record_fsync)
+            if sorted(self.game_record.player_names) != sorted(c.name for c in self.clients):
+                raise ValueError(f"玩家配置与游戏 {game_id} 的玩家不一致: {', '.join(self.game_record.player_names)}")
+            self.server = GameServer(players, self.game_record, reflection_concurrency=reflection_concurrency,
+                                     seed=self.game_record.seed)
+            self.server.restore_state(state)
+            logger.info(f"从检查点继续游戏 {game_id}，第 {self.server.round_count} 轮")
+        else:
+            self.game_record = GameRecord(fsync=record_fsync, game_id=game_id)
+            self.game_record.start_game([c.name for c in self.clients], seed=seed)
+            self.server = GameServer(players, self.game_record, reflection_concurrency=reflection_concurrency, seed=seed)
+
+    def save_checkpoint(self) -> None:
+        """保存当前的对局状态，中断后可以用 resume 从这里继续"""
+        self.game_record.save_checkpoint(self.server.checkpoint_state())
 
     def handle_play_cards(self, current_player_client: PlayerClient, next_player_client: PlayerClient) -> List[str]:
+        return run_sync(self.ahandle_play_cards(current_player_client, next_player_client))
+
+    async def ahandle_play_cards(self, current_player_client: PlayerClient, next_player_client: PlayerClient) -> List[str]:
         round_base_info = self.game_record.get_latest_round_info()
-        round_action_info = self.game_record.get_latest_round_actions(current_player_client.name, include_latest=True)
+        round_action_info = self.game_record.get_latest_round_actions(current_player_client.name, include_latest=True, style=current_player_client.action_log_style)
         play_decision_info = self.game_record.get_play_decision_info(current_player_client.name, next_player_client.name)
 
-        play_result, reasoning = current_player_client.choose_cards_to_play(
-            round_base_info, round_action_info, play_decision_info
-        )
+        with measure_calls() as play_stats:
+            play_result, reasoning = await current_player_client.achoose_cards_to_play(
+                round_base_info, round_action_info, play_decision_info
+            )
+        play_stats["attempts"] = current_player_client.last_decision_attempts
 
         console.print(Panel(f"[cyan]{current_player_client.name}[/cyan] 打出了 [bold]{len(play_result['played_cards'])}[/bold] 张牌。", expand=False))
 
@@ -51,20 +96,26 @@ class Game:
             play_reason=play_result["play_reason"],
             behavior=play_result["behavior"],
             next_player=next_player_client.name,
-            play_thinking=reasoning
+            play_thinking=reasoning,
+            play_stats=play_stats
         )
         return play_result["played_cards"]
 
     def handle_challenge(self, current_player_client: PlayerClient, next_player_client: PlayerClient, played_cards: List[str]) -> PlayerClient:
+        return run_sync(self.ahandle_challenge(current_player_client, next_player_client, played_cards))
+
+    async def ahandle_challenge(self, current_player_client: PlayerClient, next_player_client: PlayerClient, played_cards: List[str]) -> PlayerClient:
         round_base_info = self.game_record.get_latest_round_info()
-        round_action_info = self.game_record.get_latest_round_actions(next_player_client.name, include_latest=False)
+        round_action_info = self.game_record.get_latest_round_actions(next_player_client.name, include_latest=False, style=next_player_client.action_log_style)
         challenge_decision_info = self.game_record.get_challenge_decision_info(next_player_client.name, current_player_client.name)
         challenging_player_behavior = self.game_record.get_latest_play_behavior()
         extra_hint = "注意：其他玩家手牌均已打空。" if self.server.check_other_players_no_cards(next_player_client.player) else ""
 
-        challenge_result, reasoning = next_player_client.decide_challenge(
-            round_base_info, round_action_info, challenge_decision_info, challenging_player_behavior, extra_hint
-        )
+        with measure_calls() as challenge_stats:
+            challenge_result, reasoning = await next_player_client.adecide_challenge(
+                round_base_info, round_action_info, challenge_decision_info, challenging_player_behavior, extra_hint
+            )
+        challenge_stats["attempts"] = next_player_client.last_decision_attempts
 
         if challenge_result["was_challenged"]:
             console.print(Panel(f"[bold yellow]{next_player_client.name} 决定质疑！[/bold yellow]\n理由: {challenge_result['challenge_reason']}", title="[red]质疑[/red]", expand=False))
@@ -73,7 +124,8 @@ class Game:
                 was_challenged=True,
                 reason=challenge_result["challenge_reason"],
                 result=not is_valid,
-                challenge_thinking=reasoning
+                challenge_thinking=reasoning,
+                challenge_stats=challenge_stats
             )
             return next_player_client if is_valid else current_player_client
         else:
@@ -82,11 +134,15 @@ class Game:
                 was_challenged=False,
                 reason=challenge_result["challenge_reason"],
                 result=None,
-                challenge_thinking=reasoning
+                challenge_thinking=reasoning,
+                challenge_stats=challenge_stats
             )
             return None
 
     def handle_system_challenge(self, current_player_client: PlayerClient) -> None:
+        run_sync(self.ahandle_system_challenge(current_player_client))
+
+    async def ahandle_system_challenge(self, current_player_client: PlayerClient) -> None:
         logger.info(f"系统自动质疑 {current_player_client.name} 的手牌！")
         all_cards = current_player_client.hand.copy()
         current_player_client.player.hand.clear()
@@ -112,16 +168,19 @@ class Game:
         if is_valid:
             logger.info(f"系统质疑失败！{current_player_client.name} 的手牌符合规则。")
             self.game_record.record_shooting(shooter_name="无", bullet_hit=False)
-            self.server.reset_round(record_shooter=False)
+            await self.server.areset_round(record_shooter=False)
         else:
             logger.warning(f"系统质疑成功！{current_player_client.name} 的手牌违规，将执行射击惩罚。")
-            self.server.perform_penalty(current_player_client.player)
+            await self.server.aperform_penalty(current_player_client.player)
 
     def play_round(self) -> None:
+        run_sync(self.aplay_round())
+
+    async def aplay_round(self) -> None:
         current_player_client = self.clients[self.server.current_player_idx]
 
         if self.server.check_other_players_no_cards(current_player_client.player):
-            self.handle_system_challenge(current_player_client)
+            await self.ahandle_system_challenge(current_player_client)
             return
 
         table = Table(title=f"第 {self.server.round_count} 轮 - {current_player_client.name} 的回合")
@@ -137,12 +196,12 @@ class Game:
         next_idx = self.server.find_next_player_with_cards(self.server.current_player_idx)
         next_player_client = self.clients[next_idx]
 
-        played_cards = self.handle_play_cards(current_player_client, next_player_client)
+        played_cards = await self.ahandle_play_cards(current_player_client, next_player_client)
 
         if next_player_client != current_player_client:
-            client_to_penalize = self.handle_challenge(current_player_client, next_player_client, played_cards)
+            client_to_penalize = await self.ahandle_challenge(current_player_client, next_player_client, played_cards)
             if client_to_penalize:
-                self.server.perform_penalty(client_to_penalize.player)
+                await self.server.aperform_penalty(client_to_penalize.player)
                 if self.server.game_over:
                     winner_name = self.game_record.winner
                     console.print(Panel(f"[bold green]{winner_name} 获胜！[/bold green]", title="游戏结束", expand=False))
@@ -153,15 +212,87 @@ class Game:
         self.server.current_player_idx = next_idx
 
     def start_game(self) -> None:
-        self.server.deal_cards()
-        self.server.choose_target_card()
-        self.server.start_round_record()
+        """在新的事件循环中运行整局游戏"""
+        run_sync(self.astart_game())
+
+    async def astart_game(self) -> None:
+        """运行整局游戏；多局游戏可以在同一个事件循环中并发运行"""
+        if not self.resumed:
+            self.server.deal_cards()
+            self.server.choose_target_card()
+            self.server.start_round_record()
         while not self.server.game_over:
-            self.play_round()
+            # 每次操作前保存检查点，操作失败时从这里继续
+            self.save_checkpoint()
+            await self.aplay_round()
         if self.server.game_over:
             winner_name = self.game_record.winner
             if winner_name:
                 console.print(Panel(f"[bold green]{winner_name} 获胜！[/bold green]", title="游戏结束", expand=False))
+        self.log_decision_stats()
+        # 记录由后台线程写入，游戏结束后等待写完（批量运行的工作进程退出时不会执行atexit）
+        await asyncio.to_thread(self.game_record.flush)
+
+    def log_decision_stats(self) -> None:
+        """记录每个玩家各类决策的请求、重试与修复次数"""
+        for client in self.clients:
+            decision_stats = getattr(client.player, "decision_stats", None)
+            if not decision_stats:
+                continue
+            for decision_type, stats in decision_stats.items():
+                logger.info(
+                    f"{client.name} {decision_type}决策统计: 决策 {stats['calls']} 次，请求 {stats['requests']} 次，"
+                    f"重试 {stats['retries']} 次，修复 {stats['repairs']} 次，失败 {stats['failures']} 次"
+                )
+
+class TableError(Exception):
+    """一局游戏运行失败，保留game_id以便从检查点继续"""
+
+    def __init__(self, game_id: str, error: Exception):
+        super().__init__(f"{type(error).__name__}: {error}")
+        self.game_id = game_id
+
+
+async def arun_tables(table_configs: List[List[Dict[str, str]]], max_concurrent_tables: int = 100,
+                      game_ids: List[str] = None, seeds: List[int] = None, **game_kwargs) -> List[Any]:
+    """
+    在当前事件循环中并发运行多局游戏
+
+    Args:
+        table_configs: 每局游戏的玩家配置列表
+        max_concurrent_tables: 同时进行的游戏局数上限
+        game_ids: 每局游戏的ID（元素可以为None表示自动生成），留有检查点的游戏从检查点继续
+        seeds: 每局游戏的随机种子（元素可以为None）
+        game_kwargs: 传给 Game 的其他参数
+
+    Returns:
+        List: 与table_configs顺序一致，成功的游戏为 Game 对象，失败的为 TableError
+    """
+    semaphore = asyncio.Semaphore(max_concurrent_tables)
+
+    async def run_table(player_configs: List[Dict[str, str]], game_id: str, seed: int) -> "Game":
+        async with semaphore:
+            try:
+                # Game 会修改配置字典（弹出type），每局使用独立的副本
+                game = Game(copy.deepcopy(player_configs), game_id=game_id,
+                            resume=game_id is not None and has_checkpoint(game_id), seed=seed, **game_kwargs)
+            except Exception as e:
+                raise TableError(game_id, e) from e
+            try:
+                await game.astart_game()
+            except Exception as e:
+                raise TableError(game.game_record.game_id, e) from e
+            return game
+
+    game_ids = game_ids or [None] * len(table_configs)
+    seeds = seeds or [None] * len(table_configs)
+    results = await asyncio.gather(*(run_table(configs, game_id, seed)
+                                     for configs, game_id, seed in zip(table_configs, game_ids, seeds)),
+                                   return_exceptions=True)
+    for index, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.error(f"第 {index + 1} 桌游戏失败: {result}")
+    return results
 
 def parse_arguments():
     """解析命令行参数"""
@@ -178,6 +309,68 @@ def parse_arguments():
         default='INFO',
         help='指定日志记录级别 (默认: INFO)'
     )
+    parser.add_argument(
+        '--reflection-concurrency',
+        type=int,
+        default=8,
+        help='轮次结束时并发反思请求的上限，1表示串行 (默认: 8)'
+    )
+    parser.add_argument(
+        '--record-fsync',
+        type=str,
+        default='round',
+        choices=FSYNC_POLICIES,
+        help='游戏事件日志的fsync策略：never 只flush，round 每轮结束时落盘，always 每个事件都落盘 (默认: round)'
+    )
+    parser.add_argument(
+        '--record-backpressure',
+        type=str,
+        default='block',
+        choices=BACKPRESSURE_POLICIES,
+        help='记录写入队列满时的处理策略：block 等待写入，drop 丢弃事件和检查点的写入并记录错误，有事件被丢弃的游戏不再保存检查点，记录标记为lossy (默认: block)'
+    )
+    parser.add_argument(
+        '--hot-reload-prompts',
+        action='store_true',
+        help='每次决策前检查prompt文件的修改时间，修改后自动重新加载 (默认: 只在启动时加载一次)'
+    )
+    parser.add_argument(
+        '--llm-cache',
+        type=str,
+        default=None,
+        help='启用LLM响应缓存并指定SQLite文件路径，重放相同对局时可直接命中缓存 (默认: 不启用)'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=None,
+        help='在该端口以Prometheus文本格式提供LLM调用指标 (/metrics) (默认: 不启用)'
+    )
+    parser.add_argument(
+        '--metrics-snapshot',
+        type=str,
+        default=None,
+        help='定期把LLM调用指标和调用记录写入该json文件 (默认: 不启用)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='随机种子，相同种子的游戏发牌、目标牌、子弹位置和起始玩家相同 (默认: 不固定)'
+    )
+    parser.add_argument(
+        '--resume',
+        type=str,
+        default=None,
+        metavar='GAME_ID',
+        help='从该游戏最近的检查点继续（game_records下的 {game_id}.checkpoint），玩家配置需与原来一致 (默认: 开始新游戏)'
+    )
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=30.0,
+        help='写入指标快照的间隔秒数 (默认: 30)'
+    )
     return parser.parse_args()
 
 def main():
@@ -191,9 +384,28 @@ def main():
     with open(args.config, 'r') as f:
         config = yaml.safe_load(f)
 
+    prompt_registry.hot_reload = args.hot_reload_prompts
+    if args.record_backpressure != 'block':
+        configure_writer(backpressure=args.record_backpressure)
+
+    if args.llm_cache:
+        for player_config in config['player']:
+            player_config.setdefault('cache_path', args.llm_cache)
+
+    if args.metrics_port is not None:
+        metrics.start_http_server(args.metrics_port)
+    stop_snapshot_writer = None
+    if args.metrics_snapshot:
+        stop_snapshot_writer = metrics.start_snapshot_writer(args.metrics_snapshot, args.metrics_interval, include_records=True)
+
     # 创建并开始游戏
-    game = Game(config['player'])
-    game.start_game()
+    game = Game(config['player'], reflection_concurrency=args.reflection_concurrency, record_fsync=args.record_fsync,
+                game_id=args.resume, resume=args.resume is not None, seed=args.seed)
+    try:
+        game.start_game()
+    finally:
+        if stop_snapshot_writer is not None:
+            stop_snapshot_writer()
 
 
 if __name__ == "__main__":
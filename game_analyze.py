@@ -1,7 +1,38 @@
 import os
 import json
+import math
 from collections import defaultdict, Counter
 
+# 反思模式 -> 决策类型
+REFLECTION_DECISION_TYPES = {'per_player': 'reflect', 'batch': 'reflect_all'}
+
+def percentile(values, q):
+    """线性插值的分位数，q取值0-100"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def add_decision_cost(stats, player, decision_type, decision_stats):
+    """记录一次决策的耗时、token数和请求次数"""
+    if not player or not decision_stats:
+        return
+    costs = stats['decision_costs'][player][decision_type]
+    if decision_stats.get('latency') is not None:
+        costs['latency'].append(decision_stats['latency'])
+    prompt_tokens = decision_stats.get('prompt_tokens')
+    completion_tokens = decision_stats.get('completion_tokens')
+    if prompt_tokens is not None or completion_tokens is not None:
+        costs['prompt_tokens'].append(prompt_tokens or 0)
+        costs['completion_tokens'].append(completion_tokens or 0)
+        costs['cached_tokens'].append(decision_stats.get('cached_tokens') or 0)
+    if decision_stats.get('attempts') is not None:
+        costs['attempts'].append(decision_stats['attempts'])
+    costs['llm_retries'].append(decision_stats.get('llm_retries') or 0)
+
 def analyze_game_records(folder_path):
     # 初始化统计数据结构
     stats = {
@@ -9,7 +40,9 @@ def analyze_game_records(folder_path):
         'shots_fired': Counter(),
         'survival_points': Counter(),
         'matchups': defaultdict(lambda: defaultdict(int)),  # A和B之间的对决次数记录
-        'win_counts': defaultdict(lambda: defaultdict(int))  # A对B的胜利次数
+        'win_counts': defaultdict(lambda: defaultdict(int)),  # A对B的胜利次数
+        # 玩家 -> 决策类型 -> 指标 -> 每次决策的取值
+        'decision_costs': defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
     }
     
     player_names = set()
@@ -55,6 +88,10 @@ def analyze_game_records(folder_path):
                     player = play.get('player_name')
                     next_player = play.get('next_player')
                     was_challenged = play.get('was_challenged')
+
+                    # 决策耗时与用量（旧记录中没有这些字段）
+                    add_decision_cost(stats, player, 'play', play.get('play_stats'))
+                    add_decision_cost(stats, next_player, 'challenge', play.get('challenge_stats'))
                     
                     if was_challenged and next_player:
                         challenge_result = play.get('challenge_result')
@@ -71,6 +108,10 @@ def analyze_game_records(folder_path):
                             stats['win_counts'][next_player][player] += 1
                         elif challenge_result is False:  # 挑战失败，player赢
                             stats['win_counts'][player][next_player] += 1
+
+                for reflection in round_data.get('reflections', []):
+                    decision_type = REFLECTION_DECISION_TYPES.get(reflection.get('reflection_mode'), 'reflect')
+                    add_decision_cost(stats, reflection.get('player_name'), decision_type, reflection.get('stats'))
             
             # 计算存活积分
             # 首先确定淘汰顺序
@@ -157,6 +198,46 @@ def print_statistics(stats, win_rates, game_count, player_names):
                     
                     print(f"{player} vs {opponent:<10} {matchups:<10} {wins:<10} {win_rate:.1f}%")
 
+    print_decision_costs(stats['decision_costs'])
+
+def format_seconds(value):
+    return f"{value:.2f}s" if value is not None else "-"
+
+def print_decision_costs(decision_costs):
+    """按玩家和决策类型输出决策耗时分位数和平均token数"""
+    if not decision_costs:
+        return
+
+    # 所有玩家合计
+    totals = defaultdict(lambda: defaultdict(list))
+    for player_costs in decision_costs.values():
+        for decision_type, costs in player_costs.items():
+            for metric, values in costs.items():
+                totals[decision_type][metric].extend(values)
+
+    print("\n决策耗时与token统计:")
+    print(f"{'玩家':<20} {'决策类型':<12} {'次数':<6} {'p50':<8} {'p95':<8} {'p99':<8} "
+          f"{'输入token/次':<12} {'输出token/次':<12} {'前缀缓存':<8} {'请求/次':<8} {'LLM重试':<8}")
+    print("-" * 120)
+    rows = [(player, decision_costs[player]) for player in sorted(decision_costs)] + [("全部", totals)]
+    for player, player_costs in rows:
+        for decision_type in sorted(player_costs):
+            costs = player_costs[decision_type]
+            latencies = costs['latency']
+            count = max(len(latencies), len(costs['llm_retries']))
+            prompt_tokens = costs['prompt_tokens']
+            completion_tokens = costs['completion_tokens']
+            attempts = costs['attempts']
+            avg_prompt = f"{sum(prompt_tokens) / len(prompt_tokens):.0f}" if prompt_tokens else "-"
+            avg_completion = f"{sum(completion_tokens) / len(completion_tokens):.0f}" if completion_tokens else "-"
+            # 服务端前缀缓存命中的prompt token占比
+            cached_ratio = f"{sum(costs['cached_tokens']) / sum(prompt_tokens) * 100:.0f}%" if sum(prompt_tokens) else "-"
+            avg_attempts = f"{sum(attempts) / len(attempts):.2f}" if attempts else "-"
+            print(f"{player:<20} {decision_type:<12} {count:<6} "
+                  f"{format_seconds(percentile(latencies, 50)):<8} {format_seconds(percentile(latencies, 95)):<8} "
+                  f"{format_seconds(percentile(latencies, 99)):<8} {avg_prompt:<12} {avg_completion:<12} "
+                  f"{cached_ratio:<8} {avg_attempts:<8} {sum(costs['llm_retries']):<8}")
+
 if __name__ == "__main__":
     folder_path = "game_records"  # 替换为实际的文件夹路径
     stats, win_rates, game_count, player_names = analyze_game_records(folder_path)
@@ -1,13 +1,41 @@
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import datetime
 import json
+import logging
 import os
+import time
+import uuid
+from record_writer import RecordWriter, get_writer
+
+logger = logging.getLogger(__name__)
+
+# 操作记录的格式：prose 逐条的自然语言描述；compact 每次操作一行的表格，token数约为prose的一半
+ACTION_LOG_STYLES = ("prose", "compact")
+# compact格式的表头，'?'表示未公开的牌
+COMPACT_ACTION_HEADER = "本轮操作（序号|出牌玩家|张数|实际出牌|剩余手牌|表现|下家|质疑），?表示未公开"
+
+# 事件日志的落盘策略：never 只flush不fsync；round 每轮结束和游戏结束时fsync；always 每个事件都fsync
+FSYNC_POLICIES = ("never", "round", "always")
+EVENT_LOG_SUFFIX = ".events.jsonl"
+# 不以.json结尾，避免被按 *.json 读取游戏记录的分析工具当作游戏记录
+CHECKPOINT_SUFFIX = ".checkpoint"
+# 之前版本写出的检查点，续跑时仍然可以读取
+LEGACY_CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+def find_checkpoint(game_id: str, save_directory: str = "game_records") -> Optional[str]:
+    """该游戏的检查点路径，没有时返回None"""
+    for suffix in (CHECKPOINT_SUFFIX, LEGACY_CHECKPOINT_SUFFIX):
+        path = os.path.join(save_directory, f"{game_id}{suffix}")
+        if os.path.exists(path):
+            return path
+    return None
+
 
 def generate_game_id():
-    """生成包含时间信息的游戏ID"""
+    """生成包含时间信息的游戏ID，随机后缀避免同一秒内开始的多局游戏（并发的牌桌）使用同一个文件"""
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    return timestamp
+    return f"{timestamp}_{uuid.uuid4().hex[:8]}"
 
 @dataclass
 class PlayerInitialState:
@@ -39,6 +67,9 @@ class PlayAction:
     challenge_result: Optional[bool] = None
     play_thinking: Optional[str] = None
     challenge_thinking: Optional[str] = None
+    # 决策耗时与用量：latency, attempts, llm_calls, llm_retries, prompt_tokens, completion_tokens 等
+    play_stats: Optional[Dict] = None
+    challenge_stats: Optional[Dict] = None
     
     def to_dict(self) -> Dict:
         return {
@@ -52,15 +83,18 @@ class PlayAction:
             "challenge_reason": self.challenge_reason,
             "challenge_result": self.challenge_result,
             "play_thinking": self.play_thinking,
-            "challenge_thinking": self.challenge_thinking
+            "challenge_thinking": self.challenge_thinking,
+            "play_stats": self.play_stats,
+            "challenge_stats": self.challenge_stats
         }
     
-    def update_challenge(self, was_challenged: bool, reason: str, result: bool, challenge_thinking: str = None) -> None:
+    def update_challenge(self, was_challenged: bool, reason: str, result: bool, challenge_thinking: str = None, challenge_stats: Dict = None) -> None:
         """更新质疑信息"""
         self.was_challenged = was_challenged
         self.challenge_reason = reason
         self.challenge_result = result
         self.challenge_thinking = challenge_thinking
+        self.challenge_stats = challenge_stats
 
 @dataclass
 class ShootingResult:
@@ -74,6 +108,24 @@ class ShootingResult:
             "bullet_hit": self.bullet_hit,
         }
 
+@dataclass
+class ReflectionRecord:
+    """记录一次反思请求（per_player模式每个对手一次，batch模式一次覆盖所有对手）"""
+    player_name: str
+    target_names: List[str]
+    reflection_mode: str
+    updated_targets: List[str]
+    stats: Optional[Dict] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "player_name": self.player_name,
+            "target_names": self.target_names,
+            "reflection_mode": self.reflection_mode,
+            "updated_targets": self.updated_targets,
+            "stats": self.stats
+        }
+
 @dataclass
 class RoundRecord:
     """记录一轮游戏"""
@@ -85,6 +137,7 @@ class RoundRecord:
     player_opinions: Dict[str, Dict[str, str]] = field(default_factory=dict)
     play_history: List[PlayAction] = field(default_factory=list)
     round_result: Optional[ShootingResult] = None
+    reflections: List[ReflectionRecord] = field(default_factory=list)
     
     def to_dict(self) -> Dict:
         return {
@@ -95,9 +148,16 @@ class RoundRecord:
             "player_initial_states": [ps.to_dict() for ps in self.player_initial_states],
             "player_opinions": self.player_opinions,
             "play_history": [play.to_dict() for play in self.play_history],
-            "round_result": self.round_result.to_dict() if self.round_result else None
+            "round_result": self.round_result.to_dict() if self.round_result else None,
+            "reflections": [reflection.to_dict() for reflection in self.reflections]
         }
     
+    def __post_init__(self):
+        # 玩家名 -> 初始状态，决策信息中按名字查询开枪次数
+        self._initial_states: Dict[str, PlayerInitialState] = {ps.player_name: ps for ps in self.player_initial_states}
+        # (玩家, 格式) -> 累积渲染的操作记录，第i项为前i+1次操作的文本；只追加，质疑结果更新时丢弃最后一项
+        self._action_texts: Dict[Tuple[str, str], List[str]] = {}
+
     def add_play_action(self, action: PlayAction) -> None:
         """添加出牌记录"""
         self.play_history.append(action)
@@ -105,6 +165,16 @@ class RoundRecord:
     def get_last_action(self) -> Optional[PlayAction]:
         """获取最后一次出牌记录"""
         return self.play_history[-1] if self.play_history else None
+
+    def update_last_challenge(self, was_challenged: bool, reason: str, result: bool, challenge_thinking: str = None, challenge_stats: Dict = None) -> None:
+        """更新最后一次出牌的质疑信息，并使该次操作已渲染的文本失效"""
+        last_action = self.get_last_action()
+        if not last_action:
+            return
+        last_action.update_challenge(was_challenged, reason, result, challenge_thinking, challenge_stats)
+        finalized = len(self.play_history) - 1
+        for texts in self._action_texts.values():
+            del texts[finalized:]
     
     def set_shooting_result(self, result: ShootingResult) -> None:
         """设置射击结果"""
@@ -117,51 +187,88 @@ class RoundRecord:
             f"从玩家{self.starting_player}开始"
         )
 
-    def get_latest_round_actions(self, current_player: str, include_latest: bool = True) -> str:
+    def get_latest_round_actions(self, current_player: str, include_latest: bool = True, style: str = "prose") -> str:
         """
         输入当前玩家，返回该轮次的操作信息
+
+        每个玩家、每种格式的文本按操作逐次追加渲染并缓存，已渲染的操作不会重复渲染。
         
         Args:
             current_player (str): 当前玩家名称
             include_latest (bool): 是否包含最新一次操作，默认为 True
+            style (str): 操作记录的格式，prose 或 compact，默认为 prose
         
         Returns:
             str: 格式化的操作信息文本
         """
-        action_texts = []
-        actions_to_process = self.play_history if include_latest else self.play_history[:-1]
+        if style not in ACTION_LOG_STYLES:
+            raise ValueError(f"未知的操作记录格式: {style}，可选: {', '.join(ACTION_LOG_STYLES)}")
+        count = len(self.play_history) if include_latest else len(self.play_history) - 1
+        if count <= 0:
+            return ""
+
+        texts = self._action_texts.setdefault((current_player, style), [])
+        for index in range(len(texts), count):
+            action = self.play_history[index]
+            if style == "compact":
+                entry = self._render_compact_action(current_player, index + 1, action)
+                previous = texts[-1] if texts else COMPACT_ACTION_HEADER
+            else:
+                entry = self._render_prose_action(current_player, action)
+                previous = texts[-1] if texts else None
+            texts.append(entry if previous is None else f"{previous}\n{entry}")
+        return texts[count - 1]
+
+    def _render_prose_action(self, current_player: str, action: PlayAction) -> str:
+        """以当前玩家的视角描述一次出牌和质疑"""
+        if action.player_name == current_player:
+            play_text = (
+                f"轮到你出牌，你打出{len(action.played_cards)}张牌，出牌：{'、'.join(action.played_cards)}，"
+                f"剩余手牌：{'、'.join(action.remaining_cards)}\n你的表现：{action.behavior}"
+            )
+        else:
+            play_text = (
+                f"轮到{action.player_name}出牌，{action.player_name}宣称打出{len(action.played_cards)}张'{self.target_card}'，"
+                f"剩余手牌{len(action.remaining_cards)}张\n{action.player_name} 的表现：{action.behavior}"
+            )
         
-        for action in actions_to_process:
-            if action.player_name == current_player:
-                action_texts.append(
-                    f"轮到你出牌，你打出{len(action.played_cards)}张牌，出牌：{'、'.join(action.played_cards)}，"
-                    f"剩余手牌：{'、'.join(action.remaining_cards)}\n你的表现：{action.behavior}"
-                )
+        if action.was_challenged:
+            actual_cards = f"打出的牌是：{'、'.join(action.played_cards)}"
+            challenge_result_text = f"{actual_cards}，质疑成功" if action.challenge_result else f"{actual_cards}，质疑失败"
+            if action.next_player == current_player:
+                challenge_text = f"你选择质疑{action.player_name}，{action.player_name}{challenge_result_text}"
+            elif action.player_name == current_player:
+                challenge_text = f"{action.next_player}选择质疑你，你{challenge_result_text}"
             else:
-                action_texts.append(
-                    f"轮到{action.player_name}出牌，{action.player_name}宣称打出{len(action.played_cards)}张'{self.target_card}'，"
-                    f"剩余手牌{len(action.remaining_cards)}张\n{action.player_name} 的表现：{action.behavior}"
-                )
-            
-            if action.was_challenged:
-                actual_cards = f"打出的牌是：{'、'.join(action.played_cards)}"
-                challenge_result_text = f"{actual_cards}，质疑成功" if action.challenge_result else f"{actual_cards}，质疑失败"
-                if action.next_player == current_player:
-                    challenge_text = f"你选择质疑{action.player_name}，{action.player_name}{challenge_result_text}"
-                elif action.player_name == current_player:
-                    challenge_text = f"{action.next_player}选择质疑你，你{challenge_result_text}"
-                else:
-                    challenge_text = f"{action.next_player}选择质疑{action.player_name}，{action.player_name}{challenge_result_text}"
+                challenge_text = f"{action.next_player}选择质疑{action.player_name}，{action.player_name}{challenge_result_text}"
+        else:
+            if action.next_player == current_player:
+                challenge_text = f"你选择不质疑{action.player_name}"
+            elif action.player_name == current_player:
+                challenge_text = f"{action.next_player}选择不质疑你"
             else:
-                if action.next_player == current_player:
-                    challenge_text = f"你选择不质疑{action.player_name}"
-                elif action.player_name == current_player:
-                    challenge_text = f"{action.next_player}选择不质疑你"
-                else:
-                    challenge_text = f"{action.next_player}选择不质疑{action.player_name}"
-            action_texts.append(challenge_text)
-        
-        return "\n".join(action_texts)
+                challenge_text = f"{action.next_player}选择不质疑{action.player_name}"
+        return f"{play_text}\n{challenge_text}"
+
+    def _render_compact_action(self, current_player: str, index: int, action: PlayAction) -> str:
+        """compact格式的一行：序号|出牌玩家|张数|实际出牌|剩余手牌|表现|下家|质疑"""
+        is_self = action.player_name == current_player
+        # 自己的牌和被质疑后翻开的牌是公开的，其余只知道张数
+        revealed = is_self or action.was_challenged
+        if action.was_challenged:
+            challenge_text = "质疑成功" if action.challenge_result else "质疑失败"
+        else:
+            challenge_text = "不质疑"
+        return "|".join([
+            str(index),
+            "你" if is_self else action.player_name,
+            str(len(action.played_cards)),
+            "、".join(action.played_cards) if revealed else "?",
+            ("、".join(action.remaining_cards) or "无") if is_self else str(len(action.remaining_cards)),
+            action.behavior,
+            "你" if action.next_player == current_player else action.next_player,
+            challenge_text
+        ])
     
     def get_latest_play_behavior(self) -> str:
         """
@@ -204,6 +311,11 @@ class RoundRecord:
         else:
             return f"{shooter}开枪！没有命中，{shooter}还活着"
 
+    def _gun_position(self, player_name: str) -> Optional[int]:
+        """玩家在本轮开始时已经开了几枪"""
+        state = self._initial_states.get(player_name)
+        return state.current_gun_position if state else None
+
     def get_play_decision_info(self, self_player: str, interacting_player: str) -> str:
         """获取当前轮次出牌决策相关信息
         
@@ -213,8 +325,8 @@ class RoundRecord:
         Returns:
             str: 包含双方枪状态和当前玩家对下家印象的信息
         """
-        self_gun = next((ps.current_gun_position for ps in self.player_initial_states if ps.player_name == self_player), None)
-        other_gun = next((ps.current_gun_position for ps in self.player_initial_states if ps.player_name == interacting_player), None)
+        self_gun = self._gun_position(self_player)
+        other_gun = self._gun_position(interacting_player)
         opinion = self.player_opinions[self_player].get(interacting_player, "还不了解这个玩家")
         
         return (f"{interacting_player}是你的下家，决定是否质疑你的出牌。\n"
@@ -230,87 +342,322 @@ class RoundRecord:
         Returns:
             str: 包含双方枪状态和当前玩家对上家印象的信息
         """
-        self_gun = next((ps.current_gun_position for ps in self.player_initial_states if ps.player_name == self_player), None)
-        other_gun = next((ps.current_gun_position for ps in self.player_initial_states if ps.player_name == interacting_player), None)
+        self_gun = self._gun_position(self_player)
+        other_gun = self._gun_position(interacting_player)
         opinion = self.player_opinions[self_player].get(interacting_player, "还不了解这个玩家")
         
         return (f"你正在判断是否质疑{interacting_player}的出牌。\n"
                 f"你已经开了{self_gun}枪，{interacting_player}开了{other_gun}枪。"
                 f"你对{interacting_player}的印象分析：{opinion}")
 
+class GameEventLog:
+    """追加写入的游戏事件日志，每行一个json事件
+
+    写入由进程内共享的后台写线程完成，游戏循环只负责入队。
+    fsync策略决定何时强制落盘：never 从不（每批写入后flush），round 每轮结束（开枪）和游戏结束时，always 每个事件。
+    """
+
+    def __init__(self, path: str, fsync: str = "round", writer: Optional[RecordWriter] = None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"未知的fsync策略: {fsync}，可选: {', '.join(FSYNC_POLICIES)}")
+        self.path = path
+        self.fsync = fsync
+        self.writer = writer or get_writer()
+
+    def append(self, event: Dict, boundary: bool = False) -> None:
+        """追加一个事件，boundary表示轮次或游戏的结束"""
+        self.writer.append_event(self.path, event, sync=self.fsync == "always" or (boundary and self.fsync == "round"))
+
+    def close(self) -> None:
+        self.writer.close_file(self.path)
+
+
+def read_events(path: str) -> List[Dict]:
+    """读取事件日志，进程崩溃时写了一半的最后一行会被忽略"""
+    events = []
+    with open(path, "r", encoding="utf-8") as file:
+        lines = file.read().split("\n")
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except json.JSONDecodeError:
+            if index < len(lines) - 1 and any(rest.strip() for rest in lines[index + 1:]):
+                raise
+            logger.warning(f"忽略事件日志 {path} 末尾不完整的一行")
+    return events
+
+
+def write_events(path: str, events: List[Dict]) -> None:
+    """同步地把事件写成新的事件日志：先写临时文件并落盘，再替换原文件，中途崩溃时原日志保持不变"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        for event in events:
+            file.write(json.dumps(event, ensure_ascii=False) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
 @dataclass
 class GameRecord:
-    """完整游戏记录"""
-    def __init__(self):
-        self.game_id: str = generate_game_id()
+    """完整游戏记录
+
+    游戏过程中的每次变化都作为一个事件追加到 {game_id}.events.jsonl，
+    游戏结束时压缩为与以往相同格式的 {game_id}.json 并删除事件日志和检查点。
+    未结束的游戏可以用 compact_event_log 从事件日志生成json，或用 from_checkpoint 从检查点继续。
+    """
+    def __init__(self, save_directory: str = "game_records", fsync: str = "round", game_id: Optional[str] = None,
+                 writer: Optional[RecordWriter] = None):
+        self.game_id: str = game_id or generate_game_id()
         self.player_names: List[str] = []
         self.rounds: List[RoundRecord] = []
         self.winner: Optional[str] = None
-        self.save_directory: str = "game_records"
+        self.seed: Optional[int] = None
+        self.save_directory: str = save_directory
+        # 已应用的事件数，检查点据此确定事件日志中属于检查点的部分
+        self.event_count: int = 0
+        self._checkpoints_disabled = False
+        # 重放的事件日志中标记了有事件丢失
+        self.events_lost = False
+        # 最近一次检查点被丢弃，磁盘上的检查点落后于当前进度（恢复时会从更早的位置继续）
+        self.checkpoint_stale = False
         
         # 确保保存目录存在
         if not os.path.exists(self.save_directory):
             os.makedirs(self.save_directory)
+        self.writer = writer or get_writer()
+        self.event_log = GameEventLog(self.events_path, fsync=fsync, writer=self.writer)
+
+    @property
+    def events_path(self) -> str:
+        return os.path.join(self.save_directory, f"{self.game_id}{EVENT_LOG_SUFFIX}")
+
+    @property
+    def json_path(self) -> str:
+        return os.path.join(self.save_directory, f"{self.game_id}.json")
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.save_directory, f"{self.game_id}{CHECKPOINT_SUFFIX}")
     
+    @property
+    def lossy(self) -> bool:
+        """事件日志是否有追加被丢弃（--record-backpressure drop），此时日志不完整，不能再作为检查点的依据"""
+        return self.events_lost or self.writer.dropped_count("append", self.events_path) > 0
+
     def to_dict(self) -> Dict:
-        return {
+        data = {
             "game_id": self.game_id,
             "player_names": self.player_names,
             "rounds": [round.to_dict() for round in self.rounds],
             "winner": self.winner,
+            "seed": self.seed,
         }
+        if self.lossy:
+            data["lossy"] = True
+        return data
+
+    @classmethod
+    def from_events(cls, events: List[Dict], save_directory: str = "game_records", fsync: str = "round",
+                    writer: Optional[RecordWriter] = None) -> "GameRecord":
+        """按顺序重放事件，重建游戏记录（不写入事件日志）"""
+        game_id = next((event["game_id"] for event in events if event.get("event") == "game_start"), None)
+        record = cls(save_directory=save_directory, fsync=fsync, game_id=game_id, writer=writer)
+        for event in events:
+            record._apply(event)
+        return record
+
+    @classmethod
+    def from_checkpoint(cls, game_id: str, save_directory: str = "game_records", fsync: str = "round",
+                        writer: Optional[RecordWriter] = None) -> Tuple["GameRecord", Dict]:
+        """
+        从最近的检查点恢复游戏记录
+
+        事件日志中检查点之后的事件（中断的那次操作）会被丢弃，之后的事件继续追加到同一个事件日志。
+
+        Args:
+            game_id: 游戏ID
+            save_directory: 游戏记录目录
+
+        Returns:
+            Tuple[GameRecord, Dict]: (恢复的游戏记录, 检查点中保存的对局状态)
+        """
+        checkpoint_path = find_checkpoint(game_id, save_directory)
+        if checkpoint_path is None:
+            raise FileNotFoundError(f"游戏 {game_id} 在 {save_directory} 中没有检查点")
+        with open(checkpoint_path, "r", encoding="utf-8") as file:
+            checkpoint = json.load(file)
+        events = read_events(os.path.join(save_directory, f"{game_id}{EVENT_LOG_SUFFIX}"))
+        event_count = checkpoint["event_count"]
+        if len(events) < event_count:
+            raise ValueError(f"游戏 {game_id} 的事件日志只有 {len(events)} 个事件，少于检查点中的 {event_count} 个")
+        if len(events) > event_count:
+            logger.info(f"丢弃游戏 {game_id} 检查点之后的 {len(events) - event_count} 个事件")
+
+        record = cls.from_events(events[:event_count], save_directory=save_directory, fsync=fsync, writer=writer)
+        # 用检查点对应的事件重写事件日志：先关闭写线程中可能仍打开的旧文件，再原子地替换，之后的事件追加到新文件
+        record.writer.close_file(record.events_path)
+        record.writer.flush()
+        write_events(record.events_path, events[:event_count])
+        return record, checkpoint["state"]
+
+    def save_checkpoint(self, state: Dict) -> None:
+        """
+        保存对局状态和当前的事件数作为检查点（由后台写线程写入）
+
+        写线程先把检查点之前的事件落盘再写检查点，崩溃后检查点中的事件数不会超过日志中保存的事件数。
+        fsync策略为never时只flush，只保证进程崩溃时一致。
+        事件日志有追加被丢弃后不再写检查点，之前的检查点只依赖丢弃之前的事件，仍然可以继续。
+        """
+        if self.lossy:
+            if not self._checkpoints_disabled:
+                logger.error(f"游戏 {self.game_id} 的事件日志有写入被丢弃，不再保存检查点")
+                self._checkpoints_disabled = True
+            return
+        dropped = self.writer.dropped_count("checkpoint", self.checkpoint_path)
+        self.writer.write_checkpoint(self.checkpoint_path, {
+            "game_id": self.game_id,
+            "event_count": self.event_count,
+            "state": state,
+        }, self.events_path, sync=self.event_log.fsync != "never")
+        stale = self.writer.dropped_count("checkpoint", self.checkpoint_path) > dropped
+        if stale and not self.checkpoint_stale:
+            logger.warning(f"游戏 {self.game_id} 的检查点被丢弃，中断后将从上一个保存成功的检查点恢复")
+        self.checkpoint_stale = stale
+
+    def _record(self, event_type: str, boundary: bool = False, **payload) -> None:
+        """应用一个事件并追加到事件日志"""
+        event = {"event": event_type, "timestamp": time.time(), **payload}
+        self._apply(event)
+        self.event_log.append(event, boundary=boundary)
+
+    def _apply(self, event: Dict) -> None:
+        """把一个事件应用到内存中的记录"""
+        self.event_count += 1
+        event_type = event["event"]
+        if event_type == "game_start":
+            self.player_names = list(event["player_names"])
+            self.seed = event.get("seed")
+        elif event_type == "game_end":
+            self.winner = event["winner"]
+            self.events_lost = self.events_lost or event.get("lossy", False)
+        elif event_type == "round_start":
+            self.rounds.append(RoundRecord(
+                round_id=event["round_id"],
+                target_card=event["target_card"],
+                round_players=list(event["round_players"]),
+                starting_player=event["starting_player"],
+                player_initial_states=[PlayerInitialState(**state) for state in event["player_initial_states"]],
+                player_opinions={name: dict(opinions) for name, opinions in event["player_opinions"].items()}
+            ))
+            return
+
+        current_round = self.get_current_round()
+        if current_round is None:
+            return
+        if event_type == "play":
+            current_round.add_play_action(PlayAction(
+                player_name=event["player_name"],
+                played_cards=list(event["played_cards"]),
+                remaining_cards=list(event["remaining_cards"]),
+                play_reason=event["play_reason"],
+                behavior=event["behavior"],
+                next_player=event["next_player"],
+                play_thinking=event.get("play_thinking"),
+                play_stats=event.get("play_stats")
+            ))
+        elif event_type == "challenge":
+            current_round.update_last_challenge(
+                event["was_challenged"], event.get("reason"), event.get("result"),
+                event.get("challenge_thinking"), event.get("challenge_stats")
+            )
+        elif event_type == "reflection":
+            current_round.reflections.append(ReflectionRecord(
+                player_name=event["player_name"],
+                target_names=list(event["target_names"]),
+                reflection_mode=event["reflection_mode"],
+                updated_targets=list(event["updated_targets"]),
+                stats=event.get("stats")
+            ))
+        elif event_type == "shot":
+            current_round.set_shooting_result(ShootingResult(shooter_name=event["shooter_name"], bullet_hit=event["bullet_hit"]))
     
-    def start_game(self, player_names: List[str]) -> None:
-        """初始化游戏，记录玩家信息"""
-        self.player_names = player_names
+    def start_game(self, player_names: List[str], seed: Optional[int] = None) -> None:
+        """初始化游戏，记录玩家信息和随机种子（可以用同一个种子复现发牌）"""
+        self._record("game_start", game_id=self.game_id, player_names=player_names, seed=seed)
     
     def start_round(self, round_id: int, target_card: str, round_players: List[str], starting_player: str, player_initial_states: List[PlayerInitialState], player_opinions: Dict[str, Dict[str, str]]) -> None:
         """开始新的一轮游戏"""
-        round_record = RoundRecord(
+        self._record(
+            "round_start",
             round_id=round_id,
             target_card=target_card,
             round_players=round_players,
             starting_player=starting_player,
-            player_initial_states=player_initial_states,
+            player_initial_states=[state.to_dict() for state in player_initial_states],
             player_opinions=player_opinions
         )
-        self.rounds.append(round_record)
     
-    def record_play(self, player_name: str, played_cards: List[str], remaining_cards: List[str], play_reason: str, behavior: str, next_player: str, play_thinking: str = None) -> None:
+    def record_play(self, player_name: str, played_cards: List[str], remaining_cards: List[str], play_reason: str, behavior: str, next_player: str, play_thinking: str = None, play_stats: Dict = None) -> None:
         """记录玩家的出牌行为"""
-        current_round = self.get_current_round()
-        if current_round:
-            play_action = PlayAction(
+        if self.get_current_round():
+            self._record(
+                "play",
                 player_name=player_name,
                 played_cards=played_cards,
                 remaining_cards=remaining_cards,
                 play_reason=play_reason,
                 behavior=behavior,
                 next_player=next_player,
-                play_thinking=play_thinking
+                play_thinking=play_thinking,
+                play_stats=play_stats
             )
-            current_round.add_play_action(play_action)
     
-    def record_challenge(self, was_challenged: bool, reason: str = None, result: bool = None, challenge_thinking: str = None) -> None:
+    def record_challenge(self, was_challenged: bool, reason: str = None, result: bool = None, challenge_thinking: str = None, challenge_stats: Dict = None) -> None:
         """记录质疑信息"""
         current_round = self.get_current_round()
-        if current_round:
-            last_action = current_round.get_last_action()
-            if last_action:
-                last_action.update_challenge(was_challenged, reason, result, challenge_thinking)
+        if current_round and current_round.get_last_action():
+            self._record(
+                "challenge",
+                was_challenged=was_challenged,
+                reason=reason,
+                result=result,
+                challenge_thinking=challenge_thinking,
+                challenge_stats=challenge_stats
+            )
+
+    def record_reflection(self, player_name: str, target_names: List[str], reflection_mode: str, updated_targets: List[str], stats: Dict = None) -> None:
+        """记录轮次结束时的一次反思请求"""
+        if self.get_current_round():
+            self._record(
+                "reflection",
+                player_name=player_name,
+                target_names=target_names,
+                reflection_mode=reflection_mode,
+                updated_targets=updated_targets,
+                stats=stats
+            )
     
     def record_shooting(self, shooter_name: str, bullet_hit: bool) -> None:
-        """记录射击结果"""
-        current_round = self.get_current_round()
-        if current_round:
-            shooting_result = ShootingResult(shooter_name=shooter_name, bullet_hit=bullet_hit)
-            current_round.set_shooting_result(shooting_result)
-            self.auto_save()  # 射击后自动保存
+        """记录射击结果，一轮结束"""
+        if self.get_current_round():
+            self._record("shot", boundary=True, shooter_name=shooter_name, bullet_hit=bullet_hit)
     
     def finish_game(self, winner_name: str) -> None:
-        """记录胜利者并保存最终结果"""
-        self.winner = winner_name
-        self.auto_save()  # 游戏结束时保存
+        """记录胜利者，把事件日志压缩为json，写入成功后删除事件日志和检查点（由后台写线程完成）"""
+        if self.lossy:
+            self._record("game_end", boundary=True, winner=winner_name, lossy=True)
+        else:
+            self._record("game_end", boundary=True, winner=winner_name)
+        self.event_log.close()
+        # fsync策略不是never时，json和目录落盘后才删除事件日志，断电时至少保留其中之一
+        self.writer.write_json(self.json_path, self.to_dict(), sync=self.event_log.fsync != "never", then_remove=(
+            self.events_path,
+            self.checkpoint_path,
+            os.path.join(self.save_directory, f"{self.game_id}{LEGACY_CHECKPOINT_SUFFIX}"),
+        ))
     
     def get_current_round(self) -> Optional[RoundRecord]:
         """获取当前轮次"""
@@ -321,10 +668,10 @@ class GameRecord:
         current_round = self.get_current_round()
         return current_round.get_latest_round_info() if current_round else None
 
-    def get_latest_round_actions(self, current_player: str, include_latest: bool = True) -> Optional[str]:
+    def get_latest_round_actions(self, current_player: str, include_latest: bool = True, style: str = "prose") -> Optional[str]:
         """获取最新轮次的操作信息"""
         current_round = self.get_current_round()
-        return current_round.get_latest_round_actions(current_player, include_latest) if current_round else None
+        return current_round.get_latest_round_actions(current_player, include_latest, style) if current_round else None
     
     def get_latest_play_behavior(self) -> Optional[str]:
         """
@@ -351,8 +698,39 @@ class GameRecord:
         return current_round.get_challenge_decision_info(self_player, interacting_player) if current_round else None
 
     def auto_save(self) -> None:
-        """自动保存当前游戏记录到文件"""
-        file_path = os.path.join(self.save_directory, f"{self.game_id}.json")
-        with open(file_path, "w", encoding="utf-8") as file:
-            json.dump(self.to_dict(), file, indent=4, ensure_ascii=False)
-        print(f"游戏记录已自动保存至 {file_path}")
+        """把当前游戏记录写成json，先写临时文件再替换，中途崩溃不会留下不完整的文件
+
+        序列化和写入在后台写线程中完成，这里只生成快照并入队。
+        """
+        self.writer.write_json(self.json_path, self.to_dict())
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的记录写入完成"""
+        return self.writer.flush(timeout)
+
+
+def has_checkpoint(game_id: str, save_directory: str = "game_records") -> bool:
+    """该游戏是否留有可以继续的检查点"""
+    return find_checkpoint(game_id, save_directory) is not None
+
+
+def compact_event_log(events_path: str) -> str:
+    """
+    把事件日志压缩为json游戏记录（未结束的游戏winner为null），返回json路径
+
+    Args:
+        events_path: {game_id}.events.jsonl 的路径
+    """
+    record = GameRecord.from_events(read_events(events_path), save_directory=os.path.dirname(events_path) or ".")
+    record.auto_save()
+    record.flush()
+    return record.json_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='把未压缩的游戏事件日志转换为json游戏记录')
+    parser.add_argument('paths', nargs='+', help='事件日志路径 ({game_id}.events.jsonl)')
+    for path in parser.parse_args().paths:
+        compact_event_log(path)
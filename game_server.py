@@ -1,26 +1,63 @@
+import asyncio
+import hashlib
 import random
 import logging
-from typing import List, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Tuple, Union
 from player import Player
 from game_record import GameRecord, PlayerInitialState
+from llm_metrics import measure_calls
 
 logger = logging.getLogger(__name__)
 
+
+def derive_seed(seed: Union[int, str], *labels) -> int:
+    """由上级种子和标签派生出独立的子种子，例如由锦标赛种子和发牌序号得到每局游戏的种子"""
+    payload = ":".join(str(part) for part in (seed,) + labels)
+    return int.from_bytes(hashlib.sha256(payload.encode("utf-8")).digest()[:8], "big")
+
+
 class GameServer:
-    def __init__(self, players: List[Player], game_record: GameRecord):
+    def __init__(self, players: List[Player], game_record: GameRecord, reflection_concurrency: int = 8,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            players: 玩家列表
+            game_record: 游戏记录
+            reflection_concurrency: 轮次结束时并发执行的反思请求上限，1表示串行
+            seed: 本局游戏的随机种子，None表示不可复现
+        """
         self.players = players
         self.game_record = game_record
+        self.reflection_concurrency = reflection_concurrency
+        self.seed = seed
+        # 未指定种子时所有随机数都取自这个本局独立的生成器
+        self.rng = random.Random(seed)
         self.deck: List[str] = []
         self.target_card: Optional[str] = None
-        self.current_player_idx: int = random.randint(0, len(self.players) - 1)
+        # 子弹位置按座位确定，座位轮换后同一个位置的运气保持不变
+        for seat, player in enumerate(self.players):
+            player.bullet_position = self._stream("bullet", seat).randint(0, 5)
+        self.current_player_idx: int = self._stream("start", 1).randint(0, len(self.players) - 1)
         self.last_shooter_name: Optional[str] = None
         self.game_over: bool = False
         self.round_count = 0
 
+    def _stream(self, *labels) -> random.Random:
+        """
+        某一用途的随机数流
+
+        指定种子时由 (种子, 用途, 座位或轮次) 派生，与对局过程中其他随机数的使用次数无关：
+        同一种子的两局游戏即使进程不同、玩家决策不同，第N轮的牌组和目标牌也完全相同。
+        """
+        if self.seed is None:
+            return self.rng
+        return random.Random(derive_seed(self.seed, *labels))
+
     def _create_deck(self) -> List[str]:
         """创建并洗牌牌组"""
         deck = ['Q'] * 6 + ['K'] * 6 + ['A'] * 6 + ['Joker'] * 2
-        random.shuffle(deck)
+        self._stream("deck", self.round_count + 1).shuffle(deck)
         return deck
 
     def deal_cards(self) -> None:
@@ -38,7 +75,7 @@ class GameServer:
 
     def choose_target_card(self) -> None:
         """随机选择目标牌"""
-        self.target_card = random.choice(['Q', 'K', 'A'])
+        self.target_card = self._stream("target", self.round_count + 1).choice(['Q', 'K', 'A'])
         logger.info(f"目标牌是: {self.target_card}")
 
     def start_round_record(self) -> None:
@@ -72,6 +109,35 @@ class GameServer:
             player_opinions=player_opinions
         )
 
+    def checkpoint_state(self) -> Dict:
+        """当前的完整对局状态（牌组、目标牌、当前玩家、各玩家状态和随机数状态），可以json序列化"""
+        version, internal_state, gauss_next = self.rng.getstate()
+        return {
+            "deck": list(self.deck),
+            "target_card": self.target_card,
+            "current_player_idx": self.current_player_idx,
+            "last_shooter_name": self.last_shooter_name,
+            "game_over": self.game_over,
+            "round_count": self.round_count,
+            "players": {player.name: player.checkpoint_state() for player in self.players},
+            "seed": self.seed,
+            "rng_state": [version, list(internal_state), gauss_next],
+        }
+
+    def restore_state(self, state: Dict) -> None:
+        """从检查点恢复对局状态"""
+        self.deck = list(state["deck"])
+        self.target_card = state["target_card"]
+        self.current_player_idx = state["current_player_idx"]
+        self.last_shooter_name = state["last_shooter_name"]
+        self.game_over = state["game_over"]
+        self.round_count = state["round_count"]
+        for player in self.players:
+            player.restore_state(state["players"][player.name])
+        self.seed = state.get("seed")
+        version, internal_state, gauss_next = state["rng_state"]
+        self.rng.setstate((version, tuple(internal_state), gauss_next))
+
     def is_valid_play(self, cards: List[str]) -> bool:
         return all(card == self.target_card or card == 'Joker' for card in cards)
 
@@ -84,6 +150,16 @@ class GameServer:
         return start_idx
 
     def perform_penalty(self, player: Player) -> None:
+        if self._shoot(player):
+            self.reset_round(record_shooter=True)
+
+    async def aperform_penalty(self, player: Player) -> None:
+        """perform_penalty 的异步版本"""
+        if self._shoot(player):
+            await self.areset_round(record_shooter=True)
+
+    def _shoot(self, player: Player) -> bool:
+        """执行射击惩罚并记录结果，返回游戏是否继续"""
         logger.info(f"玩家 {player.name} 开枪！")
         still_alive = player.process_penalty()
         self.last_shooter_name = player.name
@@ -93,12 +169,21 @@ class GameServer:
         )
         if not still_alive:
             logger.warning(f"{player.name} 已死亡！")
-        if not self.check_victory():
-            self.reset_round(record_shooter=True)
+        return not self.check_victory()
 
     def reset_round(self, record_shooter: bool) -> None:
         logger.info("小局游戏重置，开始新的一局！")
         alive_players = self.handle_reflection()
+        self._start_next_round(alive_players, record_shooter)
+
+    async def areset_round(self, record_shooter: bool) -> None:
+        """reset_round 的异步版本"""
+        logger.info("小局游戏重置，开始新的一局！")
+        alive_players = await self.ahandle_reflection()
+        self._start_next_round(alive_players, record_shooter)
+
+    def _start_next_round(self, alive_players: List[Player], record_shooter: bool) -> None:
+        """发牌、选目标牌并确定下一轮的起始玩家"""
         self.deal_cards()
         self.choose_target_card()
         if record_shooter and self.last_shooter_name:
@@ -111,7 +196,7 @@ class GameServer:
                 self.current_player_idx = self.find_next_player_with_cards(shooter_idx or 0)
         else:
             self.last_shooter_name = None
-            self.current_player_idx = self.players.index(random.choice(alive_players))
+            self.current_player_idx = self.players.index(self._stream("start", self.round_count + 1).choice(alive_players))
         self.start_round_record()
         logger.info(f"从 {self.players[self.current_player_idx].name} 开始新的一轮！")
 
@@ -130,16 +215,90 @@ class GameServer:
         return all(not p.hand for p in others)
 
     def handle_reflection(self) -> List[Player]:
+        """所有存活玩家对其他存活玩家进行反思
+
+        反思任务相互独立，全部基于上一轮的印象并发执行：per_player模式的玩家每个对手一个任务，
+        batch模式的玩家一个任务覆盖所有对手。结果按座位顺序和目标顺序统一写回，与完成顺序无关。
+        """
+        alive_players, tasks, round_base_info = self._reflection_tasks()
+        results = self._run_reflections(tasks, round_base_info)
+        self._apply_reflections(tasks, results)
+        return alive_players
+
+    async def ahandle_reflection(self) -> List[Player]:
+        """handle_reflection 的异步版本，反思任务在当前事件循环中并发执行"""
+        alive_players, tasks, round_base_info = self._reflection_tasks()
+        results = await self._arun_reflections(tasks, round_base_info)
+        self._apply_reflections(tasks, results)
+        return alive_players
+
+    def _reflection_tasks(self) -> Tuple[List[Player], List[Tuple[Player, List[str], str, str]], str]:
+        """返回 (存活玩家, 反思任务列表, 轮次基础信息)"""
         alive_players = [p for p in self.players if p.alive]
         alive_player_names = [p.name for p in alive_players]
         round_base_info = self.game_record.get_latest_round_info()
+
+        tasks = []
         for player in alive_players:
-            round_action_info = self.game_record.get_latest_round_actions(player.name, include_latest=True)
+            round_action_info = self.game_record.get_latest_round_actions(player.name, include_latest=True, style=player.action_log_style)
             round_result = self.game_record.get_latest_round_result(player.name)
-            player.reflect(
-                alive_players=alive_player_names,
-                round_base_info=round_base_info,
-                round_action_info=round_action_info,
-                round_result=round_result
-            )
-        return alive_players
\ No newline at end of file
+            target_names = [name for name in alive_player_names if name != player.name]
+            if player.reflection_mode == "batch":
+                tasks.append((player, target_names, round_action_info, round_result))
+            else:
+                for target_name in target_names:
+                    tasks.append((player, [target_name], round_action_info, round_result))
+        return alive_players, tasks, round_base_info
+
+    def _apply_reflections(self, tasks: List[Tuple[Player, List[str], str, str]], results: List[Tuple[Dict[str, str], Dict]]) -> None:
+        """按任务顺序写回印象并记录反思请求"""
+        for (player, target_names, _, _), (opinions, stats) in zip(tasks, results):
+            for target_name in target_names:
+                if target_name in opinions:
+                    player.opinions[target_name] = opinions[target_name]
+            if stats["llm_calls"] or stats["cache_hits"]:
+                self.game_record.record_reflection(
+                    player_name=player.name,
+                    target_names=target_names,
+                    reflection_mode=player.reflection_mode,
+                    updated_targets=[name for name in target_names if name in opinions],
+                    stats=stats
+                )
+
+    def _run_reflections(self, tasks: List[Tuple[Player, List[str], str, str]], round_base_info: str) -> List[Tuple[Dict[str, str], Dict]]:
+        """执行反思任务，返回与tasks顺序一致的 ({被反思者: 新印象}, 耗时与用量统计) 列表"""
+        def reflect(task: Tuple[Player, List[str], str, str]) -> Tuple[Dict[str, str], Dict]:
+            player, target_names, round_action_info, round_result = task
+            opinions = {}
+            # 统计在执行反思的线程内进行，并发任务之间互不影响
+            with measure_calls() as stats:
+                try:
+                    opinions = player.reflect_on_players(target_names, round_base_info, round_action_info, round_result)
+                except Exception as e:
+                    logger.error(f"{player.name} 反思 {'、'.join(target_names)} 时出错: {str(e)}")
+            return opinions, stats
+
+        if self.reflection_concurrency <= 1 or len(tasks) <= 1:
+            return [reflect(task) for task in tasks]
+
+        with ThreadPoolExecutor(max_workers=min(self.reflection_concurrency, len(tasks)),
+                                thread_name_prefix="reflection") as executor:
+            return list(executor.map(reflect, tasks))
+
+    async def _arun_reflections(self, tasks: List[Tuple[Player, List[str], str, str]], round_base_info: str) -> List[Tuple[Dict[str, str], Dict]]:
+        """_run_reflections 的异步版本，最多 reflection_concurrency 个任务同时进行"""
+        semaphore = asyncio.Semaphore(max(1, self.reflection_concurrency))
+
+        async def reflect(task: Tuple[Player, List[str], str, str]) -> Tuple[Dict[str, str], Dict]:
+            player, target_names, round_action_info, round_result = task
+            opinions = {}
+            async with semaphore:
+                # 每个任务在自己的asyncio任务中统计，并发任务之间互不影响
+                with measure_calls() as stats:
+                    try:
+                        opinions = await player.areflect_on_players(target_names, round_base_info, round_action_info, round_result)
+                    except Exception as e:
+                        logger.error(f"{player.name} 反思 {'、'.join(target_names)} 时出错: {str(e)}")
+            return opinions, stats
+
+        return list(await asyncio.gather(*(reflect(task) for task in tasks)))
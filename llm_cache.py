@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "llm_cache/llm_cache.sqlite"
+
+CacheValue = Tuple[str, str]
+
+
+class _Flight:
+    """一次进行中的请求，供相同键的并发调用等待其结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Optional[CacheValue] = None
+
+
+class LLMCache:
+    """LLM请求的持久化缓存
+
+    以 (model, reasoning_effort, messages) 的哈希为键，保存 (content, reasoning_content)。
+    磁盘层使用SQLite，前面加一层内存LRU；磁盘条目超过上限时按最近访问时间淘汰。
+    相同键的并发请求会合并为一次实际调用（single-flight）。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 200000, memory_entries: int = 2048):
+        """
+        Args:
+            path: SQLite文件路径
+            max_entries: 磁盘上最多保留的条目数
+            memory_entries: 内存LRU最多保留的条目数
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CacheValue]" = OrderedDict()
+        self._inflight: Dict[str, "_Flight"] = {}
+        self._async_inflight: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Future] = {}
+
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, reasoning_content TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+        self._conn.commit()
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, reasoning_effort: str, messages: List[Dict], params: Optional[Dict] = None) -> str:
+        """计算缓存键，params 为 response_format、temperature 等影响输出的其他请求参数（值为None的忽略）"""
+        key = {"model": model, "reasoning_effort": reasoning_effort, "messages": messages}
+        params = {name: value for name, value in (params or {}).items() if value is not None}
+        # 没有其他参数时与旧版本的键相同，已有的缓存仍然有效
+        if params:
+            key["params"] = params
+        payload = json.dumps(key, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, value: CacheValue) -> None:
+        """写入内存LRU，调用方需持有锁"""
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[CacheValue]:
+        """查询缓存，未命中返回None"""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+
+            row = self._conn.execute(
+                "SELECT content, reasoning_content FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            value = (row[0], row[1])
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self._remember(key, value)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: CacheValue) -> None:
+        """写入缓存，空回复不缓存"""
+        content, reasoning_content = value
+        if not content:
+            return
+        now = time.time()
+        with self._lock:
+            # INSERT OR REPLACE 覆盖已有的行时 rowcount 同样为1，需先查出是否为新条目
+            exists = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, reasoning_content, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, content, reasoning_content or "", now, now)
+            )
+            self._conn.commit()
+            if not exists:
+                self._disk_count += 1
+            self._remember(key, (content, reasoning_content or ""))
+            if self._disk_count > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """按最近访问时间淘汰磁盘条目，一次淘汰10%以摊薄开销，调用方需持有锁"""
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        overflow = self._disk_count - self.max_entries
+        if overflow <= 0:
+            return
+        to_delete = overflow + self.max_entries // 10
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)", (to_delete,)
+        )
+        self._conn.commit()
+        self._disk_count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        logger.info(f"LLM缓存淘汰了 {to_delete} 条记录，剩余 {self._disk_count} 条")
+
+    def invalidate(self, key: str) -> None:
+        """删除一条缓存（例如回复无法通过校验时）"""
+        with self._lock:
+            self._memory.pop(key, None)
+            cursor = self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+            self._disk_count -= max(cursor.rowcount, 0)
+
+    def get_or_compute(self, key: str, compute: Callable[[], CacheValue]) -> CacheValue:
+        """查询缓存，未命中时调用compute；相同键的并发调用只会真正执行一次"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            flight = self._inflight.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not is_leader:
+            flight.event.wait()
+            return flight.value if flight.value is not None else compute()
+
+        try:
+            flight.value = compute()
+            self.put(key, flight.value)
+            return flight.value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[CacheValue]]) -> CacheValue:
+        """get_or_compute的异步版本，在同一事件循环内合并相同键的并发请求"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        loop = asyncio.get_running_loop()
+        inflight_key = (loop, key)
+        future = self._async_inflight.get(inflight_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = loop.create_future()
+        self._async_inflight[inflight_key] = future
+        try:
+            value = await compute()
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免无人等待时出现 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._async_inflight.pop(inflight_key, None)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_caches: Dict[str, LLMCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(path: str = DEFAULT_CACHE_PATH, **kwargs) -> LLMCache:
+    """获取进程内共享的缓存实例，同一路径只打开一次"""
+    path = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = LLMCache(path, **kwargs)
+            _caches[path] = cache
+        return cache
@@ -1,6 +1,28 @@
+import asyncio
+import contextvars
 import logging
 import datetime
-from openai import OpenAI
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import httpx
+from openai import OpenAI, AsyncOpenAI, BadRequestError, DefaultHttpxClient, DefaultAsyncHttpxClient
+from llm_cache import LLMCache, get_cache
+from concurrency_limiter import get_limiter, is_overload_error
+from llm_metrics import CallRecord, record_call
+from load_balancer import choose_endpoint, hedge_delay, record_latency, track_outstanding
+from resilience import (
+    FATAL, EndpointBusyError, LLMFatalError, LLMUnavailableError, available_endpoints, backoff_delay, classify_error,
+    get_breaker, retry_after_seconds
+)
+
+try:
+    import h2  # noqa: F401  HTTP/2 依赖可选包 h2 (pip install "httpx[http2]")
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # 配置日志
 log_filename = f"game_{datetime.datetime.now().strftime('%Y%m%d')}.log"
@@ -12,42 +34,641 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 连接池配置：同一base_url的所有玩家共享一个连接池，连接保持长连接复用
+POOL_MAX_CONNECTIONS = 256
+POOL_MAX_KEEPALIVE_CONNECTIONS = 64
+POOL_KEEPALIVE_EXPIRY = 60.0
+
+_pool_lock = threading.Lock()
+# base_url -> 同步httpx连接池
+_sync_http_clients: Dict[str, httpx.Client] = {}
+# (base_url, api_key) -> 共享连接池的OpenAI客户端
+_sync_clients: Dict[Tuple[str, str], OpenAI] = {}
+# 异步连接池绑定在事件循环上：事件循环 -> {base_url: httpx.AsyncClient}
+_async_http_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+# 事件循环 -> {(base_url, api_key): AsyncOpenAI}
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+# 拒绝过 json_schema response_format 的endpoint，之后不再发送结构化输出参数
+_structured_output_unsupported = set()
+
+# 当前线程/协程最近一次调用的耗时和记录；用contextvars使并发的asyncio任务各自独立
+_last_call_timing: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("last_call_timing", default=None)
+_last_call_record: contextvars.ContextVar[Optional[CallRecord]] = contextvars.ContextVar("last_call_record", default=None)
+
+# 同步模式下执行对冲请求的共享线程池
+_hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm-hedge")
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=POOL_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=POOL_KEEPALIVE_EXPIRY
+    )
+
+
+def get_sync_client(base_url: str, api_key: str) -> OpenAI:
+    """获取共享连接池的同步OpenAI客户端，同一base_url的所有客户端复用一个连接池"""
+    key = (base_url, api_key)
+    with _pool_lock:
+        client = _sync_clients.get(key)
+        if client is None:
+            http_client = _sync_http_clients.get(base_url)
+            if http_client is None:
+                http_client = DefaultHttpxClient(limits=_pool_limits(), http2=HTTP2_AVAILABLE)
+                _sync_http_clients[base_url] = http_client
+                logger.info(f"为 {base_url} 创建共享连接池 (HTTP/2: {HTTP2_AVAILABLE})")
+            # 重试由 LLMClient 统一负责（退避、熔断），关闭SDK内置的重试
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            _sync_clients[key] = client
+        return client
+
+
+def get_async_client(base_url: str, api_key: str) -> AsyncOpenAI:
+    """获取当前事件循环中共享连接池的异步OpenAI客户端，必须在事件循环内调用"""
+    loop = asyncio.get_running_loop()
+    key = (base_url, api_key)
+    with _pool_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            http_clients = _async_http_clients.setdefault(loop, {})
+            http_client = http_clients.get(base_url)
+            if http_client is None:
+                http_client = DefaultAsyncHttpxClient(limits=_pool_limits(), http2=HTTP2_AVAILABLE)
+                http_clients[base_url] = http_client
+                logger.info(f"为 {base_url} 创建共享异步连接池 (HTTP/2: {HTTP2_AVAILABLE})")
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+            clients[key] = client
+        return client
+
+
+def close_clients() -> None:
+    """关闭所有同步连接池"""
+    with _pool_lock:
+        for http_client in _sync_http_clients.values():
+            http_client.close()
+        _sync_http_clients.clear()
+        _sync_clients.clear()
+
+
+def _is_response_format_rejected(error: Exception) -> bool:
+    """判断请求是否因为服务端不支持 response_format 而被拒绝"""
+    message = str(error)
+    return isinstance(error, BadRequestError) and ("response_format" in message or "json_schema" in message)
+
+
+async def aclose_clients() -> None:
+    """关闭当前事件循环中的所有异步连接池，应在事件循环结束前调用"""
+    loop = asyncio.get_running_loop()
+    with _pool_lock:
+        http_clients = _async_http_clients.pop(loop, {})
+        _async_clients.pop(loop, None)
+    for http_client in http_clients.values():
+        await http_client.aclose()
+
+
 class LLMClient:
-    def __init__(self, base_url: str, api_key: str, model: str, reasoning_effort: str = 'low'):
-        """初始化LLM客户端"""
-        self.client = OpenAI(
-            api_key=api_key,
-            base_url=base_url
-        )
+    def __init__(self, base_url: Union[str, List[str]], api_key: str, model: str, reasoning_effort: str = 'low', cache_path: Optional[str] = None,
+                 structured_output: bool = True, stream: bool = False, hedge: bool = False, hedge_quantile: float = 0.95,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_cap: float = 30.0, player: Optional[str] = None,
+                 request_params: Optional[Dict] = None):
+        """初始化LLM客户端，连接池按base_url在所有玩家间共享
+
+        Args:
+            base_url: 单个endpoint，或同一模型多个副本的endpoint列表；每次请求路由到在途请求最少的副本
+            cache_path: 可选的持久化响应缓存路径，相同路径的客户端共享同一缓存
+            structured_output: 调用方提供 response_format 时是否发送给服务端；
+                服务端拒绝后会自动关闭该endpoint的结构化输出
+            stream: 是否使用流式输出；流式模式下可通过 stop_when 在决策完整后提前断开
+            hedge: 有多个副本时，请求超过近期延迟的 hedge_quantile 分位数仍未返回，就向另一个副本发出相同请求，取先返回的结果
+            hedge_quantile: 对冲等待时间对应的延迟分位数
+            max_retries: 可重试错误（429、5xx、超时、连接错误）的最大重试次数，重试前按指数退避并遵循 Retry-After
+            backoff_base: 第一次退避时间的上限（秒）
+            backoff_cap: 单次退避时间的上限（秒）
+            player: 调用指标中的玩家标签
+            request_params: 随每次请求发送的其他参数，例如 temperature、max_tokens、top_p
+
+        Raises（chat/achat）:
+            LLMFatalError: 鉴权失败、请求参数错误等不可重试的错误
+            LLMUnavailableError: 重试耗尽，或等待熔断恢复后仍然失败
+        """
+        self.endpoints: List[str] = [base_url] if isinstance(base_url, str) else list(base_url)
+        if not self.endpoints:
+            raise ValueError("base_url 至少需要一个endpoint")
+        self.base_url = self.endpoints[0]
+        self.api_key = api_key
+        self.client = get_sync_client(self.base_url, api_key)
         self.model = model
         self.reasoning_effort = reasoning_effort
+        self.cache: Optional[LLMCache] = get_cache(cache_path) if cache_path else None
+        self.structured_output = structured_output
+        self.stream = stream
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.player = player
+        self.request_params: Dict = dict(request_params or {})
+
+    @property
+    def last_call_timing(self) -> Dict[str, Any]:
+        """当前线程/协程最近一次调用的信息：endpoint 实际使用的副本，latency 总耗时，ttft 首个token耗时，
+        time_to_decision 得到完整决策的耗时，hedged 是否由对冲请求返回，retries 退避重试次数，usage token用量"""
+        timing = _last_call_timing.get()
+        if timing is None:
+            return {"endpoint": None, "latency": None, "ttft": None, "time_to_decision": None, "hedged": False,
+                    "retries": 0, "usage": {}}
+        return timing
+
+    @property
+    def last_call_record(self) -> Optional[CallRecord]:
+        """当前线程/协程最近一次 chat/achat 调用的记录（包括命中缓存和失败的调用）"""
+        return _last_call_record.get()
+
+    def _set_timing(self, timing: Dict[str, Any]) -> None:
+        _last_call_timing.set(timing)
+        if timing["ttft"] is not None:
+            time_to_decision = timing["time_to_decision"]
+            decision_text = f"{time_to_decision:.2f}s" if time_to_decision is not None else "未提前结束"
+            logger.info(f"LLM流式调用耗时: 首token {timing['ttft']:.2f}s，决策 {decision_text}，总计 {timing['latency']:.2f}s")
+
+    def supports_structured_output(self, endpoint: str) -> bool:
+        return self.structured_output and endpoint not in _structured_output_unsupported
+
+    def _request_kwargs(self, endpoint: str, messages: List[Dict], response_format: Optional[Dict] = None) -> Dict:
+        """构造请求参数"""
+        kwargs = {
+            "model": self.model,
+            "messages": messages,
+            "reasoning_effort": self.reasoning_effort,
+            **self.request_params,
+        }
+        if response_format is not None and self.supports_structured_output(endpoint):
+            kwargs["response_format"] = response_format
+        if self.stream:
+            # 在最后一个分片中返回token用量
+            kwargs["stream_options"] = {"include_usage": True}
+        return kwargs
+
+    def _parse_response(self, response) -> Tuple[str, str]:
+        """从响应中提取 (content, reasoning_content)"""
+        if response.choices:
+            message = response.choices[0].message
+            content = message.content if message.content else ""
+            reasoning_content = getattr(message, "reasoning_content", "")
+            logger.info(f"LLM推理内容: {content}")
+            return content, reasoning_content
+
+        return "", ""
+
+    @staticmethod
+    def _parse_usage(usage) -> Dict[str, Optional[int]]:
+        """从 usage 中提取 prompt/completion/reasoning/cached token数，服务端未返回的字段为None"""
+        if usage is None:
+            return {}
+        completion_details = getattr(usage, "completion_tokens_details", None)
+        prompt_details = getattr(usage, "prompt_tokens_details", None)
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "reasoning_tokens": getattr(completion_details, "reasoning_tokens", None),
+            "cached_tokens": getattr(prompt_details, "cached_tokens", None),
+        }
+
+    @staticmethod
+    def _parse_chunk(chunk) -> Tuple[str, str]:
+        """从流式分片中提取 (content, reasoning_content) 增量"""
+        if not chunk.choices:
+            return "", ""
+        delta = chunk.choices[0].delta
+        return delta.content or "", getattr(delta, "reasoning_content", None) or ""
+
+    def _disable_structured_output(self, endpoint: str, error: Exception) -> None:
+        _structured_output_unsupported.add(endpoint)
+        logger.warning(f"{endpoint} 不支持结构化输出，之后改用普通文本输出: {str(error)}")
+
+    def _cache_key(self, messages: List[Dict], response_format: Optional[Dict] = None) -> str:
+        """缓存键包含所有影响输出的请求参数，改变 temperature 等参数后不会命中之前的回复"""
+        return LLMCache.make_key(
+            self.model, self.reasoning_effort, messages,
+            {**self.request_params, "response_format": response_format if self.structured_output else None}
+        )
+
+    def invalidate(self, messages: List[Dict], response_format: Optional[Dict] = None) -> None:
+        """丢弃该请求的缓存回复，使下一次相同请求重新调用LLM（用于回复未通过校验时）"""
+        if self.cache is not None:
+            self.cache.invalidate(self._cache_key(messages, response_format))
 
-    def chat(self, messages):
-        """与LLM交互
+    def chat(self, messages, response_format: Optional[Dict] = None, stop_when: Optional[Callable[[str], bool]] = None,
+             decision_type: Optional[str] = None):
+        """与LLM交互，启用缓存时优先返回缓存结果
 
         Args:
             messages: 消息列表
-            model: 使用的LLM模型
+            response_format: 可选的json schema输出约束，服务端不支持时自动忽略
+            stop_when: 流式模式下对已收到的content进行判断，返回True时立即断开流（例如决策json已经完整）
+            decision_type: 调用指标中的决策类型标签
 
         Returns:
             tuple: (content, reasoning_content)
         """
+        start = time.monotonic()
+        _last_call_record.set(None)
+        if self.cache is None:
+            return self._chat(messages, response_format, stop_when, decision_type)
+        result = self.cache.get_or_compute(
+            self._cache_key(messages, response_format), lambda: self._chat(messages, response_format, stop_when, decision_type)
+        )
+        if _last_call_record.get() is None:
+            self._record_cache_hit(decision_type, time.monotonic() - start)
+        return result
+
+    async def achat(self, messages, response_format: Optional[Dict] = None, stop_when: Optional[Callable[[str], bool]] = None,
+                    decision_type: Optional[str] = None):
+        """与LLM异步交互，使用当前事件循环中按base_url共享的连接池
+
+        Args:
+            messages: 消息列表
+            response_format: 可选的json schema输出约束，服务端不支持时自动忽略
+            stop_when: 流式模式下对已收到的content进行判断，返回True时立即断开流
+            decision_type: 调用指标中的决策类型标签
+
+        Returns:
+            tuple: (content, reasoning_content)
+        """
+        start = time.monotonic()
+        _last_call_record.set(None)
+        if self.cache is None:
+            return await self._achat(messages, response_format, stop_when, decision_type)
+        result = await self.cache.aget_or_compute(
+            self._cache_key(messages, response_format), lambda: self._achat(messages, response_format, stop_when, decision_type)
+        )
+        if _last_call_record.get() is None:
+            self._record_cache_hit(decision_type, time.monotonic() - start)
+        return result
+
+    def _record_call(self, decision_type: Optional[str], total_latency: float, retries: int,
+                     timing: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None) -> None:
+        """记录一次实际发出请求的调用（成功或最终失败）"""
+        timing = timing or {}
+        usage = timing.get("usage") or {}
+        record = CallRecord(
+            player=self.player,
+            model=self.model,
+            endpoint=timing.get("endpoint"),
+            decision_type=decision_type,
+            latency=timing.get("latency", total_latency),
+            total_latency=total_latency,
+            ttft=timing.get("ttft"),
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            reasoning_tokens=usage.get("reasoning_tokens"),
+            cached_tokens=usage.get("cached_tokens"),
+            retries=retries,
+            hedged=timing.get("hedged", False),
+            error=type(error).__name__ if error is not None else None
+        )
+        _last_call_record.set(record)
+        record_call(record)
+        if record.cached_tokens and record.prompt_tokens:
+            logger.info(f"服务端前缀缓存命中 {record.cached_tokens}/{record.prompt_tokens} 个prompt token")
+
+    def _record_cache_hit(self, decision_type: Optional[str], latency: float) -> None:
+        record = CallRecord(
+            player=self.player, model=self.model, endpoint=None, decision_type=decision_type,
+            latency=latency, total_latency=latency, cache_hit=True
+        )
+        _last_call_record.set(record)
+        record_call(record)
+
+    def _hedge_delay(self, endpoints: List[str]) -> Optional[float]:
+        """当前应使用的对冲等待时间，不对冲时返回None"""
+        if not self.hedge or len(endpoints) < 2:
+            return None
+        return hedge_delay(self.endpoints, quantile=self.hedge_quantile)
+
+    def _backoff(self, attempt: int, error: Exception) -> Optional[float]:
+        """失败后下一次重试前的等待时间，错误不可重试或重试次数耗尽时返回None"""
+        if classify_error(error) == FATAL or attempt >= self.max_retries:
+            return None
+        return backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after_seconds(error))
+
+    def _fail(self, decision_type: Optional[str], start: float, attempts: int, error: Optional[Exception]):
+        """记录最终失败的调用并抛出对应的 LLMError"""
+        self._record_call(decision_type, time.monotonic() - start, max(0, attempts - 1), error=error)
+        if error is not None and classify_error(error) == FATAL:
+            raise LLMFatalError(str(error)) from error
+        raise LLMUnavailableError(f"{self.model} 在 {attempts} 次尝试后仍然失败: {error}") from error
+
+    def _breaker_wait(self) -> float:
+        """所有endpoint都熔断时需要等待的时间"""
+        return min(get_breaker(endpoint).retry_in() for endpoint in self.endpoints)
+
+    def _chat(self, messages, response_format: Optional[Dict] = None, stop_when: Optional[Callable[[str], bool]] = None,
+              decision_type: Optional[str] = None):
+        start = time.monotonic()
+        last_error: Optional[Exception] = None
+        # attempts 只统计实际发出请求的次数，等待熔断的次数单独计数，两者都不超过 max_retries + 1
+        attempts = 0
+        breaker_waits = 0
+        while attempts <= self.max_retries:
+            endpoints = available_endpoints(self.endpoints)
+            if endpoints:
+                attempts += 1
+                try:
+                    delay = self._hedge_delay(endpoints)
+                    if delay is None:
+                        content, reasoning_content, timing = self._chat_endpoint(
+                            choose_endpoint(endpoints), messages, response_format, stop_when
+                        )
+                    else:
+                        content, reasoning_content, timing = self._chat_hedged(endpoints, delay, messages, response_format, stop_when)
+                except EndpointBusyError:
+                    # 选中的endpoint刚被其他调用方占用了探测名额，本次没有发出请求
+                    attempts -= 1
+                except Exception as e:
+                    last_error = e
+                    backoff = self._backoff(attempts - 1, e)
+                    if backoff is None:
+                        break
+                    logger.warning(f"LLM调用出错（第 {attempts} 次），{backoff:.1f}s 后重试: {str(e)}")
+                    time.sleep(backoff)
+                    continue
+                else:
+                    timing["retries"] = attempts - 1
+                    self._set_timing(timing)
+                    self._record_call(decision_type, time.monotonic() - start, attempts - 1, timing)
+                    return content, reasoning_content
+            if breaker_waits >= self.max_retries:
+                break
+            breaker_waits += 1
+            wait_time = self._breaker_wait()
+            logger.warning(f"{self.model} 的所有endpoint均已熔断或正在探测，{wait_time:.1f}s 后重试")
+            time.sleep(wait_time)
+        self._fail(decision_type, start, attempts, last_error)
+
+    async def _achat(self, messages, response_format: Optional[Dict] = None, stop_when: Optional[Callable[[str], bool]] = None,
+                    decision_type: Optional[str] = None):
+        start = time.monotonic()
+        last_error: Optional[Exception] = None
+        # attempts 只统计实际发出请求的次数，等待熔断的次数单独计数，两者都不超过 max_retries + 1
+        attempts = 0
+        breaker_waits = 0
+        while attempts <= self.max_retries:
+            endpoints = available_endpoints(self.endpoints)
+            if endpoints:
+                attempts += 1
+                try:
+                    delay = self._hedge_delay(endpoints)
+                    if delay is None:
+                        content, reasoning_content, timing = await self._achat_endpoint(
+                            choose_endpoint(endpoints), messages, response_format, stop_when
+                        )
+                    else:
+                        content, reasoning_content, timing = await self._achat_hedged(endpoints, delay, messages, response_format, stop_when)
+                except EndpointBusyError:
+                    # 选中的endpoint刚被其他调用方占用了探测名额，本次没有发出请求
+                    attempts -= 1
+                except Exception as e:
+                    last_error = e
+                    backoff = self._backoff(attempts - 1, e)
+                    if backoff is None:
+                        break
+                    logger.warning(f"LLM异步调用出错（第 {attempts} 次），{backoff:.1f}s 后重试: {str(e)}")
+                    await asyncio.sleep(backoff)
+                    continue
+                else:
+                    timing["retries"] = attempts - 1
+                    self._set_timing(timing)
+                    self._record_call(decision_type, time.monotonic() - start, attempts - 1, timing)
+                    return content, reasoning_content
+            if breaker_waits >= self.max_retries:
+                break
+            breaker_waits += 1
+            wait_time = self._breaker_wait()
+            logger.warning(f"{self.model} 的所有endpoint均已熔断或正在探测，{wait_time:.1f}s 后重试")
+            await asyncio.sleep(wait_time)
+        self._fail(decision_type, start, attempts, last_error)
+
+    def _chat_hedged(self, endpoints: List[str], delay: float, messages, response_format, stop_when):
+        """先向一个副本发出请求，超过delay仍未返回时向另一个副本发出对冲请求，取先成功的结果
+
+        同步模式下落后的请求无法中断，会在后台执行完毕后自行释放并发名额。
+        """
+        primary = choose_endpoint(endpoints)
+        first = _hedge_executor.submit(self._chat_endpoint, primary, messages, response_format, stop_when)
         try:
-            logger.info(f"LLM请求: {messages}")
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                reasoning_effort=self.reasoning_effort,
-            )
-            if response.choices:
-                message = response.choices[0].message
-                content = message.content if message.content else ""
-                reasoning_content = getattr(message, "reasoning_content", "")
-                logger.info(f"LLM推理内容: {content}")
-                return content, reasoning_content
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
 
-            return "", ""
+        secondary = choose_endpoint(endpoints, exclude=[primary])
+        logger.info(f"{primary} 超过 {delay:.2f}s 未返回，向 {secondary} 发出对冲请求")
+        second = _hedge_executor.submit(self._chat_endpoint, secondary, messages, response_format, stop_when)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    result = future.result()
+                    result[2]["hedged"] = future is second
+                    return result
+                # 另一个请求确实发出并失败时，优先报告它的错误，而不是探测名额被占用
+                if error is None or isinstance(error, EndpointBusyError):
+                    error = future.exception()
+        raise error
+
+    async def _achat_hedged(self, endpoints: List[str], delay: float, messages, response_format, stop_when):
+        """_chat_hedged 的异步版本，落后的请求会被直接取消"""
+        primary = choose_endpoint(endpoints)
+        first = asyncio.ensure_future(self._achat_endpoint(primary, messages, response_format, stop_when))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        secondary = choose_endpoint(endpoints, exclude=[primary])
+        logger.info(f"{primary} 超过 {delay:.2f}s 未返回，向 {secondary} 发出对冲请求")
+        second = asyncio.ensure_future(self._achat_endpoint(secondary, messages, response_format, stop_when))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        result = task.result()
+                        result[2]["hedged"] = task is second
+                        return result
+                    if error is None or isinstance(error, EndpointBusyError):
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _read_stream(self, stream, start: float, stop_when: Optional[Callable[[str], bool]]):
+        """消费流式响应，stop_when 满足时提前断开
+
+        Returns:
+            tuple: (content, reasoning_content, ttft, time_to_decision, usage)，提前断开时 usage 可能为空
+        """
+        content_parts, reasoning_parts = [], []
+        ttft = None
+        time_to_decision = None
+        usage: Dict[str, Optional[int]] = {}
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = self._parse_usage(chunk.usage)
+                content_piece, reasoning_piece = self._parse_chunk(chunk)
+                if ttft is None and (content_piece or reasoning_piece):
+                    ttft = time.monotonic() - start
+                reasoning_parts.append(reasoning_piece)
+                content_parts.append(content_piece)
+                # 只有出现右括号时决策json才可能完整，避免每个token都解析一次
+                if stop_when is not None and "}" in content_piece and stop_when("".join(content_parts)):
+                    time_to_decision = time.monotonic() - start
+                    logger.info("决策已完整，提前结束流式输出")
+                    break
+        finally:
+            stream.close()
+        content = "".join(content_parts)
+        logger.info(f"LLM推理内容: {content}")
+        return content, "".join(reasoning_parts), ttft, time_to_decision, usage
+
+    async def _aread_stream(self, stream, start: float, stop_when: Optional[Callable[[str], bool]]):
+        """_read_stream 的异步版本"""
+        content_parts, reasoning_parts = [], []
+        ttft = None
+        time_to_decision = None
+        usage: Dict[str, Optional[int]] = {}
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    usage = self._parse_usage(chunk.usage)
+                content_piece, reasoning_piece = self._parse_chunk(chunk)
+                if ttft is None and (content_piece or reasoning_piece):
+                    ttft = time.monotonic() - start
+                reasoning_parts.append(reasoning_piece)
+                content_parts.append(content_piece)
+                if stop_when is not None and "}" in content_piece and stop_when("".join(content_parts)):
+                    time_to_decision = time.monotonic() - start
+                    logger.info("决策已完整，提前结束流式输出")
+                    break
+        finally:
+            await stream.close()
+        content = "".join(content_parts)
+        logger.info(f"LLM推理内容: {content}")
+        return content, "".join(reasoning_parts), ttft, time_to_decision, usage
+
+    def _chat_endpoint(self, endpoint: str, messages, response_format: Optional[Dict] = None,
+                       stop_when: Optional[Callable[[str], bool]] = None):
+        """向指定副本发出一次请求
+
+        Returns:
+            tuple: (content, reasoning_content, timing)
+        """
+        logger.info(f"LLM请求({endpoint}): {messages}")
+        request_kwargs = self._request_kwargs(endpoint, messages, response_format)
+        client = get_sync_client(endpoint, self.api_key)
+        limiter = get_limiter(endpoint)
+        breaker = get_breaker(endpoint)
+        probe = breaker.acquire()
+        if probe is None:
+            raise EndpointBusyError(endpoint)
+        content, reasoning_content = "", ""
+        ttft, time_to_decision = None, None
+        usage: Dict[str, Optional[int]] = {}
+        overloaded = False
+        rejected = False
+        with track_outstanding(endpoint):
+            limiter.acquire()
+            start = time.monotonic()
+            try:
+                if self.stream:
+                    stream = client.chat.completions.create(**request_kwargs, stream=True)
+                    content, reasoning_content, ttft, time_to_decision, usage = self._read_stream(stream, start, stop_when)
+                else:
+                    response = client.chat.completions.create(**request_kwargs)
+                    content, reasoning_content = self._parse_response(response)
+                    usage = self._parse_usage(getattr(response, "usage", None))
+            except Exception as e:
+                if "response_format" in request_kwargs and _is_response_format_rejected(e):
+                    self._disable_structured_output(endpoint, e)
+                    rejected = True
+                else:
+                    overloaded = is_overload_error(e)
+                    if classify_error(e) != FATAL:
+                        breaker.record_failure(probe)
+                    logger.error(f"LLM调用出错({endpoint}): {str(e)}")
+                    raise
+            else:
+                breaker.record_success(probe)
+            finally:
+                # 探测请求没有得出结果（不可重试的错误、被取消）时交还名额
+                breaker.release_probe(probe)
+                latency = time.monotonic() - start
+                limiter.release(latency, overloaded=overloaded)
+        if rejected:
+            return self._chat_endpoint(endpoint, messages, stop_when=stop_when)
+        if content:
+            record_latency(self.endpoints, time_to_decision or latency)
+        timing = {"endpoint": endpoint, "latency": latency, "ttft": ttft, "time_to_decision": time_to_decision, "hedged": False,
+                  "usage": usage}
+        return content, reasoning_content, timing
 
-        except Exception as e:
-            logger.error(f"LLM调用出错: {str(e)}")
-            return "", ""
\ No newline at end of file
+    async def _achat_endpoint(self, endpoint: str, messages, response_format: Optional[Dict] = None,
+                              stop_when: Optional[Callable[[str], bool]] = None):
+        """_chat_endpoint 的异步版本"""
+        logger.info(f"LLM异步请求({endpoint}): {messages}")
+        request_kwargs = self._request_kwargs(endpoint, messages, response_format)
+        limiter = get_limiter(endpoint)
+        breaker = get_breaker(endpoint)
+        probe = breaker.acquire()
+        if probe is None:
+            raise EndpointBusyError(endpoint)
+        content, reasoning_content = "", ""
+        ttft, time_to_decision = None, None
+        usage: Dict[str, Optional[int]] = {}
+        overloaded = False
+        rejected = False
+        with track_outstanding(endpoint):
+            await limiter.aacquire()
+            start = time.monotonic()
+            try:
+                client = get_async_client(endpoint, self.api_key)
+                if self.stream:
+                    stream = await client.chat.completions.create(**request_kwargs, stream=True)
+                    content, reasoning_content, ttft, time_to_decision, usage = await self._aread_stream(stream, start, stop_when)
+                else:
+                    response = await client.chat.completions.create(**request_kwargs)
+                    content, reasoning_content = self._parse_response(response)
+                    usage = self._parse_usage(getattr(response, "usage", None))
+            except Exception as e:
+                if "response_format" in request_kwargs and _is_response_format_rejected(e):
+                    self._disable_structured_output(endpoint, e)
+                    rejected = True
+                else:
+                    overloaded = is_overload_error(e)
+                    if classify_error(e) != FATAL:
+                        breaker.record_failure(probe)
+                    logger.error(f"LLM异步调用出错({endpoint}): {str(e)}")
+                    raise
+            else:
+                breaker.record_success(probe)
+            finally:
+                # 探测请求没有得出结果（不可重试的错误、被取消）时交还名额
+                breaker.release_probe(probe)
+                latency = time.monotonic() - start
+                limiter.release(latency, overloaded=overloaded)
+        if rejected:
+            return await self._achat_endpoint(endpoint, messages, stop_when=stop_when)
+        if content:
+            record_latency(self.endpoints, time_to_decision or latency)
+        timing = {"endpoint": endpoint, "latency": latency, "ttft": ttft, "time_to_decision": time_to_decision, "hedged": False,
+                  "usage": usage}
+        return content, reasoning_content, timing
@@ -0,0 +1,330 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "liars_bar_llm"
+LABEL_NAMES = ("player", "model", "endpoint", "decision_type")
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+Labels = Tuple[str, ...]
+
+
+@dataclass
+class CallRecord:
+    """一次 LLMClient.chat 调用的记录
+
+    latency 为最终成功的那次请求的耗时，total_latency 还包括之前失败的请求和退避等待。
+    """
+    player: Optional[str]
+    model: str
+    endpoint: Optional[str]
+    decision_type: Optional[str]
+    latency: float
+    total_latency: Optional[float] = None
+    ttft: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    reasoning_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    retries: int = 0
+    hedged: bool = False
+    cache_hit: bool = False
+    error: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @property
+    def labels(self) -> Labels:
+        return tuple("" if value is None else str(value) for value in
+                     (self.player, self.model, self.endpoint, self.decision_type))
+
+
+class Histogram:
+    """累积分桶直方图，桶的语义与 Prometheus 相同（le）"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+
+    def to_dict(self) -> Dict:
+        return {
+            "buckets": {str(upper): count for upper, count in zip(self.buckets, self.counts)},
+            "count": self.count,
+            "sum": self.sum
+        }
+
+
+# 指标名 -> (直方图的桶, 从记录中取值的字段)
+_HISTOGRAMS = {
+    "call_latency_seconds": (LATENCY_BUCKETS, "latency"),
+    "total_latency_seconds": (LATENCY_BUCKETS, "total_latency"),
+    "ttft_seconds": (LATENCY_BUCKETS, "ttft"),
+    "prompt_tokens": (TOKEN_BUCKETS, "prompt_tokens"),
+    "completion_tokens": (TOKEN_BUCKETS, "completion_tokens"),
+}
+
+# 计数器名 -> 从记录中取增量的字段
+_TOKEN_COUNTERS = {
+    "prompt_tokens_total": "prompt_tokens",
+    "completion_tokens_total": "completion_tokens",
+    "reasoning_tokens_total": "reasoning_tokens",
+    "cached_prompt_tokens_total": "cached_tokens",
+    "retries_total": "retries",
+}
+
+
+class MetricsRegistry:
+    """进程内的LLM调用指标聚合
+
+    按 (player, model, endpoint, decision_type) 聚合延迟、token数的直方图和计数器，
+    可以导出为 Prometheus 文本格式，或写成json快照。
+    """
+
+    def __init__(self, keep_records: int = 10000):
+        """
+        Args:
+            keep_records: 保留最近多少条原始调用记录，用于快照
+        """
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self.records: Deque[CallRecord] = deque(maxlen=keep_records)
+
+    def _inc(self, name: str, labels: Labels, value: float = 1) -> None:
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def record(self, call: CallRecord) -> None:
+        """记录一次调用"""
+        labels = call.labels
+        with self._lock:
+            self.records.append(call)
+            if call.cache_hit:
+                self._inc("cache_hits_total", labels)
+                return
+            self._inc("calls_total", labels)
+            if call.error is not None:
+                self._inc("errors_total", labels)
+            if call.hedged:
+                self._inc("hedged_total", labels)
+            for name, attr in _TOKEN_COUNTERS.items():
+                value = getattr(call, attr)
+                if value:
+                    self._inc(name, labels, value)
+            if call.error is not None:
+                return
+            for name, (buckets, attr) in _HISTOGRAMS.items():
+                value = getattr(call, attr)
+                if value is None:
+                    continue
+                histogram = self._histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self._histograms[(name, labels)] = Histogram(buckets)
+                histogram.observe(value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.records.clear()
+
+    def snapshot(self, include_records: bool = False) -> Dict:
+        """当前所有指标的json可序列化快照"""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(zip(LABEL_NAMES, labels)), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {"name": name, "labels": dict(zip(LABEL_NAMES, labels)), **histogram.to_dict()}
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+            records = [record.to_dict() for record in self.records] if include_records else None
+        snapshot = {"timestamp": time.time(), "pid": os.getpid(), "counters": counters, "histograms": histograms}
+        if records is not None:
+            snapshot["records"] = records
+        return snapshot
+
+    def write_snapshot(self, path: str, include_records: bool = False) -> None:
+        """原子地把快照写入json文件"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(include_records), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def to_prometheus(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines: List[str] = []
+        with self._lock:
+            counter_names = sorted({name for name, _ in self._counters})
+            for name in counter_names:
+                metric = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# TYPE {metric} counter")
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{metric}{{{_format_labels(labels)}}} {_format_value(value)}")
+            histogram_names = sorted({name for name, _ in self._histograms})
+            for name in histogram_names:
+                metric = f"{METRIC_PREFIX}_{name}"
+                lines.append(f"# TYPE {metric} histogram")
+                for (histogram_name, labels), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    label_text = _format_labels(labels)
+                    for upper, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{metric}_bucket{{{label_text},le="{_format_value(upper)}"}} {count}')
+                    lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {histogram.count}')
+                    lines.append(f"{metric}_sum{{{label_text}}} {_format_value(histogram.sum)}")
+                    lines.append(f"{metric}_count{{{label_text}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """在后台线程中提供 /metrics（Prometheus文本）和 /snapshot（json）"""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def do_GET(self):
+                if self.path.startswith("/snapshot"):
+                    body = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics") or self.path == "/":
+                    body = registry.to_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="llm-metrics-http", daemon=True).start()
+        logger.info(f"LLM指标服务已启动: http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+    def start_snapshot_writer(self, path: str, interval: float = 30.0,
+                              include_records: bool = False) -> Callable[[], None]:
+        """在后台线程中每隔 interval 秒写一次快照
+
+        Returns:
+            Callable: 停止函数，调用后写出最后一次快照并等待线程结束
+        """
+        stop_event = threading.Event()
+
+        def loop():
+            while not stop_event.wait(interval):
+                self._try_write_snapshot(path, include_records)
+            self._try_write_snapshot(path, include_records)
+
+        thread = threading.Thread(target=loop, name="llm-metrics-snapshot", daemon=True)
+        thread.start()
+
+        def stop():
+            stop_event.set()
+            thread.join()
+
+        return stop
+
+    def _try_write_snapshot(self, path: str, include_records: bool) -> None:
+        try:
+            self.write_snapshot(path, include_records)
+        except OSError as e:
+            logger.error(f"写入LLM指标快照失败: {str(e)}")
+
+
+def _format_labels(labels: Labels) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(LABEL_NAMES, labels))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# 进程内共享的默认指标
+metrics = MetricsRegistry()
+
+# measure_calls 期间收集当前线程/协程的调用记录
+_call_collector: contextvars.ContextVar[Optional[List[CallRecord]]] = contextvars.ContextVar("call_collector", default=None)
+
+
+def record_call(call: CallRecord) -> None:
+    """把调用记录计入默认指标，并交给当前的 measure_calls（如果有）"""
+    metrics.record(call)
+    collector = _call_collector.get()
+    if collector is not None:
+        collector.append(call)
+
+
+def summarize_calls(calls: Sequence[CallRecord], latency: float) -> Dict:
+    """汇总一次决策中的所有LLM调用
+
+    Args:
+        calls: 决策期间的调用记录
+        latency: 决策的总耗时（秒）
+
+    Returns:
+        Dict: latency, llm_calls, cache_hits, llm_retries, errors 以及各类token数之和；
+            没有任何调用返回用量时token数为None
+    """
+    requested = [call for call in calls if not call.cache_hit]
+    summary = {
+        "latency": latency,
+        "llm_calls": len(requested),
+        "cache_hits": len(calls) - len(requested),
+        "llm_retries": sum(call.retries for call in requested),
+        "errors": sum(1 for call in requested if call.error is not None),
+    }
+    for attr in ("prompt_tokens", "completion_tokens", "reasoning_tokens", "cached_tokens"):
+        values = [getattr(call, attr) for call in requested if getattr(call, attr) is not None]
+        summary[attr] = sum(values) if values else None
+    return summary
+
+
+@contextmanager
+def measure_calls() -> Iterator[Dict]:
+    """统计代码块内当前线程/协程发出的LLM调用，退出时把 summarize_calls 的结果写入产出的字典"""
+    calls: List[CallRecord] = []
+    token = _call_collector.set(calls)
+    start = time.monotonic()
+    stats: Dict = {}
+    try:
+        yield stats
+    finally:
+        _call_collector.reset(token)
+        stats.update(summarize_calls(calls, time.monotonic() - start))
@@ -0,0 +1,75 @@
+import itertools
+import math
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterable, Optional, Sequence, Tuple
+
+# 计算对冲延迟时使用的最近延迟样本数，以及开始对冲前需要的最少样本数
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+
+_lock = threading.Lock()
+# endpoint -> 当前进程内在途请求数
+_outstanding: Dict[str, int] = defaultdict(int)
+# 副本组 -> 最近的请求延迟
+_latencies: Dict[Tuple[str, ...], Deque[float]] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+# 在途请求数相同时轮流选择，避免总是落到第一个副本上
+_tie_breaker = itertools.count()
+
+
+def choose_endpoint(endpoints: Sequence[str], exclude: Iterable[str] = ()) -> str:
+    """选择在途请求数最少的副本
+
+    Args:
+        endpoints: 同一模型的副本列表
+        exclude: 不参与选择的副本（例如对冲请求要避开主请求所在副本）
+
+    Returns:
+        str: 选中的副本；全部被排除时返回第一个副本
+    """
+    excluded = set(exclude)
+    candidates = [endpoint for endpoint in endpoints if endpoint not in excluded]
+    if not candidates:
+        return endpoints[0]
+    with _lock:
+        offset = next(_tie_breaker) % len(candidates)
+        rotated = candidates[offset:] + candidates[:offset]
+        return min(rotated, key=lambda endpoint: _outstanding[endpoint])
+
+
+@contextmanager
+def track_outstanding(endpoint: str):
+    """在请求期间把endpoint的在途请求数加一"""
+    with _lock:
+        _outstanding[endpoint] += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _outstanding[endpoint] -= 1
+
+
+def outstanding(endpoint: str) -> int:
+    with _lock:
+        return _outstanding[endpoint]
+
+
+def record_latency(endpoints: Sequence[str], latency: float) -> None:
+    """记录副本组的一次成功请求延迟"""
+    with _lock:
+        _latencies[tuple(endpoints)].append(latency)
+
+
+def hedge_delay(endpoints: Sequence[str], quantile: float = 0.95, min_delay: float = 0.5) -> Optional[float]:
+    """副本组最近延迟的分位数，作为发出对冲请求前的等待时间
+
+    Returns:
+        Optional[float]: 等待秒数；样本不足时返回None，表示暂不对冲
+    """
+    with _lock:
+        samples = sorted(_latencies[tuple(endpoints)])
+    if len(samples) < MIN_HEDGE_SAMPLES:
+        return None
+    index = min(len(samples) - 1, math.ceil(quantile * len(samples)) - 1)
+    return max(min_delay, samples[index])
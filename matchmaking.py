@@ -0,0 +1,80 @@
+import itertools
+import math
+import random
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+from ratings import Ratings
+
+DEFAULT_TABLE_SIZE = 4
+# 候选桌数超过该值时随机抽样评估
+DEFAULT_MAX_CANDIDATES = 5000
+
+
+class Matchmaker:
+    """按当前评分挑选下一桌玩家
+
+    一桌的信息量按每对玩家累加：两人越接近（胜负概率越接近五五开）、评分越不确定，这一对的对局越能改变排名。
+    已分派但还没有结果的对局视为已经降低了不确定度，避免并发时反复挑选同一桌。
+    """
+
+    def __init__(self, player_names: Sequence[str], ratings: Ratings, table_size: int = DEFAULT_TABLE_SIZE,
+                 max_candidates: int = DEFAULT_MAX_CANDIDATES, rng: Optional[random.Random] = None):
+        """
+        Args:
+            player_names: 候选玩家
+            ratings: 评分，结果返回后由调用方更新
+            table_size: 每桌人数
+            max_candidates: 每次最多评估的候选桌数
+            rng: 抽样候选桌和打破平分用的随机数生成器
+        """
+        if not 2 <= table_size <= len(player_names):
+            raise ValueError(f"每桌人数需在2到候选玩家数 {len(player_names)} 之间，当前为 {table_size}")
+        self.player_names = list(player_names)
+        self.ratings = ratings
+        self.table_size = table_size
+        self.max_candidates = max_candidates
+        self.rng = rng or random.Random()
+        self._in_flight: Dict[str, int] = defaultdict(int)
+
+    def _uncertainty(self, player: str) -> float:
+        return self.ratings.uncertainty(player) / math.sqrt(1 + self._in_flight[player])
+
+    def table_score(self, table: Sequence[str]) -> float:
+        """一桌的预期信息量"""
+        score = 0.0
+        for a, b in itertools.combinations(table, 2):
+            p = self.ratings.win_probability(a, b)
+            score += 4 * p * (1 - p) * (self._uncertainty(a) + self._uncertainty(b))
+        return score
+
+    def _candidates(self) -> List[Tuple[str, ...]]:
+        total = math.comb(len(self.player_names), self.table_size)
+        if total <= self.max_candidates:
+            return list(itertools.combinations(self.player_names, self.table_size))
+        return [tuple(self.rng.sample(self.player_names, self.table_size)) for _ in range(self.max_candidates)]
+
+    def next_table(self) -> List[str]:
+        """挑选信息量最大的一桌并记为已分派，座位顺序随机"""
+        best_score = -1.0
+        best: List[Tuple[str, ...]] = []
+        for table in self._candidates():
+            score = self.table_score(table)
+            if score > best_score + 1e-9:
+                best_score, best = score, [table]
+            elif abs(score - best_score) <= 1e-9:
+                best.append(table)
+        table = list(self.rng.choice(best))
+        self.rng.shuffle(table)
+        self.start(table)
+        return table
+
+    def start(self, table: Sequence[str]) -> None:
+        """记录一桌已分派"""
+        for player in table:
+            self._in_flight[player] += 1
+
+    def finish(self, table: Sequence[str]) -> None:
+        """记录一桌已返回结果（或失败）"""
+        for player in table:
+            if self._in_flight[player] > 0:
+                self._in_flight[player] -= 1
@@ -1,30 +1,76 @@
 import yaml
 import argparse
-import multiprocessing
 from game import Game
-from tqdm import tqdm
+from matchmaking import DEFAULT_TABLE_SIZE
+from ratings import RATING_BACKENDS
+from tournament import Tournament, print_ledger
+from tournament_stats import STOP_METRICS, STOP_TARGETS
 
 def run_single_game(game_info):
     """运行单场游戏"""
     game_num, player_configs = game_info
     print(f"\n=== 开始第 {game_num} 局游戏 ===")
     game = Game(player_configs)
-    game.play()
+    game.start_game()
     print(f"第 {game_num} 局游戏结束")
     return game.game_record
 
 class MultiGameRunner:
-    def __init__(self, player_configs: list[dict[str, str]], num_games: int = 10, max_parallel_requests: int = 20):
+    def __init__(self, player_configs: list[dict[str, str]], num_games: int = 10, max_parallel_requests: int = 20,
+                 max_inflight_per_endpoint: int = 64, initial_inflight_per_endpoint: int = 8,
+                 metrics_dir: str = None, tables_per_process: int = 1, ledger_path: str = None,
+                 max_attempts: int = 2, seed: int = None, duplicate: bool = False, stop_confidence: float = None,
+                 stop_metric: str = "win_rate", stop_target: str = "top1", min_games: int = 20,
+                 matchmaking: bool = False, table_size: int = DEFAULT_TABLE_SIZE, ratings_path: str = None,
+                 rating_backend: str = None):
         """初始化多局游戏运行器
 
         Args:
             player_configs: 玩家配置列表
             num_games: 要运行的游戏局数
-            max_parallel_requests: 最大并行请求数
+            max_parallel_requests: 最大并行游戏进程数
+            max_inflight_per_endpoint: 每个endpoint同时在途请求数的上限，所有进程共享
+            initial_inflight_per_endpoint: 每个endpoint并发窗口的初始值，之后按AIMD自适应调整
+            metrics_dir: 每个工作进程定期把LLM调用指标快照写入该目录下的 metrics_<pid>.json
+            tables_per_process: 每个工作进程在同一个事件循环中并发运行的游戏局数
+            ledger_path: 任务账本的SQLite路径，已存在时跳过其中已完成的游戏继续运行，None表示新建
+            max_attempts: 每局游戏失败后最多尝试的次数
+            seed: 锦标赛种子，每局游戏的种子由它派生，None表示随机生成
+            duplicate: 复式赛，同一副发牌由各模型轮换座位各打一次
+            stop_confidence: 排名在该置信水平下确定后提前结束，None表示运行全部局数
+            stop_metric: 排名依据（win_rate 或 points）
+            stop_target: 提前结束的条件（top1 或 ranking）
+            min_games: 至少完成的局数，之后才检查是否提前结束
+            matchmaking: 把玩家配置作为玩家池，每局按评分挑选 table_size 名玩家
+            table_size: 匹配模式下每桌的人数
+            ratings_path: 评分json路径，None时匹配模式放在账本旁边，否则不计算评分
+            rating_backend: 评分方式（elo 或 trueskill），None表示沿用评分文件中的
         """
         self.player_configs = player_configs
         self.num_games = num_games
         self.max_parallel_requests = max_parallel_requests
+        self.limiter_settings = {
+            "max_limit": max_inflight_per_endpoint,
+            "initial_limit": initial_inflight_per_endpoint,
+        }
+        self.metrics_dir = metrics_dir
+        self.tables_per_process = max(1, tables_per_process)
+        self.ledger_path = ledger_path
+        self.max_attempts = max_attempts
+        self.seed = seed
+        self.duplicate = duplicate
+        self.stop_settings = {
+            "stop_confidence": stop_confidence,
+            "stop_metric": stop_metric,
+            "stop_target": stop_target,
+            "min_games": min_games,
+        }
+        self.matchmaking_settings = {
+            "matchmaking": matchmaking,
+            "table_size": table_size,
+            "ratings_path": ratings_path,
+            "rating_backend": rating_backend,
+        }
 
     def run(self) -> None:
         """运行指定数量的游戏"""
@@ -36,12 +82,29 @@ class MultiGameRunner:
                 print("警告: 与HumanPlayer对战时，仅支持单局游戏。将只运行一局。")
             run_single_game((1, self.player_configs))
         else:
-            """并行运行指定数量的游戏"""
-            with multiprocessing.Pool(processes=self.max_parallel_requests) as pool:
-                game_infos = [(i + 1, self.player_configs) for i in range(self.num_games)]
-                results = list(tqdm(pool.imap(run_single_game, game_infos), total=self.num_games, desc="运行游戏"))
-            # 在这里可以处理 results，例如保存游戏记录等
-            print(f"\n所有 {self.num_games} 局游戏已完成。")
+            """并行运行指定数量的游戏，进度记录在任务账本中"""
+            tournament = Tournament(
+                self.player_configs,
+                self.num_games,
+                ledger_path=self.ledger_path,
+                processes=self.max_parallel_requests,
+                tables_per_process=self.tables_per_process,
+                max_attempts=self.max_attempts,
+                limiter_settings=self.limiter_settings,
+                metrics_dir=self.metrics_dir,
+                seed=self.seed,
+                duplicate=self.duplicate,
+                **self.stop_settings,
+                **self.matchmaking_settings
+            )
+            counts = tournament.run()
+            if counts["failed"]:
+                print(f"警告: {counts['failed']} 局游戏多次尝试后仍未完成，详见日志。")
+            if counts["done"] >= tournament.num_games:
+                print(f"\n所有 {tournament.num_games} 局游戏已完成。")
+            elif tournament.stopped_early:
+                print(f"\n排名已经确定，提前结束：完成 {counts['done']}/{tournament.num_games} 局游戏。")
+            print_ledger(tournament.ledger_path, self.stop_settings["stop_confidence"] or 0.95)
 
 def parse_arguments():
     """解析命令行参数"""
@@ -64,6 +127,106 @@ def parse_arguments():
         default=20,
         help='最大并行游戏数 (默认: 20)'
     )
+    parser.add_argument(
+        '--max_inflight_per_endpoint',
+        type=int,
+        default=64,
+        help='每个endpoint同时在途LLM请求数的上限，所有游戏进程共享 (默认: 64)'
+    )
+    parser.add_argument(
+        '--initial_inflight_per_endpoint',
+        type=int,
+        default=8,
+        help='每个endpoint并发窗口的初始值，之后根据延迟和错误率自适应调整 (默认: 8)'
+    )
+    parser.add_argument(
+        '--llm_cache',
+        type=str,
+        default=None,
+        help='启用LLM响应缓存并指定SQLite文件路径 (默认: 不启用)'
+    )
+    parser.add_argument(
+        '--metrics_dir',
+        type=str,
+        default=None,
+        help='每个工作进程定期把LLM调用指标快照写入该目录 (默认: 不启用)'
+    )
+    parser.add_argument(
+        '--tables_per_process',
+        type=int,
+        default=1,
+        help='每个工作进程在一个事件循环中并发运行的游戏局数 (默认: 1)'
+    )
+    parser.add_argument(
+        '--ledger',
+        type=str,
+        default=None,
+        help='任务账本的SQLite路径，指定已有的账本时跳过已完成的游戏继续运行 (默认: 在tournaments目录下新建)'
+    )
+    parser.add_argument(
+        '--max_attempts',
+        type=int,
+        default=2,
+        help='每局游戏失败后最多尝试的次数 (默认: 2)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='锦标赛随机种子，每局游戏的发牌、目标牌和子弹位置由它派生 (默认: 随机生成并记录在账本中)'
+    )
+    parser.add_argument(
+        '--duplicate',
+        action='store_true',
+        help='复式赛：每副发牌连续打与玩家数相同的局数，每局轮换一次座位，局数向上取整为玩家数的倍数'
+    )
+    parser.add_argument(
+        '--stop_confidence',
+        type=float,
+        default=None,
+        help='排名在该置信水平（如0.95）下确定后提前结束，不再开始新的游戏 (默认: 运行全部局数)'
+    )
+    parser.add_argument(
+        '--stop_metric',
+        choices=STOP_METRICS,
+        default='win_rate',
+        help='提前结束时的排名依据：win_rate 胜率（Wilson区间）或 points 平均存活积分（bootstrap区间） (默认: win_rate)'
+    )
+    parser.add_argument(
+        '--stop_target',
+        choices=STOP_TARGETS,
+        default='top1',
+        help='提前结束的条件：top1 第一名确定，ranking 完整排名确定 (默认: top1)'
+    )
+    parser.add_argument(
+        '--min_games',
+        type=int,
+        default=20,
+        help='至少完成的局数，之后才检查是否提前结束 (默认: 20)'
+    )
+    parser.add_argument(
+        '--matchmaking',
+        action='store_true',
+        help='匹配模式：配置中的玩家作为玩家池，每局按当前评分挑选最能区分排名的一桌'
+    )
+    parser.add_argument(
+        '--table_size',
+        type=int,
+        default=DEFAULT_TABLE_SIZE,
+        help=f'匹配模式下每桌的人数 (默认: {DEFAULT_TABLE_SIZE})'
+    )
+    parser.add_argument(
+        '--ratings',
+        type=str,
+        default=None,
+        help='评分json路径，已存在时在其基础上更新 (默认: 匹配模式下放在账本旁边，否则不计算评分)'
+    )
+    parser.add_argument(
+        '--rating_backend',
+        choices=RATING_BACKENDS,
+        default=None,
+        help='评分方式：elo 或 trueskill（需要 pip install trueskill） (默认: 沿用评分文件中的，新建时为elo)'
+    )
     return parser.parse_args()
 
 if __name__ == '__main__':
@@ -73,7 +236,30 @@ if __name__ == '__main__':
     with open(args.config, 'r') as f:
         config_data = yaml.safe_load(f)
     player_configs = config_data['player_configs']
+    if args.llm_cache:
+        for player_config in player_configs:
+            player_config.setdefault('cache_path', args.llm_cache)
 
     # 运行多次游戏
-    runner = MultiGameRunner(player_configs, num_games=args.num_games, max_parallel_requests=args.max_parallel_requests)
+    runner = MultiGameRunner(
+        player_configs,
+        num_games=args.num_games,
+        max_parallel_requests=args.max_parallel_requests,
+        max_inflight_per_endpoint=args.max_inflight_per_endpoint,
+        initial_inflight_per_endpoint=args.initial_inflight_per_endpoint,
+        metrics_dir=args.metrics_dir,
+        tables_per_process=args.tables_per_process,
+        ledger_path=args.ledger,
+        max_attempts=args.max_attempts,
+        seed=args.seed,
+        duplicate=args.duplicate,
+        stop_confidence=args.stop_confidence,
+        stop_metric=args.stop_metric,
+        stop_target=args.stop_target,
+        min_games=args.min_games,
+        matchmaking=args.matchmaking,
+        table_size=args.table_size,
+        ratings_path=args.ratings,
+        rating_backend=args.rating_backend
+    )
     runner.run()
\ No newline at end of file
@@ -1,9 +1,20 @@
-import random
+import asyncio
 import json
-import re
+import random
 import logging
-from typing import List, Dict, Optional, Tuple, Any
+from collections import Counter, defaultdict
+from typing import Callable, List, Dict, Optional, Tuple, Any, Union
 from llm_client import LLMClient
+from resilience import LLMError
+from decision_parser import (
+    extract_last_json_object, repair_play_decision, repair_challenge_decision,
+    play_decision_response_format, challenge_decision_response_format,
+    PLAY_DECISION_KEYS, CHALLENGE_DECISION_KEYS
+)
+from prompt_templates import registry as prompt_registry
+from conversation import DEFAULT_CONVERSATION_TOKEN_BUDGET, RoundConversation
+from game_record import ACTION_LOG_STYLES
+from prompt_builder import DEFAULT_OPINION_MAX_TOKENS, PromptBuilder
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
@@ -22,8 +33,112 @@ RULE_BASE_PATH = "prompt/rule_base.txt"
 PLAY_CARD_PROMPT_TEMPLATE_PATH = "prompt/play_card_prompt_template.txt"
 CHALLENGE_PROMPT_TEMPLATE_PATH = "prompt/challenge_prompt_template.txt"
 REFLECT_PROMPT_TEMPLATE_PATH = "prompt/reflect_prompt_template.txt"
+REFLECT_ALL_PROMPT_TEMPLATE_PATH = "prompt/reflect_all_prompt_template.txt"
+
+# prefix_stable布局：规则和身份放在每个玩家固定不变的system消息中，user消息按变化频率从低到高排列
+SYSTEM_PROMPT_TEMPLATE_PATH = "prompt/system_prompt_template.txt"
+PREFIX_STABLE_TEMPLATE_PATHS = {
+    PLAY_CARD_PROMPT_TEMPLATE_PATH: "prompt/play_card_prefix_stable_template.txt",
+    CHALLENGE_PROMPT_TEMPLATE_PATH: "prompt/challenge_prefix_stable_template.txt",
+    REFLECT_PROMPT_TEMPLATE_PATH: "prompt/reflect_prefix_stable_template.txt",
+    REFLECT_ALL_PROMPT_TEMPLATE_PATH: "prompt/reflect_all_prefix_stable_template.txt",
+}
+# conversation模式：每轮一段多轮对话，{context} 为完整的轮次情况或新增的操作记录
+CONVERSATION_TEMPLATE_PATHS = {
+    PLAY_CARD_PROMPT_TEMPLATE_PATH: "prompt/conversation_play_card_template.txt",
+    CHALLENGE_PROMPT_TEMPLATE_PATH: "prompt/conversation_challenge_template.txt",
+    REFLECT_PROMPT_TEMPLATE_PATH: "prompt/conversation_reflect_template.txt",
+    REFLECT_ALL_PROMPT_TEMPLATE_PATH: "prompt/conversation_reflect_all_template.txt",
+}
+
+# 出牌/质疑决策最多请求LLM的次数
+MAX_DECISION_ATTEMPTS = 5
+
+# 模板在进程内只加载一次，规则文本作为静态前缀直接嵌入模板
+prompt_registry.register(
+    PLAY_CARD_PROMPT_TEMPLATE_PATH,
+    placeholders=["self_name", "round_base_info", "round_action_info", "play_decision_info", "current_cards"],
+    includes={"rules": RULE_BASE_PATH}
+)
+prompt_registry.register(
+    CHALLENGE_PROMPT_TEMPLATE_PATH,
+    placeholders=["self_name", "round_base_info", "round_action_info", "self_hand", "challenge_decision_info",
+                  "challenging_player_performance", "extra_hint"],
+    includes={"rules": RULE_BASE_PATH}
+)
+prompt_registry.register(
+    REFLECT_PROMPT_TEMPLATE_PATH,
+    placeholders=["self_name", "round_base_info", "round_action_info", "round_result", "player", "previous_opinion"],
+    includes={"rules": RULE_BASE_PATH}
+)
+prompt_registry.register(
+    REFLECT_ALL_PROMPT_TEMPLATE_PATH,
+    placeholders=["self_name", "round_base_info", "round_action_info", "round_result", "players", "previous_opinions"],
+    includes={"rules": RULE_BASE_PATH}
+)
+
+prompt_registry.register(
+    SYSTEM_PROMPT_TEMPLATE_PATH,
+    placeholders=["self_name"],
+    includes={"rules": RULE_BASE_PATH}
+)
+prompt_registry.register(
+    PREFIX_STABLE_TEMPLATE_PATHS[PLAY_CARD_PROMPT_TEMPLATE_PATH],
+    placeholders=["round_base_info", "round_action_info", "play_decision_info", "current_cards"]
+)
+prompt_registry.register(
+    PREFIX_STABLE_TEMPLATE_PATHS[CHALLENGE_PROMPT_TEMPLATE_PATH],
+    placeholders=["round_base_info", "round_action_info", "self_hand", "challenge_decision_info",
+                  "challenging_player_performance", "extra_hint"]
+)
+prompt_registry.register(
+    PREFIX_STABLE_TEMPLATE_PATHS[REFLECT_PROMPT_TEMPLATE_PATH],
+    placeholders=["round_base_info", "round_action_info", "round_result", "player", "previous_opinion"]
+)
+prompt_registry.register(
+    PREFIX_STABLE_TEMPLATE_PATHS[REFLECT_ALL_PROMPT_TEMPLATE_PATH],
+    placeholders=["round_base_info", "round_action_info", "round_result", "players", "previous_opinions"]
+)
+
+prompt_registry.register(
+    CONVERSATION_TEMPLATE_PATHS[PLAY_CARD_PROMPT_TEMPLATE_PATH],
+    placeholders=["context", "play_decision_info", "current_cards"]
+)
+prompt_registry.register(
+    CONVERSATION_TEMPLATE_PATHS[CHALLENGE_PROMPT_TEMPLATE_PATH],
+    placeholders=["context", "self_hand", "challenge_decision_info", "challenging_player_performance", "extra_hint"]
+)
+prompt_registry.register(
+    CONVERSATION_TEMPLATE_PATHS[REFLECT_PROMPT_TEMPLATE_PATH],
+    placeholders=["context", "round_result", "player", "previous_opinion"]
+)
+prompt_registry.register(
+    CONVERSATION_TEMPLATE_PATHS[REFLECT_ALL_PROMPT_TEMPLATE_PATH],
+    placeholders=["context", "round_result", "players", "previous_opinions"]
+)
+
+# 上下文模式：stateless 每次请求都发送完整的轮次情况；conversation 每轮保持一段多轮对话，只追加新增的操作
+CONTEXT_MODES = ("stateless", "conversation")
+
+# 提示词布局：default 单条user消息；prefix_stable 固定的system消息 + 静态内容在前、动态内容在后的user消息，
+# 便于服务端的前缀缓存（vLLM/SGLang automatic prefix caching）在每次决策中命中
+PROMPT_LAYOUTS = ("default", "prefix_stable")
+
+# 反思模式：per_player 对每个对手单独发起一次请求；batch 一次请求同时更新所有对手的印象
+REFLECTION_MODES = ("per_player", "batch")
+
+# 模板 -> 决策类型，用于记录每次决策的提示词大小
+TEMPLATE_DECISION_TYPES = {
+    PLAY_CARD_PROMPT_TEMPLATE_PATH: "play",
+    CHALLENGE_PROMPT_TEMPLATE_PATH: "challenge",
+    REFLECT_PROMPT_TEMPLATE_PATH: "reflect",
+    REFLECT_ALL_PROMPT_TEMPLATE_PATH: "reflect_all",
+}
 
 class Player:
+    reflection_mode = "per_player"
+    action_log_style = "prose"
+
     def __init__(self, name: str, **kwargs):
         """初始化玩家基类"""
         self.name = name
@@ -52,8 +167,71 @@ class Player:
     def decide_challenge(self, round_base_info: str, round_action_info: str, challenge_decision_info: str, challenging_player_performance: str, extra_hint: str) -> bool:
         raise NotImplementedError
 
+    async def achoose_cards_to_play(self, round_base_info: str, round_action_info: str, play_decision_info: str) -> Dict:
+        """异步出牌，默认在线程中执行同步版本（例如等待人类输入），不阻塞事件循环"""
+        return await asyncio.to_thread(self.choose_cards_to_play, round_base_info, round_action_info, play_decision_info)
+
+    async def adecide_challenge(self, round_base_info: str, round_action_info: str, challenge_decision_info: str, challenging_player_performance: str, extra_hint: str) -> bool:
+        """异步质疑决策，默认在线程中执行同步版本"""
+        return await asyncio.to_thread(
+            self.decide_challenge, round_base_info, round_action_info, challenge_decision_info, challenging_player_performance, extra_hint
+        )
+
     def reflect(self, alive_players: List[str], round_base_info: str, round_action_info: str, round_result: str) -> None:
-        pass
+        """轮次结束后对其他存活玩家进行反思，更新对他们的印象"""
+        player_names = [name for name in alive_players if name != self.name]
+        self.opinions.update(self.reflect_on_players(player_names, round_base_info, round_action_info, round_result))
+
+    async def areflect(self, alive_players: List[str], round_base_info: str, round_action_info: str, round_result: str) -> None:
+        """reflect 的异步版本"""
+        player_names = [name for name in alive_players if name != self.name]
+        self.opinions.update(await self.areflect_on_players(player_names, round_base_info, round_action_info, round_result))
+
+    def reflect_on_players(self, player_names: List[str], round_base_info: str, round_action_info: str, round_result: str) -> Dict[str, str]:
+        """对一组玩家进行反思，返回 {玩家名: 更新后的印象}，未能更新的玩家不出现在结果中"""
+        opinions = {}
+        for player_name in player_names:
+            opinion = self.reflect_on_player(player_name, round_base_info, round_action_info, round_result)
+            if opinion is not None:
+                opinions[player_name] = opinion
+        return opinions
+
+    def reflect_on_player(self, player_name: str, round_base_info: str, round_action_info: str, round_result: str) -> Optional[str]:
+        """对单个玩家进行反思，返回更新后的印象；不进行反思时返回None
+
+        各次调用之间相互独立且不修改自身状态，因此可以并发执行，由调用方写回opinions。
+        """
+        return None
+
+    async def areflect_on_players(self, player_names: List[str], round_base_info: str, round_action_info: str, round_result: str) -> Dict[str, str]:
+        """reflect_on_players 的异步版本，对各玩家的反思并发执行"""
+        results = await asyncio.gather(*(
+            self.areflect_on_player(player_name, round_base_info, round_action_info, round_result)
+            for player_name in player_names
+        ))
+        return {player_name: opinion for player_name, opinion in zip(player_names, results) if opinion is not None}
+
+    async def areflect_on_player(self, player_name: str, round_base_info: str, round_action_info: str, round_result: str) -> Optional[str]:
+        """reflect_on_player 的异步版本，默认在线程中执行同步版本"""
+        return await asyncio.to_thread(self.reflect_on_player, player_name, round_base_info, round_action_info, round_result)
+
+    def checkpoint_state(self) -> Dict:
+        """检查点中保存的玩家状态"""
+        return {
+            "hand": list(self.hand),
+            "alive": self.alive,
+            "bullet_position": self.bullet_position,
+            "current_bullet_position": self.current_bullet_position,
+            "opinions": dict(self.opinions),
+        }
+
+    def restore_state(self, state: Dict) -> None:
+        """从检查点恢复玩家状态"""
+        self.hand = list(state["hand"])
+        self.alive = state["alive"]
+        self.bullet_position = state["bullet_position"]
+        self.current_bullet_position = state["current_bullet_position"]
+        self.opinions = dict(state["opinions"])
 
     def process_penalty(self) -> bool:
         """处理射击惩罚，返回玩家是否存活"""
@@ -66,23 +244,149 @@ class Player:
         return self.alive
 
 class LLMPlayer(Player):
-    def __init__(self, name: str, model: str = DEFAULT_MODEL_NAME, base_url: str = DEFAULT_BASE_URL, api_key: str = DEFAULT_API_KEY, reasoning_effort: str = 'low', **kwargs):
+    def __init__(self, name: str, model: str = DEFAULT_MODEL_NAME, base_url: Union[str, List[str]] = DEFAULT_BASE_URL, api_key: str = DEFAULT_API_KEY, reasoning_effort: str = 'low', cache_path: Optional[str] = None, reflection_mode: str = "per_player", structured_output: bool = True, stream: bool = False, hedge: bool = False, max_retries: int = 4, prompt_layout: str = "default", context_mode: str = "stateless", conversation_token_budget: int = DEFAULT_CONVERSATION_TOKEN_BUDGET, tokenizer: str = "estimate", prompt_token_budget: Optional[int] = None, action_log_style: str = "prose", opinion_policy: str = "full", opinion_max_tokens: int = DEFAULT_OPINION_MAX_TOKENS, request_params: Optional[Dict] = None, **kwargs):
         super().__init__(name, **kwargs)
+        if reflection_mode not in REFLECTION_MODES:
+            raise ValueError(f"未知的反思模式: {reflection_mode}，可选: {', '.join(REFLECTION_MODES)}")
+        if prompt_layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"未知的提示词布局: {prompt_layout}，可选: {', '.join(PROMPT_LAYOUTS)}")
+        if context_mode not in CONTEXT_MODES:
+            raise ValueError(f"未知的上下文模式: {context_mode}，可选: {', '.join(CONTEXT_MODES)}")
+        if action_log_style not in ACTION_LOG_STYLES:
+            raise ValueError(f"未知的操作记录格式: {action_log_style}，可选: {', '.join(ACTION_LOG_STYLES)}")
+        self.reflection_mode = reflection_mode
+        self.prompt_layout = prompt_layout
+        self.context_mode = context_mode
+        self.action_log_style = action_log_style
+        self.prompt_builder = PromptBuilder(
+            tokenizer=tokenizer,
+            token_budget=prompt_token_budget,
+            opinion_policy=opinion_policy,
+            opinion_max_tokens=opinion_max_tokens
+        )
+        self.conversation = RoundConversation(conversation_token_budget, count_tokens=self.prompt_builder.count)
+        prompt_registry.preload()
         self.llm_client = LLMClient(
             base_url=base_url,
             api_key=api_key,
             model=model,
-            reasoning_effort=reasoning_effort
+            reasoning_effort=reasoning_effort,
+            cache_path=cache_path,
+            structured_output=structured_output,
+            stream=stream,
+            hedge=hedge,
+            max_retries=max_retries,
+            player=name,
+            request_params=request_params
         )
-
-    def _read_file(self, filepath: str) -> str:
-        """读取文件内容"""
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return f.read().strip()
-        except Exception as e:
-            logger.error(f"读取文件 {filepath} 失败: {str(e)}")
-            return ""
+        # 每种决策的统计：calls 决策次数，requests 实际请求次数，retries 重试次数，repairs 修复次数，failures 失败次数
+        self.decision_stats: Dict[str, Counter] = defaultdict(Counter)
+        self.last_decision_attempts = 0
+
+    def checkpoint_state(self) -> Dict:
+        """在基类的状态之外保存本轮的对话历史（conversation模式）和决策统计"""
+        state = super().checkpoint_state()
+        state["conversation"] = self.conversation.checkpoint_state()
+        state["decision_stats"] = {decision_type: dict(stats) for decision_type, stats in self.decision_stats.items()}
+        return state
+
+    def restore_state(self, state: Dict) -> None:
+        super().restore_state(state)
+        # 旧检查点中没有这两项时保持初始状态
+        if "conversation" in state:
+            self.conversation.restore_state(state["conversation"])
+        if "decision_stats" in state:
+            self.decision_stats = defaultdict(Counter, {
+                decision_type: Counter(stats) for decision_type, stats in state["decision_stats"].items()
+            })
+
+    def _build_messages(self, template_path: str, **kwargs) -> List[Dict[str, str]]:
+        """按上下文模式和提示词布局填充模板，返回请求消息
+
+        default布局下为一条user消息；prefix_stable布局下system消息只包含规则和身份，
+        对同一玩家的所有请求逐字节相同，user消息中轮次信息和操作记录在前、手牌等每次都变化的内容在后。
+        conversation模式下在本轮的对话历史后追加一条只包含新增操作的user消息。
+        设置了 prompt_token_budget 时，超出预算的部分从最早的操作记录开始省略。
+        """
+        round_action_info = kwargs.pop("round_action_info")
+        if self.context_mode == "conversation":
+            # 对话历史有单独的预算，省略操作记录会破坏增量发送
+            round_base_info = kwargs.pop("round_base_info")
+            system_prompt = prompt_registry.get(SYSTEM_PROMPT_TEMPLATE_PATH).format(self_name=self.name)
+            template = prompt_registry.get(CONVERSATION_TEMPLATE_PATHS[template_path])
+            messages = self.conversation.prepare(
+                system_prompt, round_base_info, round_action_info,
+                lambda context: template.format(context=context, **kwargs)
+            )
+            tokens = self.prompt_builder.count_messages(messages)
+        else:
+            messages, tokens = self.prompt_builder.fit(
+                lambda action_log: self._render_messages(template_path, round_action_info=action_log, **kwargs),
+                round_action_info
+            )
+        logger.info(f"{self.name} 的{TEMPLATE_DECISION_TYPES[template_path]}提示词约 {tokens} tokens ({self.prompt_builder.tokenizer.name})")
+        return messages
+
+    def _render_messages(self, template_path: str, **kwargs) -> List[Dict[str, str]]:
+        """按提示词布局填充模板"""
+        if self.prompt_layout == "prefix_stable":
+            system_prompt = prompt_registry.get(SYSTEM_PROMPT_TEMPLATE_PATH).format(self_name=self.name)
+            prompt = prompt_registry.get(PREFIX_STABLE_TEMPLATE_PATHS[template_path]).format(**kwargs)
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ]
+        prompt = prompt_registry.get(template_path).format(self_name=self.name, **kwargs)
+        return [
+            {"role": "user", "content": prompt}
+        ]
+
+    def _remember(self, messages: List[Dict[str, str]], decision: Dict, round_base_info: str, round_action_info: str) -> None:
+        """conversation模式下把本次决策追加到本轮的对话历史"""
+        if self.context_mode == "conversation":
+            self.conversation.commit(messages, json.dumps(decision, ensure_ascii=False), round_base_info, round_action_info)
+
+    def _record_decision(self, decision_type: str, attempts: int, failed: bool = False) -> None:
+        """记录一次决策用掉的请求次数"""
+        stats = self.decision_stats[decision_type]
+        stats["calls"] += 1
+        stats["requests"] += attempts
+        stats["retries"] += attempts - 1
+        if failed:
+            stats["failures"] += 1
+        self.last_decision_attempts = attempts
+
+    def _parse_play_decision(self, content: str) -> Optional[Dict]:
+        """从回复中提取最后一个出牌决策，能修复的直接修复，无效时返回None"""
+        result = extract_last_json_object(content, required_keys=("played_cards",))
+        if result is None:
+            return None
+        decision, repaired = repair_play_decision(result, self.hand)
+        if decision is not None and repaired:
+            self.decision_stats["play"]["repairs"] += 1
+            logger.info(f"{self.name} 的出牌决策经修复后生效: {result} -> {decision}")
+        return decision
+
+    def _is_play_decision_complete(self, content: str) -> bool:
+        """流式输出中是否已经出现完整且有效的出牌决策"""
+        result = extract_last_json_object(content, required_keys=PLAY_DECISION_KEYS)
+        return result is not None and repair_play_decision(result, self.hand)[0] is not None
+
+    def _is_challenge_decision_complete(self, content: str) -> bool:
+        """流式输出中是否已经出现完整且有效的质疑决策"""
+        result = extract_last_json_object(content, required_keys=CHALLENGE_DECISION_KEYS)
+        return result is not None and repair_challenge_decision(result)[0] is not None
+
+    def _parse_challenge_decision(self, content: str) -> Optional[Dict]:
+        """从回复中提取最后一个质疑决策，能修复的直接修复，无效时返回None"""
+        result = extract_last_json_object(content, required_keys=("was_challenged",))
+        if result is None:
+            return None
+        decision, repaired = repair_challenge_decision(result)
+        if decision is not None and repaired:
+            self.decision_stats["challenge"]["repairs"] += 1
+            logger.info(f"{self.name} 的质疑决策经修复后生效: {result} -> {decision}")
+        return decision
 
     def choose_cards_to_play(self,
                         round_base_info: str,
@@ -101,59 +405,37 @@ class LLMPlayer(Player):
             - 结果字典包含played_cards, behavior和play_reason
             - 推理内容为LLM的原始推理过程
         """
-        # 读取规则和模板
-        rules = self._read_file(RULE_BASE_PATH)
-        template = self._read_file(PLAY_CARD_PROMPT_TEMPLATE_PATH)
+        return self._decide(*self._play_request(round_base_info, round_action_info, play_decision_info))
+
+    async def achoose_cards_to_play(self, round_base_info: str, round_action_info: str, play_decision_info: str) -> Dict:
+        """choose_cards_to_play 的异步版本"""
+        return await self._adecide(*self._play_request(round_base_info, round_action_info, play_decision_info))
 
+    def _play_request(self, round_base_info: str, round_action_info: str, play_decision_info: str) -> Tuple:
+        """构造出牌请求，返回 _decide 的参数"""
         # 准备当前手牌信息
         current_cards = ", ".join(self.hand)
 
-        # 填充模板
-        prompt = template.format(
-            rules=rules,
-            self_name=self.name,
+        # 填充模板（规则已嵌入）
+        messages = self._build_messages(
+            PLAY_CARD_PROMPT_TEMPLATE_PATH,
             round_base_info=round_base_info,
             round_action_info=round_action_info,
             play_decision_info=play_decision_info,
             current_cards=current_cards
         )
 
-        # 尝试获取有效的JSON响应，最多重试五次
-        for attempt in range(5):
-            # 每次都发送相同的原始prompt
-            messages = [
-                {"role": "user", "content": prompt}
-            ]
-
-            try:
-                content, reasoning_content = self.llm_client.chat(messages)
-
-                # 尝试从内容中提取JSON部分
-                json_match = re.search(r'({[\s\S]*})', content)
-                if json_match:
-                    json_str = json_match.group(1)
-                    result = json.loads(json_str)
-
-                    # 验证JSON格式是否符合要求
-                    if all(key in result for key in ["played_cards", "behavior", "play_reason"]):
-                        # 确保played_cards是列表
-                        if not isinstance(result["played_cards"], list):
-                            result["played_cards"] = [result["played_cards"]]
-
-                        # 确保选出的牌是有效的（从手牌中选择1-3张）
-                        valid_cards = all(card in self.hand for card in result["played_cards"])
-                        valid_count = 1 <= len(result["played_cards"]) <= 3
-
-                        if valid_cards and valid_count:
-                            # 从手牌中移除已出的牌
-                            for card in result["played_cards"]:
-                                self.hand.remove(card)
-                            return result, reasoning_content
+        def accept(content: str) -> Optional[Dict]:
+            result = self._parse_play_decision(content)
+            if result is not None:
+                # 从手牌中移除已出的牌
+                for card in result["played_cards"]:
+                    self.hand.remove(card)
+                self._remember(messages, result, round_base_info, round_action_info)
+            return result
 
-            except Exception as e:
-                # 仅记录错误，不修改重试请求
-                logger.warning(f"尝试 {attempt+1} 解析失败: {str(e)}")
-        raise RuntimeError(f"玩家 {self.name} 的choose_cards_to_play方法在多次尝试后失败")
+        return ("play", "choose_cards_to_play", messages, play_decision_response_format(self.hand),
+                self._is_play_decision_complete, accept)
 
     def decide_challenge(self,
                         round_base_info: str,
@@ -177,15 +459,24 @@ class LLMPlayer(Player):
             - result: 包含was_challenged和challenge_reason的字典
             - reasoning_content: LLM的原始推理过程
         """
-        # 读取规则和模板
-        rules = self._read_file(RULE_BASE_PATH)
-        template = self._read_file(CHALLENGE_PROMPT_TEMPLATE_PATH)
+        return self._decide(*self._challenge_request(
+            round_base_info, round_action_info, challenge_decision_info, challenging_player_performance, extra_hint
+        ))
+
+    async def adecide_challenge(self, round_base_info: str, round_action_info: str, challenge_decision_info: str, challenging_player_performance: str, extra_hint: str) -> bool:
+        """decide_challenge 的异步版本"""
+        return await self._adecide(*self._challenge_request(
+            round_base_info, round_action_info, challenge_decision_info, challenging_player_performance, extra_hint
+        ))
+
+    def _challenge_request(self, round_base_info: str, round_action_info: str, challenge_decision_info: str,
+                           challenging_player_performance: str, extra_hint: str) -> Tuple:
+        """构造质疑请求，返回 _decide 的参数"""
         self_hand = f"你现在的手牌是: {', '.join(self.hand)}"
 
-        # 填充模板
-        prompt = template.format(
-            rules=rules,
-            self_name=self.name,
+        # 填充模板（规则已嵌入）
+        messages = self._build_messages(
+            CHALLENGE_PROMPT_TEMPLATE_PATH,
             round_base_info=round_base_info,
             round_action_info=round_action_info,
             self_hand=self_hand,
@@ -194,83 +485,199 @@ class LLMPlayer(Player):
             extra_hint=extra_hint
         )
 
-        # 尝试获取有效的JSON响应，最多重试五次
-        for attempt in range(5):
-            # 每次都发送相同的原始prompt
-            messages = [
-                {"role": "user", "content": prompt}
-            ]
-
-            try:
-                content, reasoning_content = self.llm_client.chat(messages)
-
-                # 解析JSON响应
-                json_match = re.search(r'({[\s\S]*})', content)
-                if json_match:
-                    json_str = json_match.group(1)
-                    result = json.loads(json_str)
+        def accept(content: str) -> Optional[Dict]:
+            result = self._parse_challenge_decision(content)
+            if result is not None:
+                self._remember(messages, result, round_base_info, round_action_info)
+            return result
 
-                    # 验证JSON格式是否符合要求
-                    if all(key in result for key in ["was_challenged", "challenge_reason"]):
-                        # 确保was_challenged是布尔值
-                        if isinstance(result["was_challenged"], bool):
-                            return result, reasoning_content
+        return ("challenge", "decide_challenge", messages, challenge_decision_response_format(),
+                self._is_challenge_decision_complete, accept)
 
+    def _decide(self, decision_type: str, method_name: str, messages: List[Dict[str, str]], response_format: Dict,
+                stop_when: Callable[[str], bool], accept: Callable[[str], Optional[Dict]]) -> Tuple[Dict, str]:
+        """请求LLM直到得到有效的决策，最多请求五次；可以修复的回复直接修复，不再重新请求"""
+        for attempt in range(MAX_DECISION_ATTEMPTS):
+            try:
+                content, reasoning_content = self.llm_client.chat(
+                    messages, response_format=response_format, stop_when=stop_when, decision_type=decision_type
+                )
+                result = accept(content)
+                if result is not None:
+                    self._record_decision(decision_type, attempt + 1)
+                    return result, reasoning_content
+
+            except LLMError:
+                # LLMClient 已经完成退避重试，再次请求没有意义
+                self._record_decision(decision_type, attempt + 1, failed=True)
+                raise
             except Exception as e:
                 # 仅记录错误，不修改重试请求
                 logger.warning(f"尝试 {attempt+1} 解析失败: {str(e)}")
-        raise RuntimeError(f"玩家 {self.name} 的decide_challenge方法在多次尝试后失败")
+            # 回复无效，丢弃缓存以便重试时重新请求
+            self.llm_client.invalidate(messages, response_format)
+        self._record_decision(decision_type, MAX_DECISION_ATTEMPTS, failed=True)
+        raise RuntimeError(f"玩家 {self.name} 的{method_name}方法在多次尝试后失败")
+
+    async def _adecide(self, decision_type: str, method_name: str, messages: List[Dict[str, str]], response_format: Dict,
+                       stop_when: Callable[[str], bool], accept: Callable[[str], Optional[Dict]]) -> Tuple[Dict, str]:
+        """_decide 的异步版本"""
+        for attempt in range(MAX_DECISION_ATTEMPTS):
+            try:
+                content, reasoning_content = await self.llm_client.achat(
+                    messages, response_format=response_format, stop_when=stop_when, decision_type=decision_type
+                )
+                result = accept(content)
+                if result is not None:
+                    self._record_decision(decision_type, attempt + 1)
+                    return result, reasoning_content
+
+            except LLMError:
+                self._record_decision(decision_type, attempt + 1, failed=True)
+                raise
+            except Exception as e:
+                logger.warning(f"尝试 {attempt+1} 解析失败: {str(e)}")
+            self.llm_client.invalidate(messages, response_format)
+        self._record_decision(decision_type, MAX_DECISION_ATTEMPTS, failed=True)
+        raise RuntimeError(f"玩家 {self.name} 的{method_name}方法在多次尝试后失败")
 
-    def reflect(self, alive_players: List[str], round_base_info: str, round_action_info: str, round_result: str) -> None:
+    def reflect_on_player(self, player_name: str, round_base_info: str, round_action_info: str, round_result: str) -> Optional[str]:
         """
-        玩家在轮次结束后对其他存活玩家进行反思，更新对他们的印象
+        玩家在轮次结束后对某个存活玩家进行反思，得到对其更新后的印象
 
         Args:
-            alive_players: 还存活的玩家名称列表
+            player_name: 被反思的玩家名称
             round_base_info: 轮次基础信息
             round_action_info: 轮次操作信息
             round_result: 轮次结果
+
+        Returns:
+            Optional[str]: 更新后的印象，失败时返回None（保留原印象）
         """
-        # 读取反思模板
-        template = self._read_file(REFLECT_PROMPT_TEMPLATE_PATH)
-
-        # 读取规则
-        rules = self._read_file(RULE_BASE_PATH)
-
-        # 对每个存活的玩家进行反思和印象更新（排除自己）
-        for player_name in alive_players:
-            # 跳过对自己的反思
-            if player_name == self.name:
-                continue
-
-            # 获取此前对该玩家的印象
-            previous_opinion = self.opinions.get(player_name, "还不了解这个玩家")
-
-            # 填充模板
-            prompt = template.format(
-                rules=rules,
-                self_name=self.name,
-                round_base_info=round_base_info,
-                round_action_info=round_action_info,
-                round_result=round_result,
-                player=player_name,
-                previous_opinion=previous_opinion
-            )
+        messages = self._reflect_messages(player_name, round_base_info, round_action_info, round_result)
+        try:
+            content, _ = self.llm_client.chat(messages, decision_type="reflect")
+            return self._accept_reflection(player_name, content)
+        except Exception as e:
+            logger.error(f"反思玩家 {player_name} 时出错: {str(e)}")
+            return None
 
-            # 向LLM请求分析
-            messages = [
-                {"role": "user", "content": prompt}
-            ]
+    async def areflect_on_player(self, player_name: str, round_base_info: str, round_action_info: str, round_result: str) -> Optional[str]:
+        """reflect_on_player 的异步版本"""
+        messages = self._reflect_messages(player_name, round_base_info, round_action_info, round_result)
+        try:
+            content, _ = await self.llm_client.achat(messages, decision_type="reflect")
+            return self._accept_reflection(player_name, content)
+        except Exception as e:
+            logger.error(f"反思玩家 {player_name} 时出错: {str(e)}")
+            return None
 
-            try:
-                content, _ = self.llm_client.chat(messages)
+    def _reflect_messages(self, player_name: str, round_base_info: str, round_action_info: str, round_result: str) -> List[Dict[str, str]]:
+        # 获取此前对该玩家的印象
+        previous_opinion = self.opinions.get(player_name, "还不了解这个玩家")
+
+        # 填充反思模板（规则已嵌入）
+        return self._build_messages(
+            REFLECT_PROMPT_TEMPLATE_PATH,
+            round_base_info=round_base_info,
+            round_action_info=round_action_info,
+            round_result=round_result,
+            player=player_name,
+            previous_opinion=previous_opinion
+        )
 
-                # 更新对该玩家的印象
-                self.opinions[player_name] = content.strip()
-                logger.info(f"{self.name} 更新了对 {player_name} 的印象")
+    def _accept_reflection(self, player_name: str, content: str) -> Optional[str]:
+        opinion = content.strip()
+        if not opinion:
+            logger.warning(f"{self.name} 对 {player_name} 的反思没有得到有效回复，保留原印象")
+            return None
+        logger.info(f"{self.name} 更新了对 {player_name} 的印象")
+        return self.prompt_builder.compact_opinion(opinion)
 
-            except Exception as e:
-                logger.error(f"反思玩家 {player_name} 时出错: {str(e)}")
+    def reflect_on_players(self, player_names: List[str], round_base_info: str, round_action_info: str, round_result: str) -> Dict[str, str]:
+        """
+        对一组玩家进行反思。batch模式下只发起一次请求，要求LLM返回 {玩家名: 印象} 的json，
+        缺失或无效的玩家回退为逐个反思
+
+        Args:
+            player_names: 被反思的玩家名称列表
+            round_base_info: 轮次基础信息
+            round_action_info: 轮次操作信息
+            round_result: 轮次结果
+
+        Returns:
+            Dict[str, str]: 玩家名到更新后印象的映射
+        """
+        if self.reflection_mode != "batch" or len(player_names) <= 1:
+            return super().reflect_on_players(player_names, round_base_info, round_action_info, round_result)
+
+        messages = self._reflect_all_messages(player_names, round_base_info, round_action_info, round_result)
+        opinions = {}
+        try:
+            content, _ = self.llm_client.chat(messages, decision_type="reflect_all")
+            opinions = self._parse_batch_reflection(player_names, content)
+        except Exception as e:
+            logger.warning(f"{self.name} 的批量反思解析失败: {str(e)}")
+
+        missing = self._check_batch_reflection(player_names, opinions, messages)
+        if missing:
+            opinions.update(super().reflect_on_players(missing, round_base_info, round_action_info, round_result))
+        return opinions
+
+    async def areflect_on_players(self, player_names: List[str], round_base_info: str, round_action_info: str, round_result: str) -> Dict[str, str]:
+        """reflect_on_players 的异步版本"""
+        if self.reflection_mode != "batch" or len(player_names) <= 1:
+            return await super().areflect_on_players(player_names, round_base_info, round_action_info, round_result)
+
+        messages = self._reflect_all_messages(player_names, round_base_info, round_action_info, round_result)
+        opinions = {}
+        try:
+            content, _ = await self.llm_client.achat(messages, decision_type="reflect_all")
+            opinions = self._parse_batch_reflection(player_names, content)
+        except Exception as e:
+            logger.warning(f"{self.name} 的批量反思解析失败: {str(e)}")
+
+        missing = self._check_batch_reflection(player_names, opinions, messages)
+        if missing:
+            opinions.update(await super().areflect_on_players(missing, round_base_info, round_action_info, round_result))
+        return opinions
+
+    def _reflect_all_messages(self, player_names: List[str], round_base_info: str, round_action_info: str, round_result: str) -> List[Dict[str, str]]:
+        previous_opinions = "\n".join(
+            f"{player_name}：{self.opinions.get(player_name, '还不了解这个玩家')}"
+            for player_name in player_names
+        )
+
+        return self._build_messages(
+            REFLECT_ALL_PROMPT_TEMPLATE_PATH,
+            round_base_info=round_base_info,
+            round_action_info=round_action_info,
+            round_result=round_result,
+            players="、".join(player_names),
+            previous_opinions=previous_opinions
+        )
+
+    def _parse_batch_reflection(self, player_names: List[str], content: str) -> Dict[str, str]:
+        """从批量反思的回复中提取每个玩家的印象"""
+        opinions = {}
+        result = extract_last_json_object(content)
+        if result is not None:
+            for player_name in player_names:
+                opinion = result.get(player_name)
+                if isinstance(opinion, str) and opinion.strip():
+                    opinions[player_name] = self.prompt_builder.compact_opinion(opinion.strip())
+        return opinions
+
+    def _check_batch_reflection(self, player_names: List[str], opinions: Dict[str, str], messages: List[Dict[str, str]]) -> List[str]:
+        """返回批量反思中缺失、需要逐个反思的玩家；全部缺失时丢弃缓存"""
+        missing = [player_name for player_name in player_names if player_name not in opinions]
+        if missing:
+            if len(missing) == len(player_names):
+                self.llm_client.invalidate(messages)
+            logger.warning(f"{self.name} 的批量反思缺少对 {'、'.join(missing)} 的印象，回退为逐个反思")
+        else:
+            logger.info(f"{self.name} 通过批量反思更新了对 {'、'.join(player_names)} 的印象")
+        return missing
 
 
 
@@ -17,11 +17,30 @@ class PlayerClient:
     def hand(self):
         return self.player.hand
 
+    @property
+    def action_log_style(self):
+        """玩家使用的操作记录格式"""
+        return self.player.action_log_style
+
+    @property
+    def last_decision_attempts(self):
+        """最近一次决策用掉的请求次数，非LLM玩家为None"""
+        return getattr(self.player, "last_decision_attempts", None)
+
     def choose_cards_to_play(self, round_base_info: str, round_action_info: str, play_decision_info: str) -> Dict:
         return self.player.choose_cards_to_play(round_base_info, round_action_info, play_decision_info)
 
+    async def achoose_cards_to_play(self, round_base_info: str, round_action_info: str, play_decision_info: str) -> Dict:
+        return await self.player.achoose_cards_to_play(round_base_info, round_action_info, play_decision_info)
+
     def decide_challenge(self, round_base_info: str, round_action_info: str, challenge_decision_info: str, challenging_player_performance: str, extra_hint: str) -> bool:
         return self.player.decide_challenge(round_base_info, round_action_info, challenge_decision_info, challenging_player_performance, extra_hint)
 
+    async def adecide_challenge(self, round_base_info: str, round_action_info: str, challenge_decision_info: str, challenging_player_performance: str, extra_hint: str) -> bool:
+        return await self.player.adecide_challenge(round_base_info, round_action_info, challenge_decision_info, challenging_player_performance, extra_hint)
+
     def reflect(self, alive_players: List[str], round_base_info: str, round_action_info: str, round_result: str) -> None:
-        self.player.reflect(alive_players, round_base_info, round_action_info, round_result)
\ No newline at end of file
+        self.player.reflect(alive_players, round_base_info, round_action_info, round_result)
+
+    async def areflect(self, alive_players: List[str], round_base_info: str, round_action_info: str, round_result: str) -> None:
+        await self.player.areflect(alive_players, round_base_info, round_action_info, round_result)
@@ -0,0 +1,202 @@
+import logging
+import math
+import re
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from game_record import COMPACT_ACTION_HEADER
+
+logger = logging.getLogger(__name__)
+
+# 印象的处理策略：full 原样保留；truncate 截断到 opinion_max_tokens；summary 保留完整的句子（首句和末句优先）
+OPINION_POLICIES = ("full", "truncate", "summary")
+DEFAULT_OPINION_MAX_TOKENS = 200
+
+_SENTENCE_PATTERN = re.compile(r"[^。！？!?；;\n]+[。！？!?；;\n]*")
+
+
+def _is_cjk(ch: str) -> bool:
+    return ord(ch) > 0x2E80
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数：中文约每个字一个token，其余约每4个字符一个token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class EstimateTokenizer:
+    """按字符估计token数，不依赖任何模型的词表"""
+
+    name = "estimate"
+
+    def count(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """保留开头不超过max_tokens的部分"""
+        cost = 0.0
+        for index, ch in enumerate(text):
+            cost += 1 if _is_cjk(ch) else 0.25
+            if math.ceil(cost) > max_tokens:
+                return text[:index]
+        return text
+
+
+class TiktokenTokenizer:
+    """用tiktoken的词表精确计数，需要安装可选依赖 tiktoken"""
+
+    def __init__(self, encoding: str = "o200k_base"):
+        try:
+            import tiktoken
+        except ImportError as e:
+            raise ImportError("使用tiktoken计数需要先安装: pip install tiktoken") from e
+        self.name = f"tiktoken:{encoding}"
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text)) if text else 0
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self._encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self._encoding.decode(tokens[:max_tokens])
+
+
+Tokenizer = Union[EstimateTokenizer, TiktokenTokenizer]
+
+
+def get_tokenizer(spec: Union[str, Tokenizer, None] = "estimate") -> Tokenizer:
+    """
+    按名称创建计数器
+
+    Args:
+        spec: estimate（默认），tiktoken 或 tiktoken:<编码名>，也可以直接传入计数器对象
+
+    Returns:
+        Tokenizer: 提供 count / truncate 的计数器
+    """
+    if spec is None or spec == "estimate":
+        return EstimateTokenizer()
+    if not isinstance(spec, str):
+        return spec
+    if spec == "tiktoken":
+        return TiktokenTokenizer()
+    if spec.startswith("tiktoken:"):
+        return TiktokenTokenizer(spec.split(":", 1)[1])
+    raise ValueError(f"未知的tokenizer: {spec}，可选: estimate, tiktoken, tiktoken:<编码名>")
+
+
+def split_action_entries(action_log: str) -> Tuple[str, List[str]]:
+    """
+    把操作记录拆成表头和逐次操作
+
+    compact格式每行是一次操作；prose格式每次操作以"轮到"开头，后面跟着表现和质疑的行。
+
+    Returns:
+        Tuple[str, List[str]]: (表头，没有时为空字符串, 每次操作的文本)
+    """
+    lines = action_log.split("\n") if action_log else []
+    if lines and lines[0] == COMPACT_ACTION_HEADER:
+        return lines[0], lines[1:]
+    entries: List[str] = []
+    for line in lines:
+        if line.startswith("轮到") or not entries:
+            entries.append(line)
+        else:
+            entries[-1] += "\n" + line
+    return "", entries
+
+
+class PromptBuilder:
+    """按token预算组装提示词
+
+    先按印象策略压缩对其他玩家的印象；渲染后超过预算时从最早的操作开始省略，
+    只保留最近的操作记录，并记录每次决策的提示词大小。
+    """
+
+    def __init__(self, tokenizer: Union[str, Tokenizer, None] = "estimate", token_budget: Optional[int] = None,
+                 opinion_policy: str = "full", opinion_max_tokens: int = DEFAULT_OPINION_MAX_TOKENS):
+        """
+        Args:
+            tokenizer: 本地计数器，见 get_tokenizer
+            token_budget: 每次决策的提示词token上限，None表示不限制
+            opinion_policy: 印象的处理策略，见 OPINION_POLICIES
+            opinion_max_tokens: truncate/summary 策略下每条印象的token上限
+        """
+        if opinion_policy not in OPINION_POLICIES:
+            raise ValueError(f"未知的印象处理策略: {opinion_policy}，可选: {', '.join(OPINION_POLICIES)}")
+        self.tokenizer = get_tokenizer(tokenizer)
+        self.token_budget = token_budget
+        self.opinion_policy = opinion_policy
+        self.opinion_max_tokens = opinion_max_tokens
+
+    def count(self, text: str) -> int:
+        return self.tokenizer.count(text)
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        """消息内容的token数之和（不含chat模板的开销）"""
+        return sum(self.count(message.get("content") or "") for message in messages)
+
+    def compact_opinion(self, opinion: str) -> str:
+        """按印象策略压缩一条印象"""
+        if self.opinion_policy == "full" or self.count(opinion) <= self.opinion_max_tokens:
+            return opinion
+        if self.opinion_policy == "truncate":
+            return self.tokenizer.truncate(opinion, self.opinion_max_tokens).rstrip() + "……"
+
+        # summary：首句和末句往往是结论，优先保留，其余按原顺序尽量保留
+        sentences = [sentence.strip() for sentence in _SENTENCE_PATTERN.findall(opinion) if sentence.strip()]
+        if not sentences:
+            return opinion
+        order = [0, len(sentences) - 1] + list(range(1, len(sentences) - 1))
+        kept = set()
+        used = 0
+        for index in dict.fromkeys(order):
+            cost = self.count(sentences[index])
+            if used + cost > self.opinion_max_tokens:
+                continue
+            kept.add(index)
+            used += cost
+        if not kept:
+            return self.tokenizer.truncate(sentences[0], self.opinion_max_tokens).rstrip() + "……"
+        return "".join(sentences[index] for index in sorted(kept))
+
+    def fit(self, render: Callable[[str], List[Dict[str, str]]], action_log: str) -> Tuple[List[Dict[str, str]], int]:
+        """
+        渲染提示词，超过预算时省略最早的操作记录
+
+        Args:
+            render: 用操作记录渲染出请求消息
+            action_log: 完整的操作记录
+
+        Returns:
+            Tuple[List[Dict[str, str]], int]: (请求消息, 提示词token数)
+        """
+        messages = render(action_log)
+        tokens = self.count_messages(messages)
+        if self.token_budget is None or tokens <= self.token_budget:
+            return messages, tokens
+
+        header, entries = split_action_entries(action_log)
+        # 省略说明本身也占用预算
+        overflow = tokens - self.token_budget + self.count(f"（省略了更早的{len(entries)}次操作）")
+        dropped = 0
+        freed = 0
+        # 至少保留最近一次操作
+        while dropped < len(entries) - 1 and freed < overflow:
+            freed += self.count(entries[dropped]) + 1
+            dropped += 1
+        if dropped == 0:
+            logger.warning(f"提示词约 {tokens} tokens，超过预算 {self.token_budget}，但没有可以省略的操作记录")
+            return messages, tokens
+
+        kept = [f"（省略了更早的{dropped}次操作）"] + entries[dropped:]
+        trimmed = "\n".join(([header] if header else []) + kept)
+        messages = render(trimmed)
+        trimmed_tokens = self.count_messages(messages)
+        logger.info(
+            f"提示词约 {tokens} tokens，超过预算 {self.token_budget}，省略了最早的{dropped}次操作，剩余约 {trimmed_tokens} tokens"
+        )
+        return messages, trimmed_tokens
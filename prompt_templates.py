@@ -0,0 +1,177 @@
+import logging
+import os
+import string
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PromptTemplate:
+    """预先切分好的提示词模板
+
+    加载时用 string.Formatter 把模板切分为 (字面文本, 占位符) 片段，
+    format 时只做拼接，不再重复解析模板。
+    """
+
+    def __init__(self, path: str, text: str):
+        self.path = path
+        self.text = text
+        self._parts: List[Tuple[str, Optional[str], str, Optional[str]]] = []
+        placeholders = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(text):
+            if field_name is not None and not field_name.isidentifier():
+                raise ValueError(f"模板 {path} 中的占位符 {{{field_name}}} 不是合法的名称")
+            self._parts.append((literal, field_name, format_spec or "", conversion))
+            if field_name is not None and field_name not in placeholders:
+                placeholders.append(field_name)
+        self.placeholders: Tuple[str, ...] = tuple(placeholders)
+
+        # 第一个占位符之前的文本在每次调用中都完全相同
+        prefix = []
+        for literal, field_name, _, _ in self._parts:
+            prefix.append(literal)
+            if field_name is not None:
+                break
+        self.static_prefix: str = "".join(prefix)
+
+    @property
+    def static_prefix_len(self) -> int:
+        """静态前缀的字符数"""
+        return len(self.static_prefix)
+
+    def format(self, **kwargs) -> str:
+        """填充模板，语义与 str.format 相同，缺少占位符时抛出KeyError"""
+        pieces = []
+        for literal, field_name, format_spec, conversion in self._parts:
+            pieces.append(literal)
+            if field_name is None:
+                continue
+            value = kwargs[field_name]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "a":
+                value = ascii(value)
+            elif conversion == "s":
+                value = str(value)
+            pieces.append(format(value, format_spec) if format_spec else str(value))
+        return "".join(pieces)
+
+
+class TemplateRegistry:
+    """进程内共享的提示词模板注册表
+
+    模板在首次使用时读取、校验占位符并预切分，之后直接复用。
+    可以声明 includes（例如规则文本），加载时直接嵌入模板，使其成为静态前缀的一部分。
+    开启 hot_reload 后每次获取模板时检查文件的修改时间，文件变化时重新加载。
+    """
+
+    def __init__(self, hot_reload: bool = False):
+        self.hot_reload = hot_reload
+        self._lock = threading.Lock()
+        self._specs: Dict[str, Tuple[frozenset, Dict[str, str]]] = {}
+        self._templates: Dict[str, PromptTemplate] = {}
+        self._mtimes: Dict[str, Tuple[float, ...]] = {}
+        # 热加载时读取失败的模板，只记录一次警告，恢复后清除
+        self._reload_failed: Dict[str, Tuple[float, ...]] = {}
+
+    def register(self, path: str, placeholders: Iterable[str], includes: Optional[Dict[str, str]] = None) -> None:
+        """
+        声明一个模板
+
+        Args:
+            path: 模板文件路径
+            placeholders: 调用方会提供的占位符，加载时要求与模板中的占位符完全一致
+            includes: 占位符名 -> 文件路径，加载时用文件内容直接替换这些占位符
+        """
+        with self._lock:
+            self._specs[path] = (frozenset(placeholders), dict(includes or {}))
+            self._templates.pop(path, None)
+            self._mtimes.pop(path, None)
+            self._reload_failed.pop(path, None)
+
+    def _source_paths(self, path: str) -> List[str]:
+        _, includes = self._specs.get(path, (frozenset(), {}))
+        return [path] + list(includes.values())
+
+    def _read_mtimes(self, path: str) -> Tuple[float, ...]:
+        return tuple(os.path.getmtime(p) for p in self._source_paths(path))
+
+    def _load(self, path: str) -> PromptTemplate:
+        """读取、嵌入includes、校验并预切分模板，调用方需持有锁"""
+        expected, includes = self._specs.get(path, (None, {}))
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read().strip()
+            for name, include_path in includes.items():
+                with open(include_path, 'r', encoding='utf-8') as f:
+                    # 被嵌入的文本中的花括号需要转义，避免被当作占位符
+                    include_text = f.read().strip().replace("{", "{{").replace("}", "}}")
+                text = text.replace("{" + name + "}", include_text)
+        except OSError as e:
+            logger.error(f"读取模板 {path} 失败: {str(e)}")
+            raise
+
+        template = PromptTemplate(path, text)
+        if expected is not None and set(template.placeholders) != expected:
+            missing = expected - set(template.placeholders)
+            unknown = set(template.placeholders) - expected
+            raise ValueError(
+                f"模板 {path} 的占位符不匹配，缺少: {sorted(missing)}，多余: {sorted(unknown)}"
+            )
+        logger.info(f"已加载模板 {path}，静态前缀 {template.static_prefix_len} 字符")
+        return template
+
+    def get(self, path: str) -> PromptTemplate:
+        """获取模板，首次使用时加载"""
+        with self._lock:
+            template = self._templates.get(path)
+            if template is not None and self.hot_reload:
+                return self._reload_if_changed(path, template)
+            if template is None:
+                mtimes = self._read_mtimes(path)
+                template = self._load(path)
+                self._templates[path] = template
+                self._mtimes[path] = mtimes
+            return template
+
+    def _reload_if_changed(self, path: str, template: PromptTemplate) -> PromptTemplate:
+        """
+        文件修改后重新加载模板，调用方需持有锁
+
+        文件暂时不存在（例如编辑器先删除再写入）或新内容无效时继续使用上一次成功加载的模板，
+        同一状态只记录一次警告。
+        """
+        try:
+            mtimes = self._read_mtimes(path)
+        except OSError as e:
+            if self._reload_failed.get(path) != ():
+                logger.warning(f"无法读取模板 {path} 的修改时间，继续使用已加载的版本: {str(e)}")
+                self._reload_failed[path] = ()
+            return template
+        if mtimes == self._mtimes.get(path) or mtimes == self._reload_failed.get(path):
+            return template
+        logger.info(f"模板 {path} 已修改，重新加载")
+        try:
+            new_template = self._load(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"重新加载模板 {path} 失败，继续使用已加载的版本: {str(e)}")
+            self._reload_failed[path] = mtimes
+            return template
+        self._templates[path] = new_template
+        self._mtimes[path] = mtimes
+        self._reload_failed.pop(path, None)
+        return new_template
+
+    def preload(self) -> None:
+        """加载所有已声明的模板，使配置错误在游戏开始前暴露"""
+        for path in list(self._specs):
+            self.get(path)
+
+    def static_prefix_lengths(self) -> Dict[str, int]:
+        """各模板静态前缀的字符数"""
+        return {path: self.get(path).static_prefix_len for path in list(self._specs)}
+
+
+# 进程内共享的默认注册表
+registry = TemplateRegistry()
@@ -0,0 +1,232 @@
+import json
+import math
+import os
+from abc import ABC, abstractmethod
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Optional
+from tournament_stats import record_elimination_order
+
+# 评分方式：elo 把一局的名次拆成两两对局更新（不需要额外依赖）；trueskill 需要安装可选依赖 trueskill
+RATING_BACKENDS = ("elo", "trueskill")
+
+DEFAULT_ELO_RATING = 1500.0
+DEFAULT_ELO_K = 32.0
+# Elo没有不确定度，按对局数估计：新玩家约350分，之后按 1/sqrt(对局数) 缩小
+ELO_INITIAL_UNCERTAINTY = 350.0
+
+
+class Ratings(ABC):
+    """按名次增量更新的玩家评分
+
+    名次来自一局游戏的淘汰顺序（最后一个是胜者）。已计入的游戏ID会一并保存，
+    重复计入同一局游戏会被忽略，因此可以反复从游戏记录中增量更新。
+    """
+
+    name = ""
+
+    def __init__(self):
+        self.players: Dict[str, Dict] = {}
+        self.game_ids: List[str] = []
+        self._seen = set()
+
+    @abstractmethod
+    def rating(self, player: str) -> float:
+        """用于排名的评分"""
+
+    @abstractmethod
+    def uncertainty(self, player: str) -> float:
+        """评分的不确定度，与rating同一量纲"""
+
+    @abstractmethod
+    def win_probability(self, player: str, opponent: str) -> float:
+        """player的名次高于opponent的概率"""
+
+    @abstractmethod
+    def _update(self, order: List[str]) -> None:
+        """按一局的淘汰顺序更新评分"""
+
+    def games(self, player: str) -> int:
+        return self.players.get(player, {}).get("games", 0)
+
+    def record_game(self, game_id: Optional[str], order: List[str]) -> bool:
+        """
+        计入一局游戏
+
+        Args:
+            game_id: 游戏ID，已计入过的游戏会被忽略
+            order: 淘汰顺序，最后一个是胜者
+
+        Returns:
+            bool: 是否计入
+        """
+        if len(order) < 2 or (game_id is not None and game_id in self._seen):
+            return False
+        self._update(order)
+        for player in order:
+            self.players[player]["games"] = self.games(player) + 1
+        if game_id is not None:
+            self._seen.add(game_id)
+            self.game_ids.append(game_id)
+        return True
+
+    def leaderboard(self) -> List[Dict]:
+        """按评分从高到低排列"""
+        rows = [
+            {"player": player, "rating": self.rating(player), "uncertainty": self.uncertainty(player),
+             "games": self.games(player)}
+            for player in self.players
+        ]
+        return sorted(rows, key=lambda row: row["rating"], reverse=True)
+
+    def to_dict(self) -> Dict:
+        return {"backend": self.name, "players": self.players, "game_ids": self.game_ids}
+
+    def load(self, data: Dict) -> None:
+        self.players = {player: dict(state) for player, state in data.get("players", {}).items()}
+        self.game_ids = list(data.get("game_ids", []))
+        self._seen = set(self.game_ids)
+
+    def save(self, path: str) -> None:
+        """写成json，先写临时文件再替换"""
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class EloRatings(Ratings):
+    """多人Elo：一局中每对玩家按名次先后视为一次胜负，每次更新的K按对手数平均"""
+
+    name = "elo"
+
+    def __init__(self, k: float = DEFAULT_ELO_K, initial: float = DEFAULT_ELO_RATING):
+        super().__init__()
+        self.k = k
+        self.initial = initial
+
+    def _state(self, player: str) -> Dict:
+        return self.players.setdefault(player, {"rating": self.initial, "games": 0})
+
+    def rating(self, player: str) -> float:
+        return self._state(player)["rating"]
+
+    def uncertainty(self, player: str) -> float:
+        return ELO_INITIAL_UNCERTAINTY / math.sqrt(1 + self.games(player))
+
+    def win_probability(self, player: str, opponent: str) -> float:
+        return 1 / (1 + 10 ** ((self.rating(opponent) - self.rating(player)) / 400))
+
+    def _update(self, order: List[str]) -> None:
+        k = self.k / (len(order) - 1)
+        deltas = {player: 0.0 for player in order}
+        for low_index, loser in enumerate(order):
+            for winner in order[low_index + 1:]:
+                expected = self.win_probability(winner, loser)
+                deltas[winner] += k * (1 - expected)
+                deltas[loser] -= k * (1 - expected)
+        for player, delta in deltas.items():
+            self._state(player)["rating"] += delta
+
+
+class TrueSkillRatings(Ratings):
+    """TrueSkill评分，用 mu - 3*sigma 排名，需要安装可选依赖 trueskill"""
+
+    name = "trueskill"
+
+    def __init__(self):
+        try:
+            import trueskill
+        except ImportError as e:
+            raise ImportError("使用TrueSkill评分需要先安装: pip install trueskill") from e
+        super().__init__()
+        self._env = trueskill.TrueSkill(draw_probability=0.0)
+
+    def _rating(self, player: str):
+        state = self.players.setdefault(player, {"mu": self._env.mu, "sigma": self._env.sigma, "games": 0})
+        return self._env.create_rating(state["mu"], state["sigma"])
+
+    def rating(self, player: str) -> float:
+        rating = self._rating(player)
+        return rating.mu - 3 * rating.sigma
+
+    def uncertainty(self, player: str) -> float:
+        return self._rating(player).sigma
+
+    def win_probability(self, player: str, opponent: str) -> float:
+        a, b = self._rating(player), self._rating(opponent)
+        spread = math.sqrt(2 * self._env.beta ** 2 + a.sigma ** 2 + b.sigma ** 2)
+        return NormalDist().cdf((a.mu - b.mu) / spread)
+
+    def _update(self, order: List[str]) -> None:
+        groups = [(self._rating(player),) for player in order]
+        # rank越小名次越高，胜者在order末尾
+        ranks = [len(order) - 1 - index for index in range(len(order))]
+        for player, (rating,) in zip(order, self._env.rate(groups, ranks=ranks)):
+            self.players[player]["mu"] = rating.mu
+            self.players[player]["sigma"] = rating.sigma
+
+
+def create_ratings(backend: str = "elo") -> Ratings:
+    """按名称创建评分，见 RATING_BACKENDS"""
+    if backend == "elo":
+        return EloRatings()
+    if backend == "trueskill":
+        return TrueSkillRatings()
+    raise ValueError(f"未知的评分方式: {backend}，可选: {', '.join(RATING_BACKENDS)}")
+
+
+def load_ratings(path: str, backend: Optional[str] = None) -> Ratings:
+    """
+    读取保存的评分，文件不存在时新建
+
+    Args:
+        path: json路径
+        backend: 评分方式，None表示沿用文件中的（新建时为elo），与文件中的不一致时报错
+    """
+    if not os.path.exists(path):
+        return create_ratings(backend or "elo")
+    with open(path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+    if backend is not None and data.get("backend") != backend:
+        raise ValueError(f"{path} 中的评分方式是 {data.get('backend')}，与指定的 {backend} 不一致")
+    ratings = create_ratings(data.get("backend", "elo"))
+    ratings.load(data)
+    return ratings
+
+
+def update_from_records(ratings: Ratings, record_paths: Iterable[str]) -> int:
+    """用已结束的json游戏记录增量更新评分，返回新计入的局数"""
+    added = 0
+    for path in record_paths:
+        with open(path, "r", encoding="utf-8") as file:
+            record = json.load(file)
+        if not record.get("winner"):
+            continue
+        if ratings.record_game(record.get("game_id"), record_elimination_order(record)):
+            added += 1
+    return added
+
+
+def print_leaderboard(ratings: Ratings) -> None:
+    for index, row in enumerate(ratings.leaderboard(), start=1):
+        print(f"{index}. {row['player']}: {row['rating']:.1f} ± {row['uncertainty']:.1f} ({row['games']} 局)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="用json游戏记录增量更新玩家评分并打印排名")
+    parser.add_argument("ratings", help="评分json路径，不存在时新建")
+    parser.add_argument("records", nargs="*", help="json游戏记录路径")
+    parser.add_argument("--backend", choices=RATING_BACKENDS, default=None, help="评分方式 (默认: 沿用文件中的，新建时为elo)")
+    args = parser.parse_args()
+
+    ratings = load_ratings(args.ratings, args.backend)
+    added = update_from_records(ratings, args.records)
+    if added:
+        ratings.save(args.ratings)
+    print(f"新计入 {added} 局游戏")
+    print_leaderboard(ratings)
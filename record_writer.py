@@ -0,0 +1,313 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 队列满时的处理策略：block 等待写线程腾出空间；drop 丢弃该次事件追加或检查点并记录错误（只适合不关心记录的压测）
+BACKPRESSURE_POLICIES = ("block", "drop")
+# drop策略下可以丢弃的写入，json记录、关闭和删除文件总是等待
+DROPPABLE_JOBS = ("append", "checkpoint")
+
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_BATCH_SIZE = 256
+# 队列持续满超过该秒数时记录一次警告
+BLOCK_WARNING_SECONDS = 1.0
+# drop策略下每丢弃这么多次记录一次错误
+DROP_LOG_EVERY = 100
+
+# 写入任务：(类型, 路径, 数据, 标志)，append和checkpoint的标志表示写入后fsync，json的标志表示写完后记录日志
+_Job = Tuple[str, str, object, bool]
+
+
+class RecordWriter:
+    """进程内共享的后台写线程
+
+    游戏记录的事件追加、json写出和文件删除都放入有界队列，由一个后台线程按顺序批量序列化和写入，
+    同一路径的写入顺序与提交顺序一致。提交的数据在写入完成前不能再修改。
+    进程退出时（atexit）会等待队列写完。
+    """
+
+    def __init__(self, max_queue: int = DEFAULT_MAX_QUEUE, batch_size: int = DEFAULT_BATCH_SIZE,
+                 backpressure: str = "block"):
+        """
+        Args:
+            max_queue: 队列中最多等待写入的任务数
+            batch_size: 每批最多处理的任务数
+            backpressure: 队列满时的处理策略，见 BACKPRESSURE_POLICIES
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"未知的背压策略: {backpressure}，可选: {', '.join(BACKPRESSURE_POLICIES)}")
+        self.batch_size = batch_size
+        self.backpressure = backpressure
+        self.dropped = 0
+        # 路径 -> 丢弃的事件追加次数
+        self.dropped_appends: Dict[str, int] = {}
+        # 路径 -> 丢弃的检查点次数
+        self.dropped_checkpoints: Dict[str, int] = {}
+        # 多个游戏线程可能同时丢弃写入，计数需要加锁
+        self._dropped_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue(maxsize=max_queue)
+        self._files: Dict[str, object] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="record-writer", daemon=True)
+        self._thread.start()
+
+    def append_event(self, path: str, event: Dict, sync: bool = False) -> None:
+        """向事件日志追加一行json，sync表示写入后fsync"""
+        self._submit(("append", path, event, sync))
+
+    def write_json(self, path: str, data: Dict, log: bool = True, sync: bool = False,
+                   then_remove: Sequence[str] = ()) -> None:
+        """
+        把数据写成缩进的json，先写临时文件再替换
+
+        Args:
+            path: json路径
+            data: 数据
+            log: 是否记录保存日志
+            sync: 是否fsync文件及其所在目录后再替换完成
+            then_remove: json写入成功后删除的文件（例如压缩前的事件日志），写入失败时保留
+        """
+        self._submit(("json", path, (data, sync, tuple(then_remove)), log))
+
+    def write_checkpoint(self, path: str, data: Dict, events_path: str, sync: bool = True) -> None:
+        """
+        写出检查点：先把事件日志中已提交的事件落盘，再写检查点，保证检查点记录的事件数不超过日志中已保存的
+
+        Args:
+            path: 检查点路径
+            data: 检查点数据
+            events_path: 检查点所依赖的事件日志
+            sync: 是否fsync（否则只flush，进程崩溃时仍一致，系统崩溃时不保证）
+        """
+        self._submit(("checkpoint", path, (data, events_path), sync))
+
+    def close_file(self, path: str) -> None:
+        """关闭该路径上打开的事件日志"""
+        self._submit(("close", path, None, False))
+
+    def remove(self, path: str) -> None:
+        """删除文件（之前提交的写入完成后）"""
+        self._submit(("remove", path, None, False))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的写入全部完成，超时返回False"""
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self) -> None:
+        """写完队列中的任务后停止写线程"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def dropped_count(self, job_type: str, path: str) -> int:
+        """drop策略下对该路径丢弃的 append 或 checkpoint 写入次数"""
+        counts = self.dropped_appends if job_type == "append" else self.dropped_checkpoints
+        with self._dropped_lock:
+            return counts.get(path, 0)
+
+    def _submit(self, job: _Job) -> None:
+        if self._closed:
+            raise RuntimeError("记录写线程已经关闭")
+        if self.backpressure == "drop" and job[0] in DROPPABLE_JOBS:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                counts = self.dropped_appends if job[0] == "append" else self.dropped_checkpoints
+                with self._dropped_lock:
+                    self.dropped += 1
+                    dropped = self.dropped
+                    counts[job[1]] = counts.get(job[1], 0) + 1
+                # 避免队列持续满时每次丢弃都写一条日志
+                if dropped == 1 or dropped % DROP_LOG_EVERY == 0:
+                    logger.error(f"记录写入队列已满，丢弃对 {job[1]} 的{job[0]}写入（累计丢弃 {dropped} 次）")
+            return
+
+        try:
+            self._queue.put_nowait(job)
+            return
+        except queue.Full:
+            pass
+        start = time.monotonic()
+        warned = False
+        while True:
+            try:
+                self._queue.put(job, timeout=BLOCK_WARNING_SECONDS)
+                break
+            except queue.Full:
+                if not warned:
+                    logger.warning(f"记录写入队列已满，游戏循环已等待 {time.monotonic() - start:.1f}s")
+                    warned = True
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            batch: List[Optional[_Job]] = [job]
+            while job is not None and len(batch) < self.batch_size:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(job)
+            try:
+                self._write_batch([job for job in batch if job is not None])
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if batch[-1] is None:
+                self._close_files()
+                return
+
+    def _write_batch(self, batch: List[_Job]) -> None:
+        """按顺序处理一批任务，同一文件的多行事件合并写入，批末统一flush和fsync"""
+        pending: Dict[str, bool] = {}
+        for kind, path, data, flag in batch:
+            try:
+                if kind == "append":
+                    file = self._files.get(path)
+                    if file is None:
+                        file = open(path, "a", encoding="utf-8")
+                        self._files[path] = file
+                    file.write(json.dumps(data, ensure_ascii=False) + "\n")
+                    pending[path] = pending.get(path, False) or flag
+                    continue
+                # 其余操作之前先把该文件已经写入的事件落盘
+                self._sync(path, pending.pop(path, None))
+                if kind == "json":
+                    data, sync, then_remove = data
+                    self._write_json(path, data, sync=sync)
+                    if flag:
+                        logger.info(f"游戏记录已保存至 {path}")
+                    for remove_path in then_remove:
+                        file = self._files.pop(remove_path, None)
+                        if file is not None:
+                            file.close()
+                        if os.path.exists(remove_path):
+                            os.remove(remove_path)
+                elif kind == "checkpoint":
+                    data, events_path = data
+                    pending.pop(events_path, None)
+                    # 事件没能落盘时不写检查点，保留上一个一致的检查点
+                    if self._sync(events_path, flag):
+                        self._write_json(path, data, sync=flag)
+                elif kind == "close":
+                    file = self._files.pop(path, None)
+                    if file is not None:
+                        file.close()
+                elif kind == "remove":
+                    if os.path.exists(path):
+                        os.remove(path)
+            except Exception as e:
+                logger.error(f"写入 {path} 失败: {e}")
+        for path, sync in pending.items():
+            self._sync(path, sync)
+
+    @staticmethod
+    def _write_json(path: str, data: Dict, sync: bool = False) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file, indent=4, ensure_ascii=False)
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        if sync:
+            _sync_directory(path)
+
+    def _sync(self, path: str, sync: Optional[bool]) -> bool:
+        """flush（sync为True时再fsync）该路径上打开的事件日志，返回是否成功"""
+        if sync is None:
+            return True
+        file = self._files.get(path)
+        if file is None:
+            return True
+        try:
+            file.flush()
+            if sync:
+                os.fsync(file.fileno())
+        except OSError as e:
+            logger.error(f"写入 {path} 失败: {e}")
+            return False
+        return True
+
+    def _close_files(self) -> None:
+        for file in self._files.values():
+            file.close()
+        self._files.clear()
+
+
+def _sync_directory(path: str) -> None:
+    """fsync文件所在目录，使替换和删除本身落盘（不支持打开目录的平台上跳过）"""
+    try:
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+_writer: Optional[RecordWriter] = None
+_writer_lock = threading.Lock()
+# configure_writer 的参数，fork后的子进程按同样的参数重建写线程
+_writer_options: Dict[str, object] = {}
+
+
+def get_writer() -> RecordWriter:
+    """获取进程内共享的写线程，首次使用时启动"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = RecordWriter(**_writer_options)
+        return _writer
+
+
+def configure_writer(**kwargs) -> RecordWriter:
+    """按参数重新创建共享的写线程（需在开始游戏前调用），旧的写线程会先写完再关闭"""
+    global _writer, _writer_options
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+        _writer = RecordWriter(**kwargs)
+        _writer_options = dict(kwargs)
+        return _writer
+
+
+def _reset_after_fork() -> None:
+    """fork出的子进程只有调用fork的线程，继承来的写线程不存在，锁也可能处于持有状态，丢弃后按需重建"""
+    global _writer, _writer_lock
+    _writer_lock = threading.Lock()
+    _writer = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@atexit.register
+def _flush_on_exit() -> None:
+    with _writer_lock:
+        writer = _writer
+    if writer is not None:
+        writer.close()
@@ -0,0 +1,225 @@
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+from openai import APIConnectionError, APIStatusError
+
+logger = logging.getLogger(__name__)
+
+# 错误类型：fatal 重试也不会成功（鉴权、参数、模型不存在等），retryable 可以退避后重试
+FATAL = "fatal"
+RETRYABLE = "retryable"
+
+# 这些状态码表示请求本身有问题，重试没有意义
+FATAL_STATUS_CODES = {400, 401, 403, 404, 422}
+
+# 退避抖动使用独立的随机数生成器，不影响游戏本身的随机状态
+_jitter_rng = random.Random()
+
+
+class LLMError(Exception):
+    """LLM调用失败，调用方不应再用同一请求重试"""
+
+
+class LLMFatalError(LLMError):
+    """不可重试的错误，例如鉴权失败或请求参数错误"""
+
+
+class LLMUnavailableError(LLMError):
+    """多次退避重试后仍然失败，或所有endpoint都处于熔断状态"""
+
+
+def classify_error(error: Exception) -> str:
+    """将异常分类为 FATAL 或 RETRYABLE"""
+    if isinstance(error, APIStatusError):
+        return FATAL if error.status_code in FATAL_STATUS_CODES else RETRYABLE
+    if isinstance(error, APIConnectionError):
+        return RETRYABLE
+    # 未知异常（例如流式响应中途断开）按可重试处理
+    return RETRYABLE
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """从响应头 retry-after-ms / retry-after 中读取服务端要求的等待时间"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if parsed is None:
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0, retry_after: Optional[float] = None) -> float:
+    """带完全抖动的指数退避时间，服务端给出 Retry-After 时不早于该时间
+
+    Args:
+        attempt: 已失败的次数（从0开始）
+        base: 第一次退避的上限
+        cap: 退避时间上限
+        retry_after: 服务端要求的等待时间
+    """
+    delay = _jitter_rng.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+class EndpointBusyError(Exception):
+    """endpoint处于半开状态且已有探测请求在途，本次请求没有发出"""
+
+
+class CircuitBreaker:
+    """单个endpoint的熔断器
+
+    连续失败达到 failure_threshold 次后熔断（open），期间不再向该endpoint发送请求；
+    经过 recovery_timeout 秒后进入半开状态（half_open），只放行一个探测请求，其余调用方跳过该endpoint或等待，
+    探测失败立即重新熔断，探测成功恢复正常（closed）。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    # 半开状态下探测请求在途时，其他调用方重新检查的间隔
+    PROBE_POLL_INTERVAL = 0.5
+
+    def __init__(self, endpoint: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        # 在途探测请求的编号，0表示没有
+        self._probe = 0
+        self._probe_counter = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def _refresh(self) -> None:
+        """熔断时间已过则进入半开状态，调用方需持有锁"""
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probe = 0
+            logger.info(f"{self.endpoint} 熔断结束，进入半开状态")
+
+    def _available(self) -> bool:
+        return self._state == self.CLOSED or (self._state == self.HALF_OPEN and not self._probe)
+
+    def allow_request(self) -> bool:
+        """现在是否可以向该endpoint发出请求（不占用探测名额）"""
+        with self._lock:
+            self._refresh()
+            return self._available()
+
+    def acquire(self) -> Optional[int]:
+        """
+        发出请求前调用
+
+        Returns:
+            Optional[int]: None 不允许发出；0 普通请求；正数为半开状态下探测请求的编号，
+            需把它传给 record_success / record_failure / release_probe
+        """
+        with self._lock:
+            self._refresh()
+            if not self._available():
+                return None
+            if self._state == self.CLOSED:
+                return 0
+            self._probe_counter += 1
+            self._probe = self._probe_counter
+            logger.info(f"{self.endpoint} 半开状态，发出探测请求")
+            return self._probe
+
+    def retry_in(self) -> float:
+        """距离允许请求还需等待的秒数"""
+        with self._lock:
+            self._refresh()
+            if self._state == self.OPEN:
+                return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+            if not self._available():
+                return self.PROBE_POLL_INTERVAL
+            return 0.0
+
+    def record_success(self, probe: int = 0) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"{self.endpoint} 已恢复，关闭熔断")
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            if probe and probe == self._probe:
+                self._probe = 0
+
+    def record_failure(self, probe: int = 0) -> None:
+        with self._lock:
+            self._refresh()
+            if probe and probe == self._probe:
+                self._probe = 0
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"{self.endpoint} 连续失败 {self._consecutive_failures} 次，熔断 {self.recovery_timeout:.0f}s")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release_probe(self, probe: int) -> None:
+        """探测请求没有得出结果（被取消或遇到不可重试的错误）时交还探测名额，让下一个调用方探测"""
+        if not probe:
+            return
+        with self._lock:
+            if probe == self._probe:
+                self._probe = 0
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+_breaker_settings: Dict = {}
+
+
+def configure_breakers(failure_threshold: int = 5, recovery_timeout: float = 30.0) -> None:
+    """修改之后创建的熔断器的参数"""
+    with _breakers_lock:
+        _breaker_settings.update(failure_threshold=failure_threshold, recovery_timeout=recovery_timeout)
+        _breakers.clear()
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    """获取endpoint对应的熔断器，同一进程内所有玩家共享"""
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(endpoint, **_breaker_settings)
+            _breakers[endpoint] = breaker
+        return breaker
+
+
+def available_endpoints(endpoints: Sequence[str]) -> List[str]:
+    """当前可以发出请求的endpoint（未熔断，且不是已有探测请求在途的半开endpoint）"""
+    return [endpoint for endpoint in endpoints if get_breaker(endpoint).allow_request()]
@@ -0,0 +1,441 @@
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 请求类型
+PLAY = "play"
+CHALLENGE = "challenge"
+REFLECT = "reflect"
+REFLECT_ALL = "reflect_all"
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+_HAND_PATTERN = re.compile(r"你(?:当前|现在)的手牌是[:：]\s*(.*)")
+_TARGET_PATTERN = re.compile(r"目标牌[是为:：]\s*([QKA])")
+_PLAYERS_PATTERN = re.compile(r"你需要更新印象的玩家有[:：]\s*(.*)")
+_REFLECT_PLAYER_PATTERN = re.compile(r"以下是你对玩家(.+?)此前的了解")
+
+_BEHAVIORS = ["面无表情地把牌推了出去", "犹豫片刻后轻轻放下牌", "微笑着看了看其他人", "敲了敲桌子，快速出牌"]
+_REASONS = ["手里的牌足够应付这一轮", "保持节奏，不给对手太多信息", "试探一下下家的反应"]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数：中文约每个字一个token，其余约每4个字符一个token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def detect_request_type(prompt: str) -> str:
+    """根据提示词中要求输出的键判断请求类型"""
+    if "played_cards" in prompt:
+        return PLAY
+    if "was_challenged" in prompt:
+        return CHALLENGE
+    if _PLAYERS_PATTERN.search(prompt):
+        return REFLECT_ALL
+    return REFLECT
+
+
+class StubBehavior:
+    """桩服务器的行为配置：延迟分布、生成速度和各类故障的注入比例"""
+
+    def __init__(self, latency: float = 0.2, latency_dist: str = "lognormal", latency_spread: float = 0.5,
+                 tokens_per_second: float = 0.0, error_rate: float = 0.0, burst_rate: float = 0.0,
+                 burst_duration: float = 2.0, malformed_rate: float = 0.0, challenge_rate: float = 0.3,
+                 reasoning_tokens: int = 0, prefill_tokens_per_second: float = 0.0, seed: Optional[int] = None):
+        """
+        Args:
+            latency: 首token延迟的中位数（秒）
+            latency_dist: 延迟分布，fixed / uniform / exponential / lognormal
+            latency_spread: uniform 时为相对中位数的半宽比例，lognormal 时为对数标准差
+            tokens_per_second: 生成速度，0表示输出不额外耗时
+            error_rate: 返回500错误的比例
+            burst_rate: 每个请求触发一段429限流期的概率
+            burst_duration: 每段限流期的持续时间（秒）
+            malformed_rate: 返回无法解析的内容的比例
+            challenge_rate: 质疑决策中选择质疑的概率
+            reasoning_tokens: 每次回复附带的推理内容长度，0表示不返回推理内容
+            prefill_tokens_per_second: 未命中前缀缓存的prompt token的处理速度，0表示不计入延迟
+            seed: 随机种子
+        """
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"未知的延迟分布: {latency_dist}，可选: {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_spread = latency_spread
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.burst_rate = burst_rate
+        self.burst_duration = burst_duration
+        self.malformed_rate = malformed_rate
+        self.challenge_rate = challenge_rate
+        self.reasoning_tokens = reasoning_tokens
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._burst_until = 0.0
+
+    def random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def choice(self, seq):
+        with self._lock:
+            return self._rng.choice(seq)
+
+    def sample(self, seq, k: int) -> List:
+        with self._lock:
+            return self._rng.sample(seq, k)
+
+    def randint(self, a: int, b: int) -> int:
+        with self._lock:
+            return self._rng.randint(a, b)
+
+    def sample_latency(self) -> float:
+        """按配置的分布采样一次首token延迟"""
+        with self._lock:
+            if self.latency_dist == "fixed":
+                return self.latency
+            if self.latency_dist == "uniform":
+                half_width = self.latency * self.latency_spread
+                return max(0.0, self._rng.uniform(self.latency - half_width, self.latency + half_width))
+            if self.latency_dist == "exponential":
+                return self._rng.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+            return self._rng.lognormvariate(math.log(self.latency), self.latency_spread) if self.latency > 0 else 0.0
+
+    def throttled_for(self) -> float:
+        """当前是否处于限流期：返回剩余秒数，未限流时返回0；按 burst_rate 开启新的限流期"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._burst_until:
+                return self._burst_until - now
+            if self.burst_rate and self._rng.random() < self.burst_rate:
+                self._burst_until = now + self.burst_duration
+                logger.info(f"开始一段 {self.burst_duration:.1f}s 的429限流期")
+                return self.burst_duration
+            return 0.0
+
+    def prefill_time(self, uncached_tokens: int) -> float:
+        if self.prefill_tokens_per_second <= 0:
+            return 0.0
+        return uncached_tokens / self.prefill_tokens_per_second
+
+    def generation_time(self, completion_tokens: int) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return completion_tokens / self.tokens_per_second
+
+
+class PrefixCache:
+    """模拟服务端的自动前缀缓存
+
+    与 vLLM 的做法类似，把请求文本切成固定长度的块并做链式哈希，
+    从头开始连续命中的块视为已缓存的前缀；缓存按LRU淘汰。
+    """
+
+    def __init__(self, block_chars: int = 64, max_blocks: int = 65536):
+        self.block_chars = block_chars
+        self.max_blocks = max_blocks
+        self._blocks: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def match_and_insert(self, text: str) -> int:
+        """返回命中缓存的前缀字符数，并把该请求的所有完整块加入缓存"""
+        cached_chars = 0
+        matching = True
+        block_hash = 0
+        with self._lock:
+            for start in range(0, len(text) - self.block_chars + 1, self.block_chars):
+                block_hash = hash((block_hash, text[start:start + self.block_chars]))
+                if matching and block_hash in self._blocks:
+                    self._blocks.move_to_end(block_hash)
+                    cached_chars += self.block_chars
+                    continue
+                matching = False
+                self._blocks[block_hash] = None
+                if len(self._blocks) > self.max_blocks:
+                    self._blocks.popitem(last=False)
+        return cached_chars
+
+
+def render_messages(messages: List[Dict]) -> str:
+    """把消息列表渲染为一段文本，近似服务端套用chat模板后的输入"""
+    return "".join(f"<|{message.get('role')}|>{message.get('content') or ''}" for message in messages)
+
+
+def build_reply(messages: List[Dict], behavior: StubBehavior) -> str:
+    """按最后一条user消息的类型生成合法的回复内容（多轮对话中前面的消息是历史请求）"""
+    prompt = render_messages(messages)
+    user_messages = [message.get("content") or "" for message in messages if message.get("role") == "user"]
+    request = user_messages[-1] if user_messages else prompt
+    request_type = detect_request_type(request)
+    if request_type == PLAY:
+        hand_match = _HAND_PATTERN.search(request)
+        hand = [card.strip() for card in hand_match.group(1).split(",") if card.strip()] if hand_match else []
+        if not hand:
+            hand = ["Q"]
+        # 目标牌在轮次信息中，多轮对话时只出现在本轮的第一条user消息里
+        targets = _TARGET_PATTERN.findall(prompt)
+        target = targets[-1] if targets else None
+        # 优先出目标牌和Joker，不够时随机补牌
+        honest = [card for card in hand if card in (target, "Joker")]
+        count = behavior.randint(1, min(3, len(hand)))
+        played = honest[:count]
+        rest = [card for card in hand]
+        for card in played:
+            rest.remove(card)
+        played += behavior.sample(rest, count - len(played))
+        return json.dumps({
+            "played_cards": played,
+            "behavior": behavior.choice(_BEHAVIORS),
+            "play_reason": behavior.choice(_REASONS)
+        }, ensure_ascii=False)
+    if request_type == CHALLENGE:
+        was_challenged = behavior.random() < behavior.challenge_rate
+        return json.dumps({
+            "was_challenged": was_challenged,
+            "challenge_reason": "上家出牌太顺利，值得怀疑" if was_challenged else "没有足够的理由怀疑上家"
+        }, ensure_ascii=False)
+    if request_type == REFLECT_ALL:
+        names = [name.strip() for name in _PLAYERS_PATTERN.search(request).group(1).split("、") if name.strip()]
+        return json.dumps({name: f"{name}出牌稳健，质疑谨慎，需要留意其虚张声势。" for name in names}, ensure_ascii=False)
+    player_match = _REFLECT_PLAYER_PATTERN.search(request)
+    name = player_match.group(1) if player_match else "该玩家"
+    return f"{name}出牌稳健，质疑谨慎，需要留意其虚张声势。"
+
+
+def malform(content: str, behavior: StubBehavior) -> str:
+    """把合法回复变成无法解析的内容：截断json或只输出文字"""
+    if behavior.random() < 0.5:
+        return content[:max(1, len(content) // 2)]
+    return "我需要再想想这一步该怎么出。"
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "StubLLMServer"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str, error_type: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send_json(status, {"error": {"message": message, "type": error_type}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": self.server.model_name, "object": "model"}]})
+        else:
+            self._send_error(404, f"未知路径 {self.path}", "not_found")
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_error(404, f"未知路径 {self.path}", "not_found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            messages = request["messages"]
+        except (ValueError, KeyError) as e:
+            self._send_error(400, f"无效的请求: {str(e)}", "invalid_request_error")
+            return
+
+        behavior = self.server.behavior
+        self.server.count("requests")
+        throttled = behavior.throttled_for()
+        if throttled:
+            self.server.count("throttled")
+            self._send_error(429, "请求过多，请稍后重试", "rate_limit_exceeded",
+                             {"Retry-After": f"{throttled:.2f}"})
+            return
+        if behavior.random() < behavior.error_rate:
+            self.server.count("errors")
+            self._send_error(500, "注入的服务端错误", "server_error")
+            return
+
+        prompt = render_messages(messages)
+        content = build_reply(messages, behavior)
+        if behavior.random() < behavior.malformed_rate:
+            self.server.count("malformed")
+            content = malform(content, behavior)
+        reasoning = "思考中……" * (behavior.reasoning_tokens // 4) if behavior.reasoning_tokens else ""
+        cached_chars = self.server.prefix_cache.match_and_insert(prompt) if self.server.prefix_cache else 0
+        cached_tokens = estimate_tokens(prompt[:cached_chars])
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": estimate_tokens(content) + estimate_tokens(reasoning),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        time.sleep(behavior.sample_latency() + behavior.prefill_time(usage["prompt_tokens"] - cached_tokens))
+        model = request.get("model") or self.server.model_name
+        if request.get("stream"):
+            include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            self._stream(model, content, reasoning, usage if include_usage else None)
+        else:
+            time.sleep(behavior.generation_time(usage["completion_tokens"]))
+            message = {"role": "assistant", "content": content}
+            if reasoning:
+                message["reasoning_content"] = reasoning
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+    def _stream(self, model: str, content: str, reasoning: str, usage: Optional[Dict]) -> None:
+        """以SSE格式按 tokens_per_second 的速度逐段输出"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def event(delta: Dict, finish_reason: Optional[str] = None, chunk_usage: Optional[Dict] = None) -> bytes:
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if chunk_usage is None else []
+            }
+            if chunk_usage is not None:
+                chunk["usage"] = chunk_usage
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        try:
+            self.wfile.write(event({"role": "assistant", "content": ""}))
+            for key, text in (("reasoning_content", reasoning), ("content", content)):
+                for piece in _split_pieces(text):
+                    time.sleep(self.server.behavior.generation_time(estimate_tokens(piece)))
+                    self.wfile.write(event({key: piece}))
+                    self.wfile.flush()
+            self.wfile.write(event({}, finish_reason="stop"))
+            if usage is not None:
+                self.wfile.write(event({}, chunk_usage=usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端拿到完整决策后提前断开
+            self.server.count("client_disconnects")
+
+
+def _split_pieces(text: str, size: int = 4) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """兼容 OpenAI /v1/chat/completions 的本地桩服务器"""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], behavior: StubBehavior, model_name: str = "stub-model",
+                 prefix_cache: bool = True):
+        super().__init__(address, StubRequestHandler)
+        self.behavior = behavior
+        self.model_name = model_name
+        self.prefix_cache: Optional[PrefixCache] = PrefixCache() if prefix_cache else None
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def count(self, key: str) -> None:
+        with self._stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+
+def start_stub_server(behavior: Optional[StubBehavior] = None, host: str = "127.0.0.1", port: int = 0,
+                      model_name: str = "stub-model", prefix_cache: bool = True) -> StubLLMServer:
+    """在后台线程中启动桩服务器，port 为0时自动选择空闲端口，可通过 server.base_url 获取地址"""
+    server = StubLLMServer((host, port), behavior or StubBehavior(), model_name, prefix_cache)
+    threading.Thread(target=server.serve_forever, name="stub-llm-server", daemon=True).start()
+    return server
+
+
+def parse_arguments():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='启动兼容OpenAI接口的本地桩LLM服务器，用于离线压测')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口 (默认: 8765)')
+    parser.add_argument('--model', type=str, default='stub-model', help='返回的模型名称 (默认: stub-model)')
+    parser.add_argument('--latency', type=float, default=0.2, help='首token延迟的中位数，单位秒 (默认: 0.2)')
+    parser.add_argument('--latency-dist', type=str, default='lognormal', choices=LATENCY_DISTRIBUTIONS,
+                        help='延迟分布 (默认: lognormal)')
+    parser.add_argument('--latency-spread', type=float, default=0.5,
+                        help='uniform 时为相对半宽，lognormal 时为对数标准差 (默认: 0.5)')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='生成速度，0表示不限速 (默认: 0)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500错误的比例 (默认: 0)')
+    parser.add_argument('--burst-rate', type=float, default=0.0, help='每个请求触发一段429限流期的概率 (默认: 0)')
+    parser.add_argument('--burst-duration', type=float, default=2.0, help='每段429限流期的秒数 (默认: 2)')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='返回无法解析内容的比例 (默认: 0)')
+    parser.add_argument('--challenge-rate', type=float, default=0.3, help='选择质疑的概率 (默认: 0.3)')
+    parser.add_argument('--reasoning-tokens', type=int, default=0, help='每次回复附带的推理内容长度 (默认: 0)')
+    parser.add_argument('--prefill-tokens-per-second', type=float, default=0.0,
+                        help='未命中前缀缓存的prompt token的处理速度，0表示不计入延迟 (默认: 0)')
+    parser.add_argument('--no-prefix-cache', action='store_true', help='关闭模拟的前缀缓存 (默认: 开启)')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子 (默认: 不固定)')
+    parser.add_argument('--log-level', type=str, default='INFO', help='指定日志记录级别 (默认: INFO)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    behavior = StubBehavior(
+        latency=args.latency,
+        latency_dist=args.latency_dist,
+        latency_spread=args.latency_spread,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        burst_rate=args.burst_rate,
+        burst_duration=args.burst_duration,
+        malformed_rate=args.malformed_rate,
+        challenge_rate=args.challenge_rate,
+        reasoning_tokens=args.reasoning_tokens,
+        prefill_tokens_per_second=args.prefill_tokens_per_second,
+        seed=args.seed
+    )
+    server = StubLLMServer((args.host, args.port), behavior, args.model, prefix_cache=not args.no_prefix_cache)
+    logger.info(f"桩LLM服务器已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"桩LLM服务器已停止，请求统计: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
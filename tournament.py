@@ -0,0 +1,521 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+from tqdm import tqdm
+from concurrency_limiter import install_shared_backend
+from game import arun_tables
+from game_record import generate_game_id
+from game_server import derive_seed
+from matchmaking import DEFAULT_TABLE_SIZE, Matchmaker
+from ratings import Ratings, load_ratings, print_leaderboard
+from tournament_stats import TournamentStats, elimination_order, record_elimination_order
+from llm_client import aclose_clients
+from llm_metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEDGER_DIR = "tournaments"
+
+# 任务状态：pending 等待运行；running 已分派给工作进程；done 已完成；failed 失败（未超过重试次数时会重新运行）
+JOB_STATUSES = ("pending", "running", "done", "failed")
+
+
+def config_fingerprint(player_configs: List[Dict], duplicate: bool = False, table_size: Optional[int] = None) -> str:
+    """玩家配置（和是否为复式赛、匹配时每桌人数）的哈希，用于确认续跑时使用的是同一份配置"""
+    options = {"player_configs": player_configs, "duplicate": duplicate}
+    if table_size is not None:
+        options["table_size"] = table_size
+    payload = json.dumps(options, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def default_ledger_path() -> str:
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(DEFAULT_LEDGER_DIR, f"tournament_{timestamp}.sqlite")
+
+
+class TournamentLedger:
+    """锦标赛的任务账本
+
+    每局游戏一行，记录状态、尝试次数、游戏ID、参赛玩家和结果摘要，保存在SQLite中，只由调度进程读写。
+    游戏ID和参赛玩家在第一次分派时确定，重试时沿用，使中断的游戏可以从检查点继续。
+    调度进程中断后，用同一个账本重新运行即可跳过已完成的游戏。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite文件路径
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "game_num INTEGER PRIMARY KEY, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "game_id TEXT, winner TEXT, summary TEXT, error TEXT, started_at REAL, finished_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_status ON jobs(status)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "players" not in columns:
+            # 匹配模式下每局分派时选定的玩家（json列表）
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN players TEXT")
+        self._conn.commit()
+
+    def init_jobs(self, num_games: int, fingerprint: str) -> int:
+        """
+        登记第 1 到 num_games 局游戏，已存在的任务保持不变
+
+        Args:
+            num_games: 游戏局数
+            fingerprint: 玩家配置的哈希，与账本中记录的不一致时拒绝续跑
+
+        Returns:
+            int: 新登记的任务数
+        """
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'config'").fetchone()
+        if row is None:
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('config', ?)", (fingerprint,))
+        elif row[0] != fingerprint:
+            raise ValueError(f"玩家配置与账本 {self.path} 中记录的不一致，请使用新的账本")
+        cursor = self._conn.executemany(
+            "INSERT OR IGNORE INTO jobs (game_num, status) VALUES (?, 'pending')",
+            [(game_num,) for game_num in range(1, num_games + 1)]
+        )
+        self._conn.commit()
+        return cursor.rowcount
+
+    def tournament_seed(self, requested: Optional[int] = None) -> int:
+        """
+        锦标赛种子，第一次运行时记录在账本中，续跑时沿用
+
+        Args:
+            requested: 指定的种子，None表示沿用账本中的种子或随机生成
+        """
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'seed'").fetchone()
+        if row is not None:
+            if requested is not None and requested != int(row[0]):
+                raise ValueError(f"账本 {self.path} 的种子是 {row[0]}，与指定的 {requested} 不一致")
+            return int(row[0])
+        seed = requested if requested is not None else random.randrange(2 ** 32)
+        self._conn.execute("INSERT INTO meta (key, value) VALUES ('seed', ?)", (str(seed),))
+        self._conn.commit()
+        return seed
+
+    def recover(self) -> int:
+        """把已分派但没有结果的任务（上次运行被中断）放回等待队列，返回放回的数量"""
+        cursor = self._conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+        self._conn.commit()
+        return cursor.rowcount
+
+    def runnable_jobs(self, num_games: int, max_attempts: int) -> List[int]:
+        """等待运行的任务和尝试次数未用完的失败任务"""
+        rows = self._conn.execute(
+            "SELECT game_num FROM jobs WHERE game_num <= ? AND "
+            "(status = 'pending' OR (status = 'failed' AND attempts < ?)) ORDER BY game_num",
+            (num_games, max_attempts)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_running(self, game_nums: List[int]) -> Dict[int, str]:
+        """把任务标记为已分派，第一次分派时分配游戏ID，返回 {局号: 游戏ID}"""
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE jobs SET status = 'running', started_at = ?, game_id = COALESCE(game_id, ?) WHERE game_num = ?",
+            [(now, generate_game_id(), game_num) for game_num in game_nums]
+        )
+        self._conn.commit()
+        wanted = set(game_nums)
+        rows = self._conn.execute("SELECT game_num, game_id FROM jobs WHERE status = 'running'").fetchall()
+        return {game_num: game_id for game_num, game_id in rows if game_num in wanted}
+
+    def table(self, game_num: int) -> Optional[List[str]]:
+        """第一次分派时为该局选定的玩家，尚未选定时返回None"""
+        row = self._conn.execute("SELECT players FROM jobs WHERE game_num = ?", (game_num,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def assign_table(self, game_num: int, players: List[str]) -> None:
+        self._conn.execute("UPDATE jobs SET players = ? WHERE game_num = ?",
+                           (json.dumps(players, ensure_ascii=False), game_num))
+        self._conn.commit()
+
+    def record_results(self, summaries: List[Dict]) -> None:
+        """写入一批游戏的结果摘要，有error的记为失败"""
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE jobs SET status = ?, attempts = attempts + 1, game_id = COALESCE(?, game_id), winner = ?, summary = ?, "
+            "error = ?, finished_at = ? WHERE game_num = ?",
+            [
+                (
+                    "failed" if summary.get("error") else "done",
+                    summary.get("game_id"),
+                    summary.get("winner"),
+                    json.dumps(summary, ensure_ascii=False),
+                    summary.get("error"),
+                    now,
+                    summary["game_num"],
+                )
+                for summary in summaries
+            ]
+        )
+        self._conn.commit()
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        counts = {status: 0 for status in JOB_STATUSES}
+        for status, count in self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def summaries(self) -> List[Dict]:
+        """已完成游戏的结果摘要，按局号排序"""
+        rows = self._conn.execute(
+            "SELECT summary FROM jobs WHERE status = 'done' ORDER BY game_num"
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def init_worker(limiter_state, limiter_condition, limiter_settings, metrics_dir=None):
+    """工作进程初始化：接入共享的并发窗口，并按进程写出LLM调用指标快照"""
+    install_shared_backend(limiter_state, limiter_condition, limiter_settings)
+    if metrics_dir:
+        # 工作进程随进程池一起退出，快照按间隔写出
+        metrics.start_snapshot_writer(os.path.join(metrics_dir, f"metrics_{os.getpid()}.json"), interval=10.0)
+
+
+def rotate_seats(player_configs: List[Dict], rotation: int) -> List[Dict]:
+    """把玩家整体向前轮换rotation个座位"""
+    rotation %= len(player_configs)
+    return player_configs[rotation:] + player_configs[:rotation]
+
+
+def summarize_game(game_num: int, game) -> Dict:
+    """提取一局游戏的结果摘要，完整记录已由游戏自己写入 game_records"""
+    record = game.game_record
+    return {
+        "game_num": game_num,
+        "game_id": record.game_id,
+        "winner": record.winner,
+        "players": record.player_names,
+        "rounds": len(record.rounds),
+        "seed": record.seed,
+        "eliminated": elimination_order(record.player_names, [
+            (round.round_result.shooter_name, round.round_result.bullet_hit)
+            for round in record.rounds if round.round_result
+        ]),
+        "error": None,
+    }
+
+
+def load_finished_summary(game_num: int, game_id: str, save_directory: str = "game_records") -> Optional[Dict]:
+    """游戏已经结束（结果没来得及写入账本）时，从json记录中读取摘要"""
+    path = os.path.join(save_directory, f"{game_id}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        record = json.load(file)
+    if not record.get("winner"):
+        return None
+    return {
+        "game_num": game_num,
+        "game_id": game_id,
+        "winner": record["winner"],
+        "players": record["player_names"],
+        "rounds": len(record["rounds"]),
+        "seed": record.get("seed"),
+        "eliminated": record_elimination_order(record),
+        "error": None,
+    }
+
+
+def run_job_batch(jobs: List[Tuple[int, str, int, List[Dict]]]) -> List[Dict]:
+    """在工作进程的一个事件循环中并发运行一批游戏，返回每局的结果摘要
+
+    每个任务为 (局号, 游戏ID, 种子, 按座位顺序的玩家配置)。
+    留有检查点的游戏（之前中断或失败）从检查点继续，已经结束的游戏直接读取记录。
+    """
+    summaries = {}
+    pending = []
+    for job in jobs:
+        summary = load_finished_summary(job[0], job[1])
+        if summary is not None:
+            summaries[job[0]] = summary
+        else:
+            pending.append(job)
+
+    async def main():
+        try:
+            return await arun_tables([player_configs for _, _, _, player_configs in pending],
+                                     max_concurrent_tables=max(1, len(pending)),
+                                     game_ids=[game_id for _, game_id, _, _ in pending],
+                                     seeds=[seed for _, _, seed, _ in pending])
+        finally:
+            await aclose_clients()
+
+    if pending:
+        try:
+            games = asyncio.run(main())
+        except Exception as e:
+            logger.error(f"第 {pending[0][0]}-{pending[-1][0]} 局游戏运行失败: {e}")
+            games = [e] * len(pending)
+        for (game_num, game_id, _, _), game in zip(pending, games):
+            if isinstance(game, BaseException):
+                summaries[game_num] = {"game_num": game_num, "game_id": game_id, "winner": None, "error": str(game)}
+            else:
+                summaries[game_num] = summarize_game(game_num, game)
+    return [summaries[job[0]] for job in jobs]
+
+
+class Tournament:
+    """可续跑的锦标赛调度器
+
+    游戏按批分派给进程池，每个工作进程在一个事件循环中并发运行一批游戏，只把结果摘要返回调度进程。
+    每批完成后立即写入任务账本；中断（Ctrl-C或崩溃）后用同一个账本重新运行，已完成的游戏不会重跑，
+    未完成和失败的游戏从各自最近的检查点继续。
+
+    每局游戏的种子由锦标赛种子和发牌序号派生。复式赛（duplicate）中每副发牌连续进行与玩家数相同的局数，
+    每局把玩家轮换一个座位，各模型在同一副牌的每个座位上各打一次，抵消发牌和子弹位置的运气。
+
+    指定 stop_confidence 时，每批游戏完成后对每对玩家的成绩差做时间一致的检验，排名在该置信水平下确定后
+    不再分派新的游戏（已经开始的游戏照常完成），剩余的局数留在账本中。
+
+    匹配模式（matchmaking）下player_configs是候选玩家池，每局开始前由 Matchmaker 按当前评分挑选
+    table_size 名玩家；评分在每局结束后增量更新并保存到 ratings_path，下次运行时沿用。
+    """
+
+    def __init__(self, player_configs: List[Dict], num_games: int, ledger_path: Optional[str] = None,
+                 processes: int = 20, tables_per_process: int = 1, max_attempts: int = 2,
+                 limiter_settings: Optional[Dict] = None, metrics_dir: Optional[str] = None,
+                 seed: Optional[int] = None, duplicate: bool = False, stop_confidence: Optional[float] = None,
+                 stop_metric: str = "win_rate", stop_target: str = "top1", min_games: int = 20,
+                 matchmaking: bool = False, table_size: int = DEFAULT_TABLE_SIZE, ratings_path: Optional[str] = None,
+                 rating_backend: Optional[str] = None):
+        """
+        Args:
+            player_configs: 玩家配置列表
+            num_games: 游戏局数
+            ledger_path: 任务账本路径，已存在时续跑，None表示在 DEFAULT_LEDGER_DIR 下新建
+            processes: 工作进程数
+            tables_per_process: 每个工作进程同时运行的游戏局数
+            max_attempts: 每局游戏的最多尝试次数
+            limiter_settings: 所有进程共享的并发窗口参数
+            metrics_dir: 每个工作进程定期把LLM调用指标快照写入该目录
+            seed: 锦标赛种子，None表示随机生成（记录在账本中，续跑时沿用）
+            duplicate: 复式赛，局数向上取整为玩家数的倍数
+            stop_confidence: 排名在该置信水平下确定后提前结束，None表示运行全部局数
+            stop_metric: 排名依据，见 STOP_METRICS
+            stop_target: 提前结束的条件，见 STOP_TARGETS
+            min_games: 至少完成的局数，之后才检查是否提前结束
+            matchmaking: 按评分从玩家池中挑选每一桌
+            table_size: 匹配模式下每桌的人数
+            ratings_path: 评分json路径，已存在时在其基础上更新；匹配模式下None表示放在账本旁边，否则不计算评分
+            rating_backend: 评分方式，见 RATING_BACKENDS，None表示沿用评分文件中的（新建时为elo）
+        """
+        if matchmaking and duplicate:
+            raise ValueError("匹配模式每局的玩家不同，不能与复式赛同时使用")
+        names = [config["name"] for config in player_configs]
+        if len(set(names)) != len(names):
+            raise ValueError("玩家名称不能重复")
+        self.player_configs = player_configs
+        self.duplicate = duplicate
+        if duplicate:
+            seats = len(player_configs)
+            num_games = -(-num_games // seats) * seats
+        self.num_games = num_games
+        self.ledger_path = ledger_path or default_ledger_path()
+        self.processes = processes
+        self.tables_per_process = max(1, tables_per_process)
+        self.max_attempts = max(1, max_attempts)
+        self.limiter_settings = limiter_settings or {}
+        self.metrics_dir = metrics_dir
+        self.seed = seed
+        self.stop_confidence = stop_confidence
+        self.stop_metric = stop_metric
+        self.stop_target = stop_target
+        self.min_games = min_games
+        self.stopped_early = False
+        self.matchmaking = matchmaking
+        self.table_size = table_size
+        if matchmaking and ratings_path is None:
+            ratings_path = os.path.splitext(self.ledger_path)[0] + ".ratings.json"
+        self.ratings_path = ratings_path
+        self.rating_backend = rating_backend
+        self.ratings: Optional[Ratings] = None
+        self.matchmaker: Optional[Matchmaker] = None
+
+    def run(self) -> Dict[str, int]:
+        """运行所有未完成的游戏，返回各状态的任务数（被中断时返回中断时的状态）"""
+        ledger = TournamentLedger(self.ledger_path)
+        try:
+            ledger.init_jobs(self.num_games, config_fingerprint(
+                self.player_configs, self.duplicate, self.table_size if self.matchmaking else None
+            ))
+            self.seed = ledger.tournament_seed(self.seed)
+            if self.ratings_path:
+                self.ratings = load_ratings(self.ratings_path, self.rating_backend)
+            if self.matchmaking:
+                self.matchmaker = Matchmaker([config["name"] for config in self.player_configs], self.ratings,
+                                             self.table_size, rng=random.Random(derive_seed(self.seed, "matchmaking")))
+            recovered = ledger.recover()
+            if recovered:
+                logger.info(f"上次运行中断时有 {recovered} 局游戏未完成，将重新运行")
+            print(f"任务账本: {self.ledger_path}（中断后使用相同的账本可以继续运行），种子: {self.seed}")
+
+            with multiprocessing.Manager() as manager:
+                limiter_state = manager.dict()
+                limiter_condition = manager.Condition()
+                with multiprocessing.Pool(processes=self.processes,
+                                          initializer=init_worker,
+                                          initargs=(limiter_state, limiter_condition, self.limiter_settings,
+                                                    self.metrics_dir)) as pool:
+                    self._run_jobs(ledger, pool)
+            if self.ratings is not None:
+                print(f"\n评分（{self.ratings.name}，保存在 {self.ratings_path}）:")
+                print_leaderboard(self.ratings)
+            return ledger.counts()
+        except KeyboardInterrupt:
+            # 已分派的任务放回等待队列，下次运行时重新开始
+            ledger.recover()
+            print(f"\n已中断，已完成的游戏记录在 {self.ledger_path}，使用相同的账本重新运行即可继续。")
+            return ledger.counts()
+        finally:
+            ledger.close()
+
+    def _run_jobs(self, ledger: TournamentLedger, pool) -> None:
+        stats = TournamentStats()
+        for summary in ledger.summaries():
+            stats.add(summary)
+            # 上次运行在写入账本之后、保存评分之前中断时补上
+            self._rate(summary)
+        # 局号 -> 参赛玩家，结果返回后从匹配的在途计数中扣除
+        tables: Dict[int, List[str]] = {}
+        counts = ledger.counts()
+        # 同时在途的批次数与进程数相同，一批完成后再分派下一批，提前结束时不会有大量已分派的游戏
+        results: "queue.Queue[List[Dict]]" = queue.Queue()
+        in_flight = 0
+        with tqdm(total=self.num_games, initial=min(counts["done"], self.num_games), desc="运行游戏") as progress:
+            while True:
+                if not self.stopped_early and self._settled(stats):
+                    self.stopped_early = True
+                    progress.write(f"排名已在 {self.stop_confidence:.0%} 置信水平下确定，不再开始新的游戏")
+                # 失败的游戏在尝试次数用完之前会再次分派
+                game_nums = [] if self.stopped_early else ledger.runnable_jobs(self.num_games, self.max_attempts)
+                while game_nums and in_flight < self.processes:
+                    batch_nums, game_nums = game_nums[:self.tables_per_process], game_nums[self.tables_per_process:]
+                    game_ids = ledger.mark_running(batch_nums)
+                    jobs = []
+                    for game_num in batch_nums:
+                        seed, player_configs = self._game_plan(ledger, game_num)
+                        tables[game_num] = [config["name"] for config in player_configs]
+                        jobs.append((game_num, game_ids[game_num], seed, player_configs))
+                    pool.apply_async(
+                        run_job_batch, (jobs,), callback=results.put,
+                        error_callback=lambda e, jobs=jobs: results.put([
+                            {"game_num": job[0], "game_id": job[1], "winner": None, "error": f"{type(e).__name__}: {e}"}
+                            for job in jobs
+                        ])
+                    )
+                    in_flight += 1
+                if in_flight == 0:
+                    break
+
+                summaries = results.get()
+                in_flight -= 1
+                ledger.record_results(summaries)
+                for summary in summaries:
+                    if self.matchmaker is not None:
+                        self.matchmaker.finish(tables.pop(summary["game_num"], []))
+                    if summary["error"]:
+                        logger.error(f"第 {summary['game_num']} 局游戏失败: {summary['error']}")
+                    else:
+                        stats.add(summary)
+                        self._rate(summary)
+                if self.ratings is not None:
+                    self.ratings.save(self.ratings_path)
+                progress.update(sum(1 for summary in summaries if not summary["error"]))
+                if self.stop_confidence is not None and stats.games:
+                    leader = stats.standings(self.stop_confidence, self.stop_metric)[0]
+                    progress.set_postfix_str(
+                        f"领先: {leader['player']} {leader[self.stop_metric]:.2f} "
+                        f"[{leader['interval'][0]:.2f}, {leader['interval'][1]:.2f}]"
+                    )
+
+    def _settled(self, stats: TournamentStats) -> bool:
+        if self.stop_confidence is None or stats.games < self.min_games:
+            return False
+        return stats.settled(self.stop_confidence, self.stop_metric, self.stop_target, tune_n=self.min_games)
+
+    def _rate(self, summary: Dict) -> None:
+        if self.ratings is not None and summary.get("eliminated"):
+            self.ratings.record_game(summary.get("game_id"), summary["eliminated"])
+
+    def _game_plan(self, ledger: TournamentLedger, game_num: int) -> Tuple[int, List[Dict]]:
+        """第game_num局游戏的 (种子, 按座位顺序的玩家配置)"""
+        if self.matchmaking:
+            # 重试的游戏沿用第一次分派时的玩家，才能从检查点继续
+            table = ledger.table(game_num)
+            if table is None:
+                table = self.matchmaker.next_table()
+                ledger.assign_table(game_num, table)
+            else:
+                self.matchmaker.start(table)
+            configs = {config["name"]: config for config in self.player_configs}
+            return derive_seed(self.seed, game_num), [configs[name] for name in table]
+        if not self.duplicate:
+            return derive_seed(self.seed, game_num), self.player_configs
+        seats = len(self.player_configs)
+        deal, rotation = divmod(game_num - 1, seats)
+        return derive_seed(self.seed, deal + 1), rotate_seats(self.player_configs, rotation)
+
+
+def print_ledger(path: str, confidence: float = 0.95) -> None:
+    """打印账本中的任务状态，以及各玩家的胜率和平均存活积分及其置信区间"""
+    ledger = TournamentLedger(path)
+    try:
+        counts = ledger.counts()
+        print("，".join(f"{status}: {count}" for status, count in counts.items()))
+        stats = TournamentStats()
+        for summary in ledger.summaries():
+            stats.add(summary)
+    finally:
+        ledger.close()
+    if not stats.games:
+        return
+    points = {row["player"]: row for row in stats.standings(confidence, "points")}
+    print(f"{stats.games} 局已完成，{confidence:.0%} 置信区间（按玩家数修正）：")
+    for row in stats.standings(confidence, "win_rate"):
+        line = (f"{row['player']}: {row['wins']}/{row['games']} 胜 ({row['win_rate']:.1%}, "
+                f"[{row['interval'][0]:.1%}, {row['interval'][1]:.1%}])")
+        point_row = points[row["player"]]
+        if point_row["points"] is not None:
+            line += (f"，平均存活积分 {point_row['points']:.2f} "
+                     f"[{point_row['interval'][0]:.2f}, {point_row['interval'][1]:.2f}]")
+        print(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="查看锦标赛任务账本的进度和胜场统计")
+    parser.add_argument("ledger", help="任务账本的SQLite路径")
+    parser.add_argument("--confidence", type=float, default=0.95, help="置信水平 (默认: 0.95)")
+    args = parser.parse_args()
+    print_ledger(args.ledger, args.confidence)
@@ -0,0 +1,261 @@
+import math
+import random
+from collections import defaultdict
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 提前结束的条件：top1 第一名确定；ranking 完整排名确定
+STOP_TARGETS = ("top1", "ranking")
+# 排名依据：win_rate 胜率（Wilson区间）；points 平均存活积分（按发牌分组的bootstrap区间）
+STOP_METRICS = ("win_rate", "points")
+
+DEFAULT_BOOTSTRAP_RESAMPLES = 1000
+# 组数少于该值时重抽样的结果几乎不变，百分位区间过窄，改用保守的区间
+MIN_BOOTSTRAP_GROUPS = 5
+
+Interval = Tuple[float, float]
+
+
+def elimination_order(player_names: Sequence[str], shots: Iterable[Tuple[str, bool]]) -> List[str]:
+    """
+    按开枪结果得到淘汰顺序，存活到最后的玩家排在末尾
+
+    Args:
+        player_names: 本局的玩家
+        shots: 按轮次顺序的 (开枪者, 是否中弹)
+    """
+    alive = list(player_names)
+    order = []
+    for shooter, hit in shots:
+        if hit and shooter in alive:
+            alive.remove(shooter)
+            order.append(shooter)
+    return order + alive
+
+
+def record_elimination_order(record: Dict) -> List[str]:
+    """json游戏记录的淘汰顺序"""
+    return elimination_order(record["player_names"], [
+        (round["round_result"]["shooter_name"], round["round_result"]["bullet_hit"])
+        for round in record["rounds"] if round.get("round_result")
+    ])
+
+
+def survival_points(order: Sequence[str]) -> Dict[str, int]:
+    """存活积分：第一个淘汰的得0分，第二个得1分，以此类推（与 game_analyze 一致）"""
+    return {player: index for index, player in enumerate(order)}
+
+
+def wilson_interval(successes: int, n: int, confidence: float = 0.95) -> Interval:
+    """二项比例的Wilson置信区间，样本少或比例接近0/1时比正态近似可靠"""
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def bootstrap_interval(groups: Sequence[Sequence[float]], confidence: float = 0.95,
+                       resamples: int = DEFAULT_BOOTSTRAP_RESAMPLES, rng: Optional[random.Random] = None,
+                       bounds: Interval = (0.0, 1.0)) -> Interval:
+    """
+    均值的分组bootstrap百分位区间
+
+    以组为单位重抽样（复式赛中同一副发牌的几局相关，需要整组抽取），区间为重抽样均值的分位数。
+    组数少于 MIN_BOOTSTRAP_GROUPS 时重抽样几乎不变（只有一组时宽度为0），直接返回取值范围 bounds。
+
+    Args:
+        groups: 每组的取值
+        confidence: 置信水平
+        resamples: 重抽样次数
+        rng: 随机数生成器，默认固定种子使同样的数据得到同样的区间
+        bounds: 单个取值的范围
+    """
+    groups = [group for group in groups if group]
+    if len(groups) < MIN_BOOTSTRAP_GROUPS:
+        return bounds
+    rng = rng or random.Random(0)
+    sums = [sum(group) for group in groups]
+    counts = [len(group) for group in groups]
+    indices = range(len(groups))
+    means = []
+    for _ in range(resamples):
+        sample = rng.choices(indices, k=len(groups))
+        means.append(sum(sums[i] for i in sample) / sum(counts[i] for i in sample))
+    means.sort()
+    alpha = (1 - confidence) / 2
+    lower = means[min(len(means) - 1, int(alpha * len(means)))]
+    upper = means[min(len(means) - 1, int((1 - alpha) * len(means)))]
+    return lower, upper
+
+
+def confidence_sequence_radius(n: int, scale: float, alpha: float, tune_n: int) -> float:
+    """
+    均值的时间一致（always-valid）置信序列半径
+
+    观测值为独立的有界量，取值范围宽度不超过 2*scale（因此是 scale-次高斯的）。用正态混合边界
+    （Robbins）：对任意 n 同时成立 P(存在 n 使 |均值 - 真值| > 半径) <= alpha，
+    因此每批结果后都检查一次、随时停止，也不会使错误率超过 alpha。
+
+    Args:
+        n: 观测数
+        scale: 观测值取值范围的一半
+        alpha: 显著性水平
+        tune_n: 边界在该观测数附近最紧
+    """
+    if n <= 0:
+        return math.inf
+    variance = n * scale * scale
+    log_term = -2 * math.log(alpha)
+    rho = max(1, tune_n) * scale * scale / (log_term + math.log(log_term + 1))
+    return math.sqrt((variance + rho) * math.log((variance + rho) / (rho * alpha * alpha))) / n
+
+
+class TournamentStats:
+    """按已完成游戏的结果摘要增量统计各玩家的胜率和存活积分
+
+    摘要中的seed相同的游戏（复式赛的同一副发牌）归为一组：显示用的区间以组为单位bootstrap，
+    提前结束的判断比较每对玩家在同一组中的成绩差（复式赛中同一副牌各座位都打过一次，发牌的运气相互抵消）。
+    同时比较多名玩家时，每个区间的置信水平按玩家数（成对比较时按玩家对数）做Bonferroni修正。
+    """
+
+    def __init__(self, resamples: int = DEFAULT_BOOTSTRAP_RESAMPLES):
+        self.resamples = resamples
+        self.games = 0
+        self.played: Dict[str, int] = defaultdict(int)
+        self.wins: Dict[str, int] = defaultdict(int)
+        # 玩家 -> 组 -> 每局是否获胜
+        self.win_groups: Dict[str, Dict[object, List[float]]] = defaultdict(lambda: defaultdict(list))
+        # 玩家 -> 组 -> 每局的存活积分
+        self.points: Dict[str, Dict[object, List[float]]] = defaultdict(lambda: defaultdict(list))
+        # 组 -> 每局 {玩家: {"win_rate": 是否获胜, "points": 存活积分}}，用于成对比较
+        self.results: Dict[object, List[Dict[str, Dict[str, float]]]] = defaultdict(list)
+        # 单局中最多的玩家数，决定存活积分之差的取值范围
+        self.max_table = 2
+
+    def add(self, summary: Dict) -> None:
+        """加入一局已完成游戏的摘要"""
+        players = summary.get("players") or []
+        if not players or not summary.get("winner"):
+            return
+        self.games += 1
+        self.max_table = max(self.max_table, len(players))
+        group = summary.get("seed") if summary.get("seed") is not None else ("game", summary.get("game_num"))
+        points = survival_points(summary["eliminated"]) if summary.get("eliminated") else {}
+        result = {}
+        for player in players:
+            won = 1.0 if player == summary["winner"] else 0.0
+            self.played[player] += 1
+            self.win_groups[player][group].append(won)
+            result[player] = {"win_rate": won, "points": points.get(player)}
+            if player in points:
+                self.points[player][group].append(points[player])
+        self.wins[summary["winner"]] += 1
+        self.results[group].append(result)
+
+    def _interval_confidence(self, confidence: float, comparisons: Optional[int] = None) -> float:
+        return 1 - (1 - confidence) / max(1, comparisons if comparisons is not None else len(self.played))
+
+    def _win_rate_interval(self, player: str, level: float) -> Interval:
+        groups = list(self.win_groups[player].values())
+        if all(len(group) == 1 for group in groups):
+            return wilson_interval(self.wins[player], self.played[player], level)
+        # 复式赛同一副发牌的几局高度相关，按独立样本计算的Wilson区间偏窄，改为整组bootstrap
+        if len(groups) >= MIN_BOOTSTRAP_GROUPS:
+            return bootstrap_interval(groups, level, self.resamples)
+        # 组数太少时把每组的胜率当作一次观测计算Wilson区间（按组数而不是局数，偏保守）
+        return wilson_interval(sum(sum(group) / len(group) for group in groups), len(groups), level)
+
+    def standings(self, confidence: float = 0.95, metric: str = "win_rate") -> List[Dict]:
+        """
+        按metric从高到低排列的各玩家统计
+
+        Returns:
+            List[Dict]: 每名玩家的 games、wins、win_rate、points（平均存活积分）和所选指标的 interval
+        """
+        if metric not in STOP_METRICS:
+            raise ValueError(f"未知的排名指标: {metric}，可选: {', '.join(STOP_METRICS)}")
+        level = self._interval_confidence(confidence)
+        rows = []
+        for player, games in self.played.items():
+            groups = list(self.points[player].values())
+            point_count = sum(len(group) for group in groups)
+            row = {
+                "player": player,
+                "games": games,
+                "wins": self.wins[player],
+                "win_rate": self.wins[player] / games,
+                "points": sum(sum(group) for group in groups) / point_count if point_count else None,
+            }
+            if metric == "win_rate":
+                row["interval"] = self._win_rate_interval(player, level)
+            else:
+                row["interval"] = bootstrap_interval(groups, level, self.resamples, bounds=(0.0, self.max_table - 1.0))
+            rows.append(row)
+        rows.sort(key=lambda row: row[metric] if row[metric] is not None else -1, reverse=True)
+        return rows
+
+    def pairwise_differences(self, player: str, opponent: str, metric: str = "win_rate") -> List[float]:
+        """每组中两名玩家同桌的几局里 player 与 opponent 的成绩差的均值，每组一个值"""
+        differences = []
+        for games in self.results.values():
+            pairs = [
+                result[player][metric] - result[opponent][metric]
+                for result in games
+                if player in result and opponent in result
+                and result[player][metric] is not None and result[opponent][metric] is not None
+            ]
+            if pairs:
+                differences.append(sum(pairs) / len(pairs))
+        return differences
+
+    def better(self, player: str, opponent: str, confidence: float = 0.95, metric: str = "win_rate",
+               comparisons: int = 1, tune_n: int = 20) -> bool:
+        """
+        player 是否显著优于 opponent：成对成绩差均值的时间一致置信序列整体大于0
+
+        Args:
+            comparisons: 同时进行的成对比较数，用于Bonferroni修正
+            tune_n: 置信序列在该组数附近最紧
+        """
+        differences = self.pairwise_differences(player, opponent, metric)
+        if not differences:
+            return False
+        # 胜负之差在[-1, 1]内，存活积分之差在[-(人数-1), 人数-1]内
+        scale = 1.0 if metric == "win_rate" else self.max_table - 1
+        alpha = 1 - self._interval_confidence(confidence, comparisons)
+        mean = sum(differences) / len(differences)
+        return mean - confidence_sequence_radius(len(differences), scale, alpha, tune_n) > 0
+
+    def settled(self, confidence: float = 0.95, metric: str = "win_rate", target: str = "top1",
+                tune_n: int = 20) -> bool:
+        """
+        排名是否已经确定：top1 要求第一名显著优于其他每名玩家，ranking 要求每对相邻名次都显著有先后
+
+        比较的是每对玩家同组成绩差的时间一致置信序列，而不是各自的区间是否重叠：
+        置信序列对任意多次检查同时成立，并按所有玩家对做Bonferroni修正，
+        因此无论每批之后检查多少次，错误地提前结束的概率都不超过 1 - confidence。
+        """
+        if target not in STOP_TARGETS:
+            raise ValueError(f"未知的结束条件: {target}，可选: {', '.join(STOP_TARGETS)}")
+        if metric not in STOP_METRICS:
+            raise ValueError(f"未知的排名指标: {metric}，可选: {', '.join(STOP_METRICS)}")
+        source = self.win_groups if metric == "win_rate" else self.points
+        means = {}
+        for player in self.played:
+            values = [value for group in source[player].values() for value in group]
+            means[player] = sum(values) / len(values) if values else -1
+        players = sorted(means, key=means.get, reverse=True)
+        if len(players) < 2:
+            return False
+        comparisons = len(players) * (len(players) - 1) // 2
+
+        def better(upper: str, lower: str) -> bool:
+            return self.better(upper, lower, confidence, metric, comparisons, tune_n)
+
+        if target == "top1":
+            return all(better(players[0], player) for player in players[1:])
+        return all(better(upper, lower) for upper, lower in zip(players, players[1:]))